@@ -0,0 +1,381 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# FeatureExtraction and SongCollection modules import their siblings directly
+sys.path.append(os.path.join(ROOT_DIR, "FeatureExtraction"))
+sys.path.append(os.path.join(ROOT_DIR, "SongCollection"))
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from FeatureBuffer import FeatureBuffer
+from FeatureExtractor import FeatureExtractor
+
+
+def make_clip(seed, duration, sr):
+    """Generates a deterministic synthetic music-like clip: a few harmonic notes changing every half second, a decaying
+    percussive click on every beat and some noise
+
+    Args:
+        seed (int): seed of the clip
+        duration (float): duration in seconds
+        sr (int): Sampling Rate
+
+    Returns:
+        numpy array: float32 signal in [-1, 1]
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+
+    # Notes of the clip, one every half second
+    notes = 110 * 2 ** (rng.integers(0, 36, int(np.ceil(duration * 2))) / 12)
+    frequency = notes[(t * 2).astype(int)]
+    phase = 2 * np.pi * np.cumsum(frequency) / sr
+    signal = sum(np.sin(phase * harmonic) / harmonic for harmonic in range(1, 5))
+
+    # Clicks on every beat of a random tempo
+    beat = 60 / rng.uniform(70, 160)
+    signal += 2 * np.exp(-(t % beat) * 40) * rng.normal(size=len(t))
+
+    signal += 0.05 * rng.normal(size=len(t))
+    return (0.9 * signal / np.abs(signal).max()).astype(np.float32)
+
+
+class BenchmarkSuite:
+
+    def __init__(self, n_clips=8, duration=30, sample_rate=22050, source_rate=44100, repeats=5, frame_size=1024, hop_length=512, n_songs=10000):
+        """Times each stage of feature extraction and collection on its own, on deterministic synthetic audio
+
+        Args:
+            n_clips (int, optional): number of synthetic clips. Defaults to 8.
+            duration (float, optional): duration of each clip in seconds. Defaults to 30.
+            sample_rate (int, optional): Sampling Rate clips are decoded at. Defaults to 22050.
+            source_rate (int, optional): Sampling Rate clips are written at, so decoding includes resampling if different. Defaults to 44100.
+            repeats (int, optional): number of timed runs of each stage. Defaults to 5.
+            frame_size (int, optional): frame size of the extractor. Defaults to 1024.
+            hop_length (int, optional): hop length of the extractor. Defaults to 512.
+            n_songs (int, optional): number of songs of the synthetic catalog. Defaults to 10000.
+        """
+        self.n_clips = n_clips
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.source_rate = source_rate
+        self.repeats = repeats
+        self.n_songs = n_songs
+
+        self.extractor = FeatureExtractor(frame_size=frame_size, hop_length=hop_length, sample_rate=sample_rate, use_cache=False)
+        self.work_dir = None
+        self.results = {}
+
+    def _time(self, stage, function, items, unit):
+        """Runs a stage `repeats` times after a warm up run and records its timings
+
+        Args:
+            stage (str): name of the stage
+            function (callable): function running the stage once
+            items (float): amount of work done by one run, e.g. seconds of audio
+            unit (str): unit of `items`
+        """
+        function()
+
+        timings = []
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+        median = statistics.median(timings)
+        self.results[stage] = {
+            "median_s": median,
+            "min_s": min(timings),
+            "max_s": max(timings),
+            "repeats": self.repeats,
+            "throughput": items / median if median > 0 else None,
+            "unit": f"{unit}/s",
+        }
+        print(f"{stage:24s} {median * 1000:10.2f} ms  {self.results[stage]['throughput']:14.1f} {unit}/s")
+
+    def _skip(self, stage, reason):
+        """Records a stage that could not run
+
+        Args:
+            stage (str): name of the stage
+            reason (str): why it was skipped
+        """
+        self.results[stage] = {"skipped": reason}
+        print(f"{stage:24s} skipped: {reason}")
+
+    def _write_clips(self):
+        """Writes the synthetic clips as wav files
+
+        Returns:
+            list(str): path of each clip
+        """
+        paths = []
+        for i in range(self.n_clips):
+            path = os.path.join(self.work_dir, f"bench_{i:02d}_clip.wav")
+            sf.write(path, make_clip(i, self.duration, self.source_rate), self.source_rate)
+            paths.append(path)
+        return paths
+
+    def bench_extraction(self, paths):
+        """Times decoding, the STFT, each feature of the extractor and the whole per clip extraction
+
+        Args:
+            paths (list(str)): paths of the clips
+        """
+        fe = self.extractor
+        sr = self.sample_rate
+        audio_seconds = self.n_clips * self.duration
+
+        self._time("decode", lambda: [fe._load(path) for path in paths], audio_seconds, "audio seconds")
+
+        signals = np.stack([fe._load(path)[0] for path in paths])
+        magnitude = np.abs(librosa.stft(signals, n_fft=fe.frame_size, hop_length=fe.hop_length))
+        power_spectrogram = magnitude ** 2
+        mfcc_power_spectrogram = np.abs(librosa.stft(signals, n_fft=fe.mfcc_n_fft, hop_length=512)) ** 2
+
+        self._time("stft", lambda: librosa.stft(signals, n_fft=fe.frame_size, hop_length=fe.hop_length), audio_seconds, "audio seconds")
+        self._time("stft_mfcc", lambda: librosa.stft(signals, n_fft=fe.mfcc_n_fft, hop_length=512), audio_seconds, "audio seconds")
+        self._time("feature_ae", lambda: fe._amplitude_envelope(signals), audio_seconds, "audio seconds")
+        self._time("feature_rms", lambda: fe._root_mean_square(signals), audio_seconds, "audio seconds")
+        self._time("feature_zcr", lambda: fe._zero_crossing_rate(signals), audio_seconds, "audio seconds")
+        self._time("feature_ber", lambda: fe._calculate_band_enery_ratio(power_spectrogram, sr), audio_seconds, "audio seconds")
+        self._time("feature_sc_bw", lambda: fe._spectral_features(magnitude, sr), audio_seconds, "audio seconds")
+        self._time("feature_mfcc", lambda: fe._mfcc(mfcc_power_spectrogram, sr), audio_seconds, "audio seconds")
+
+        # Per clip extraction, as _extract_features_per_sample does after decoding
+        self._time("extract_per_clip", lambda: [fe._compute_features(signal, sr) for signal in signals], audio_seconds, "audio seconds")
+        self._time("extract_batch", lambda: fe.extract_features_batch(signals, sr), audio_seconds, "audio seconds")
+
+    def bench_rows(self, n_rows=10000):
+        """Times row accumulation and checkpointing of extracted rows
+
+        Args:
+            n_rows (int, optional): number of rows. Defaults to 10000.
+        """
+        columns = self.extractor.features[2:]
+        rows = np.random.default_rng(0).normal(size=(n_rows, len(columns))).astype(np.float32)
+        names = [f"{i % 100:02d} song {i}.mp3" for i in range(n_rows)]
+
+        def accumulate():
+            buffer = FeatureBuffer(columns)
+            for name, row in zip(names, rows):
+                buffer.append(name, "bench", row)
+            return buffer
+
+        self._time("row_accumulation", accumulate, n_rows, "rows")
+
+        buffer = accumulate()
+        checkpoint_dir = os.path.join(self.work_dir, "checkpoints")
+
+        def dump():
+            # Same as FeatureExtractor._dump_data with every row new, overwriting the same shard on every run
+            buffer.checkpointed = 0
+            buffer.n_shards = 0
+            buffer.checkpoint(checkpoint_dir)
+
+        self._time("dump_data", dump, n_rows, "rows")
+
+        self._time("merge_shards", lambda: FeatureBuffer.merge_shards(checkpoint_dir, os.path.join(self.work_dir, "data.csv"), remove=False), n_rows, "rows")
+
+    def bench_segmentation(self, paths):
+        """Times ffmpeg segmentation of a song, with the arguments of SongDownloader._segment_song
+
+        Args:
+            paths (list(str)): paths of the clips, concatenated into the song
+        """
+        if shutil.which("ffmpeg") is None:
+            self._skip("ffmpeg_segmentation", "ffmpeg not found")
+            return
+
+        song_path = os.path.join(self.work_dir, "song.mp3")
+        song = np.concatenate([sf.read(path, dtype="float32")[0] for path in paths])
+        sf.write(os.path.join(self.work_dir, "song.wav"), song, self.source_rate)
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "quiet", "-i", os.path.join(self.work_dir, "song.wav"), song_path], check=True)
+
+        segment_dir = os.path.join(self.work_dir, "segments")
+        os.makedirs(segment_dir, exist_ok=True)
+
+        def segment():
+            subprocess.run(["ffmpeg", "-y", "-i", song_path, "-c", "copy", "-f", "segment", "-segment_time", str(self.extractor.segment_duration),
+                            "-reset_timestamps", "1", os.path.join(segment_dir, "bench_%02d_song.mp4"), "-loglevel", "quiet"], check=True)
+
+        self._time("ffmpeg_segmentation", segment, len(song) / self.source_rate, "audio seconds")
+
+    def bench_catalog(self):
+        """Times reading song names and urls with APICall.get_song_name_url and importing a name_list.txt file
+        """
+        from APICall import APICall
+        from SongCatalog import SongCatalog
+
+        genres = [f"genre{i}" for i in range(10)]
+        catalog = SongCatalog(os.path.join(self.work_dir, "catalog.sqlite"))
+        for i, genre in enumerate(genres):
+            names = [f"{genre} song {j}" for j in range(self.n_songs // len(genres))]
+            catalog.add_songs(genre, names)
+            catalog.set_urls({name: f"https://www.youtube.com/watch?v=bench{i}_{j}" for j, name in enumerate(names)})
+
+        # Only the catalog of APICall is used, creating it normally would call Spotify
+        api_call = APICall.__new__(APICall)
+        api_call.genres = genres
+        api_call.catalog = catalog
+
+        self._time("get_song_name_url", api_call.get_song_name_url, self.n_songs, "songs")
+
+        text_path = os.path.join(self.work_dir, "name_list.txt")
+        catalog.export_text(text_path)
+
+        def import_text():
+            imported = SongCatalog(os.path.join(self.work_dir, "import.sqlite"))
+            imported.import_text(text_path)
+            imported.close()
+            os.remove(os.path.join(self.work_dir, "import.sqlite"))
+
+        self._time("name_list_import", import_text, self.n_songs, "songs")
+        catalog.close()
+
+    def run(self, stages=None):
+        """Runs the benchmarks
+
+        Args:
+            stages (list(str), optional): groups to run among `extraction`, `rows`, `segmentation` and `catalog`. Defaults to None (all).
+
+        Returns:
+            dict: environment and parameters under `meta`, timings of each stage under `results`
+        """
+        stages = stages or ["extraction", "rows", "segmentation", "catalog"]
+        self.results = {}
+        self.work_dir = tempfile.mkdtemp(prefix="genre_bench_")
+
+        try:
+            paths = self._write_clips()
+
+            if "extraction" in stages:
+                self.bench_extraction(paths)
+            if "rows" in stages:
+                self.bench_rows()
+            if "segmentation" in stages:
+                self.bench_segmentation(paths)
+            if "catalog" in stages:
+                self.bench_catalog()
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "librosa": librosa.__version__,
+                "numpy": np.__version__,
+                "params": {
+                    "n_clips": self.n_clips,
+                    "duration": self.duration,
+                    "sample_rate": self.sample_rate,
+                    "source_rate": self.source_rate,
+                    "repeats": self.repeats,
+                    "frame_size": self.extractor.frame_size,
+                    "hop_length": self.extractor.hop_length,
+                    "n_songs": self.n_songs,
+                },
+            },
+            "results": self.results,
+        }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Compares timings against a baseline
+
+    Args:
+        report (dict): result of BenchmarkSuite.run
+        baseline (dict): previous result of BenchmarkSuite.run
+        tolerance (float, optional): relative slowdown of the median allowed before flagging a regression. Defaults to 0.2.
+
+    Returns:
+        dict: stage as key and baseline median, current median, ratio and whether it regressed as value, for stages in both
+    """
+    comparison = {}
+
+    for stage, result in report["results"].items():
+        previous = baseline["results"].get(stage)
+        if previous is None or "median_s" not in result or "median_s" not in previous:
+            continue
+
+        ratio = result["median_s"] / previous["median_s"] if previous["median_s"] > 0 else float("inf")
+        comparison[stage] = {
+            "baseline_s": previous["median_s"],
+            "current_s": result["median_s"],
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance,
+        }
+
+    return comparison
+
+
+def main():
+    benchmark_dir = os.path.dirname(os.path.realpath(__file__))
+
+    parser = argparse.ArgumentParser(description="Times feature extraction and collection stages on synthetic audio")
+    parser.add_argument("--output", default=os.path.join(benchmark_dir, "results.json"), help="file the results are written to")
+    parser.add_argument("--baseline", default=os.path.join(benchmark_dir, "baseline.json"), help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown flagged as a regression")
+    parser.add_argument("--stages", nargs="*", choices=["extraction", "rows", "segmentation", "catalog"])
+    parser.add_argument("--clips", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--frame-size", type=int, default=1024)
+    parser.add_argument("--hop-length", type=int, default=512)
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(n_clips=args.clips, duration=args.duration, repeats=args.repeats, frame_size=args.frame_size, hop_length=args.hop_length)
+    report = suite.run(args.stages)
+
+    regressions = []
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline["meta"]["params"] != report["meta"]["params"]:
+            print("Warning: baseline was run with different parameters")
+        # The committed baseline was measured on one machine, timings of another machine are only comparable to its own baseline
+        if any(baseline["meta"][key] != report["meta"][key] for key in ("platform", "cpu_count", "librosa", "numpy")):
+            print("Warning: baseline was run on another machine or library versions, refresh it with --save-baseline")
+
+        report["comparison"] = compare(report, baseline, args.tolerance)
+        print(f"\nCompared to baseline of {baseline['meta']['timestamp']}")
+        for stage, entry in report["comparison"].items():
+            flag = "REGRESSION" if entry["regression"] else ""
+            print(f"{stage:24s} {entry['ratio']:6.2f}x {flag}")
+            if entry["regression"]:
+                regressions.append(stage)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+
+    # Non zero exit code so that a regression fails a CI job
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
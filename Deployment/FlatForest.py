@@ -0,0 +1,327 @@
+import json
+import math
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+# Version of the exported layout, stored in meta.json
+FORMAT_VERSION = 1
+
+
+class FlatScaler:
+
+    def __init__(self, mean, scale):
+        """StandardScaler.transform with the same operations and dtypes, from exported mean and scale
+
+        Args:
+            mean (numpy array): mean of each feature
+            scale (numpy array): standard deviation of each feature
+        """
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float32 if np.asarray(X).dtype == np.float32 else np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class FlatForest:
+
+    def __init__(self, model_dir):
+        """Tree ensemble evaluated from flat node arrays written by `export`, memory mapped so that loading costs milliseconds
+        whatever the number of trees. All trees are walked at once, one level per step, with vectorized numpy indexing.
+
+        Random forests give the same probabilities as RandomForestClassifier.predict_proba with n_jobs=1, trees being summed in the
+        same order. XGBoost models give the same predictions, probabilities being equal up to float32 rounding of the margins
+
+        Args:
+            model_dir (str): directory written by `export`
+        """
+        with open(os.path.join(model_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported model version {self.meta['version']}")
+
+        def load(name):
+            return np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.kind = self.meta["kind"]
+        self.classes_ = np.array(self.meta["classes"])
+        self.max_depth = self.meta["max_depth"]
+
+        self.roots = np.asarray(load("roots"))
+        self.feature = load("feature")
+        self.threshold = load("threshold")
+        self.left = load("left")
+        self.right = load("right")
+        self.value = load("value")
+
+        if self.kind == "xgb":
+            self.default_left = load("default_left")
+            self.tree_class = np.asarray(load("tree_class"))
+
+    def apply(self, X):
+        """Finds the leaf every row reaches in every tree
+
+        Args:
+            X (numpy array): features of shape (n_rows, n_features)
+
+        Returns:
+            numpy array: node index of the leaves of shape (n_trees, n_rows)
+        """
+        nodes = np.repeat(self.roots[:, np.newaxis], len(X), axis=1)
+        rows = np.arange(len(X))[np.newaxis, :]
+
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            inner = feature >= 0
+            if not inner.any():
+                break
+
+            x = X[rows, np.where(inner, feature, 0)]
+            threshold = self.threshold[nodes]
+
+            if self.kind == "xgb":
+                # XGBoost goes left on x < threshold and sends missing values to the default side
+                go_left = np.where(np.isnan(x), self.default_left[nodes], x < threshold)
+            else:
+                go_left = x <= threshold
+
+            nodes = np.where(inner, np.where(go_left, self.left[nodes], self.right[nodes]), nodes)
+
+        return nodes
+
+    def predict_proba(self, X):
+        """Computes class probabilities
+
+        Args:
+            X (numpy array): features of shape (n_rows, n_features)
+
+        Returns:
+            numpy array: probability of each class of shape (n_rows, n_classes)
+        """
+        # Both libraries evaluate trees on float32 features
+        X = np.asarray(X, dtype=np.float32)
+        leaves = self.apply(X)
+
+        if self.kind == "rf":
+            # Summing along the first axis adds trees one after the other, like the forest does
+            return np.add.reduce(self.value[leaves], axis=0) / len(self.roots)
+
+        # Margins start at the base margin and add the trees of their output one after the other in float32, like XGBoost does
+        leaf_values = self.value[leaves]
+        base = np.full((1, len(X)), self.meta["base_margin"], dtype=np.float32)
+        margins = np.column_stack([
+            np.add.reduce(np.concatenate([base, leaf_values[self.tree_class == output]]), axis=0)
+            for output in range(self.meta["n_outputs"])
+        ])
+
+        if self.meta["n_outputs"] == 1:
+            positive = 1 / (1 + np.exp(-margins[:, 0].astype(np.float64)))
+            return np.column_stack([1 - positive, positive])
+
+        exponents = np.exp(margins.astype(np.float64) - margins.max(axis=1, keepdims=True))
+        return exponents / exponents.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        """Predicts classes
+
+        Args:
+            X (numpy array): features of shape (n_rows, n_features)
+
+        Returns:
+            numpy array: predicted class of each row
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    @staticmethod
+    def _flatten_sklearn(model):
+        """Concatenates the node arrays of the trees of a RandomForestClassifier
+
+        Args:
+            model (RandomForestClassifier): fitted single output forest
+
+        Returns:
+            dict: node arrays and metadata
+        """
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+        def children(tree, offset, side):
+            # Leaves keep -1
+            return np.where(side >= 0, side + offset, -1)
+
+        value = []
+        for tree in trees:
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            counts = tree.value[:, 0, :]
+            normalizer = counts.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0] = 1
+            value.append(counts / normalizer)
+
+        return {
+            "arrays": {
+                "roots": offsets[:-1].astype(np.int32),
+                "feature": np.concatenate([tree.feature for tree in trees]).astype(np.int32),
+                "threshold": np.concatenate([tree.threshold for tree in trees]),
+                "left": np.concatenate([children(tree, offset, tree.children_left) for tree, offset in zip(trees, offsets)]).astype(np.int32),
+                "right": np.concatenate([children(tree, offset, tree.children_right) for tree, offset in zip(trees, offsets)]).astype(np.int32),
+                "value": np.concatenate(value),
+            },
+            "meta": {
+                "kind": "rf",
+                "classes": model.classes_.tolist(),
+                "max_depth": max(tree.max_depth for tree in trees),
+            },
+        }
+
+    @staticmethod
+    def _flatten_xgboost(model):
+        """Concatenates the node arrays of the trees of an XGBClassifier
+
+        Args:
+            model (XGBClassifier): fitted classifier
+
+        Returns:
+            dict: node arrays and metadata
+        """
+        learner = json.loads(model.get_booster().save_raw("json"))["learner"]
+        trees = learner["gradient_booster"]["model"]["trees"]
+        objective = learner["objective"]["name"]
+        base_score = float(learner["learner_model_param"]["base_score"])
+        n_outputs = max(1, int(learner["learner_model_param"]["num_class"]))
+
+        if objective not in ("binary:logistic", "multi:softprob", "multi:softmax"):
+            raise ValueError(f"Unsupported objective {objective}")
+
+        offsets = np.cumsum([0] + [len(tree["left_children"]) for tree in trees])
+
+        def depth(tree):
+            depths = np.zeros(len(tree["left_children"]), dtype=np.int64)
+            for node, (left, right) in enumerate(zip(tree["left_children"], tree["right_children"])):
+                if left >= 0:
+                    depths[left] = depths[right] = depths[node] + 1
+            return int(depths.max())
+
+        feature, threshold, left, right, default_left, value = [], [], [], [], [], []
+        for tree, offset in zip(trees, offsets):
+            is_leaf = np.array(tree["left_children"]) < 0
+            conditions = np.array(tree["split_conditions"], dtype=np.float32)
+
+            feature.append(np.where(is_leaf, -2, tree["split_indices"]))
+            threshold.append(np.where(is_leaf, 0, conditions))
+            left.append(np.where(is_leaf, -1, np.array(tree["left_children"]) + offset))
+            right.append(np.where(is_leaf, -1, np.array(tree["right_children"]) + offset))
+            default_left.append(np.array(tree["default_left"], dtype=bool))
+            # Leaves keep their value in split_conditions
+            value.append(np.where(is_leaf, conditions, 0))
+
+        # Binary models keep base_score as a probability
+        base_margin = math.log(base_score / (1 - base_score)) if objective == "binary:logistic" else base_score
+
+        return {
+            "arrays": {
+                "roots": offsets[:-1].astype(np.int32),
+                "feature": np.concatenate(feature).astype(np.int32),
+                "threshold": np.concatenate(threshold).astype(np.float32),
+                "left": np.concatenate(left).astype(np.int32),
+                "right": np.concatenate(right).astype(np.int32),
+                "default_left": np.concatenate(default_left),
+                "value": np.concatenate(value).astype(np.float32),
+                "tree_class": np.array(learner["gradient_booster"]["model"]["tree_info"], dtype=np.int32),
+            },
+            "meta": {
+                "kind": "xgb",
+                "classes": model.classes_.tolist(),
+                "max_depth": max(depth(tree) for tree in trees),
+                "n_outputs": n_outputs,
+                "base_margin": base_margin,
+            },
+        }
+
+    @staticmethod
+    def export(model_path, model_dir):
+        """Flattens a pickled RandomForestClassifier or XGBClassifier in an artifact dict written by ML/Trainer.py into a directory
+        of arrays. Scaler, columns and labels of the artifact are exported next to the trees, bare models without a scaler are rejected
+
+        Args:
+            model_path (str): path of the pickled model or artifact
+            model_dir (str): directory to write
+
+        Returns:
+            str: directory of the exported model
+        """
+        with open(model_path, "rb") as f:
+            artifact = pickle.load(f)
+        if not isinstance(artifact, dict) or artifact.get("scaler") is None:
+            raise ValueError(f"{model_path} has no scaler, train with ML/Trainer.py or pickle {{\"model\": model, \"scaler\": scaler}} instead of the bare model")
+
+        model = artifact["model"]
+        if hasattr(model, "estimators_"):
+            flat = FlatForest._flatten_sklearn(model)
+        elif hasattr(model, "get_booster"):
+            flat = FlatForest._flatten_xgboost(model)
+        else:
+            raise ValueError(f"Can not flatten {type(model).__name__}")
+
+        arrays, meta = flat["arrays"], flat["meta"]
+        meta["version"] = FORMAT_VERSION
+
+        columns = artifact.get("columns")
+        if columns is None and hasattr(model, "feature_names_in_"):
+            columns = model.feature_names_in_
+        meta["columns"] = None if columns is None else [str(column) for column in columns]
+        meta["labels"] = None if artifact.get("labels") is None else [str(label) for label in artifact["labels"]]
+
+        arrays["scaler_mean"] = artifact["scaler"].mean_
+        arrays["scaler_scale"] = artifact["scaler"].scale_
+
+        temporary_dir = model_dir + ".tmp"
+        if os.path.isdir(temporary_dir):
+            shutil.rmtree(temporary_dir)
+        os.makedirs(temporary_dir)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(temporary_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+
+        if os.path.isdir(model_dir):
+            shutil.rmtree(model_dir)
+        os.replace(temporary_dir, model_dir)
+
+        return model_dir
+
+    @staticmethod
+    def load_artifact(model_dir):
+        """Loads an exported model as an artifact dict, as GenreClassifier expects
+
+        Args:
+            model_dir (str): directory written by `export`
+
+        Returns:
+            dict: model, and scaler, columns and labels if they were exported
+        """
+        model = FlatForest(model_dir)
+
+        scaler = None
+        if os.path.isfile(os.path.join(model_dir, "scaler_mean.npy")):
+            scaler = FlatScaler(np.load(os.path.join(model_dir, "scaler_mean.npy")), np.load(os.path.join(model_dir, "scaler_scale.npy")))
+
+        return {"model": model, "scaler": scaler, "columns": model.meta["columns"], "labels": model.meta["labels"]}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Flattens a pickled forest into memory mappable arrays")
+    parser.add_argument("model", help="pickled artifact, e.g. ML/genre_model.pkl")
+    parser.add_argument("output", help="directory to write, e.g. ML/model_flat")
+    args = parser.parse_args()
+
+    print(f"Exported to {FlatForest.export(args.model, args.output)}")
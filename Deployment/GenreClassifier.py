@@ -0,0 +1,95 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Columns the model of ML/model.ipynb was trained on, every feature except the Band Energy Ratio
+DEFAULT_COLUMNS = [
+    f"{name}_{stat}"
+    for name in ["AE", "RMS", "ZCR", "SC", "BW", *[f"MFCC{n}" for n in range(13)]]
+    for stat in ["Mean", "Std"]
+]
+
+
+class GenreClassifier:
+
+    def __init__(self, model_path, feature_names=None, labels=None):
+        """Genre classifier loaded once from a pickled artifact. The artifact is a dict with `model`, `scaler` and optionally `columns`
+        and `labels` as written by ML/Trainer.py, or a directory written by FlatForest.export. Bare models, like the `model_pkl` written
+        by ML/model.ipynb, are rejected: they were trained on scaled features and predict wrong genres on unscaled ones
+
+        Args:
+            model_path (str): path of the pickled artifact or of the exported model directory
+            feature_names (list(str), optional): name of each column of the feature rows given to predict_proba, e.g. `FeatureExtractor.features[2:]`.
+                Defaults to None (rows have the columns of the model in its order, e.g. from a FeatureExtractor given `columns=classifier.columns`).
+            labels (list(str), optional): genre of each class of the model, used if the artifact has none. Defaults to None (classes of the model).
+        """
+        # Directory written by FlatForest.export, or pickle file
+        if os.path.isdir(model_path):
+            from FlatForest import FlatForest
+            artifact = FlatForest.load_artifact(model_path)
+        else:
+            with open(model_path, "rb") as f:
+                artifact = pickle.load(f)
+
+        if not isinstance(artifact, dict) or artifact.get("scaler") is None:
+            raise ValueError(f"{model_path} has no scaler, train with ML/Trainer.py or pickle {{\"model\": model, \"scaler\": scaler}} instead of the bare model")
+
+        self.model = artifact["model"]
+        self.scaler = artifact["scaler"]
+
+        # Columns the model expects, in order
+        columns = artifact.get("columns")
+        if columns is None:
+            columns = getattr(self.model, "feature_names_in_", None)
+        if columns is None:
+            columns = DEFAULT_COLUMNS
+        self.columns = [str(column) for column in columns]
+
+        if feature_names is None:
+            feature_names = self.columns
+
+        missing = [column for column in self.columns if column not in feature_names]
+        if missing:
+            raise ValueError(f"Model expects features that are not extracted: {missing}")
+        self.column_indices = np.array([list(feature_names).index(column) for column in self.columns])
+
+        # Genre of each class, LabelEncoder codes are used as is if no names are known
+        if artifact.get("labels") is not None:
+            labels = artifact["labels"]
+        if labels is None:
+            labels = self.model.classes_
+        self.labels = [str(label) for label in labels]
+
+        if len(self.labels) != len(self.model.classes_):
+            raise ValueError(f"Got {len(self.labels)} labels for a model of {len(self.model.classes_)} classes")
+
+    def predict_proba(self, rows):
+        """Computes genre probabilities of feature rows
+
+        Args:
+            rows (numpy array): feature rows of shape (n_rows, n_features), columns in the order of `feature_names`
+
+        Returns:
+            numpy array: probability of each genre, of shape (n_rows, n_genres)
+        """
+        X = np.asarray(rows)[:, self.column_indices]
+
+        X = self.scaler.transform(self._as_input(self.scaler, X))
+
+        return self.model.predict_proba(self._as_input(self.model, X))
+
+    def _as_input(self, estimator, X):
+        """Names the columns of X if the estimator was fitted on a DataFrame, as the notebook does
+
+        Args:
+            estimator (estimator): fitted scaler or model
+            X (numpy array): features
+
+        Returns:
+            numpy array or DataFrame: features in the form the estimator was fitted on
+        """
+        if hasattr(estimator, "feature_names_in_"):
+            return pd.DataFrame(X, columns=self.columns)
+        return X
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# FeatureExtraction modules import their siblings directly
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "FeatureExtraction"))
+
+import JitCache
+from FeatureExtractor import FeatureExtractor
+from GenreClassifier import GenreClassifier
+from MicroBatcher import MicroBatcher
+
+
+class LatencyStats:
+
+    def __init__(self, window=10000):
+        """Latency and throughput of the latest requests
+
+        Args:
+            window (int, optional): number of latest requests percentiles are computed on. Defaults to 10000.
+        """
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, seconds, error=False):
+        """Records a request
+
+        Args:
+            seconds (float): time spent answering the request
+            error (bool, optional): whether the request failed. Defaults to False.
+        """
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            else:
+                self._latencies.append(seconds)
+
+    def summary(self):
+        """Summarizes recorded requests
+
+        Returns:
+            dict: number of requests and errors, p50 and p99 latency in milliseconds and requests per second since start
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            requests, errors = self.requests, self.errors
+
+        elapsed = time.monotonic() - self.started
+        p50, p99 = (float(p) * 1000 for p in np.percentile(latencies, [50, 99])) if len(latencies) else (None, None)
+
+        return {
+            "requests": requests,
+            "errors": errors,
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "throughput_rps": requests / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class InferenceService:
+
+    def __init__(self, model_path, labels=None, host="127.0.0.1", port=8000, max_batch_size=64, max_wait_ms=5, segment_duration=30,
+                 res_type="kaiser_fast", n_extract_threads=None):
+        """Local HTTP service classifying the genre of songs. The model is loaded once, features of each song are computed by
+        FeatureExtractor from every `segment_duration` second segment, and the segments of concurrent requests are predicted
+        together in a single `predict_proba` call. The genre of a song is the one with highest mean probability over its segments
+
+        Endpoints:
+            POST /predict    raw audio file as body (`X-Filename` header or `?format=` gives its extension, wav by default),
+                             or JSON `{"path": "<audio file path>"}`
+            GET  /stats      p50/p99 latency, throughput and batching statistics
+            GET  /health     ok once the model is loaded
+
+        Args:
+            model_path (str): path of the pickled model, see GenreClassifier
+            labels (list(str), optional): genre of each class of the model, if the model file has none. Defaults to None.
+            host (str, optional): address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): port to listen on, 0 picks a free port. Defaults to 8000.
+            max_batch_size (int, optional): maximum number of segments predicted at once. Defaults to 64.
+            max_wait_ms (float, optional): milliseconds a request waits for others to share its batch. Defaults to 5.
+            segment_duration (int, optional): duration in seconds of the segments the model was trained on. Defaults to 30.
+            res_type (str, optional): resampler used when loading songs. Defaults to "kaiser_fast".
+            n_extract_threads (int, optional): number of requests computing features at once. Defaults to None (number of CPUs).
+        """
+        self.classifier = GenreClassifier(model_path, labels=labels)
+
+        # Only the columns the model uses are extracted
+        self.extractor = FeatureExtractor(segment_duration=segment_duration, use_cache=False, res_type=res_type, columns=self.classifier.columns)
+        self.batcher = MicroBatcher(self.classifier.predict_proba, max_batch_size, max_wait_ms / 1000)
+        self.stats = LatencyStats()
+
+        # Feature extraction is CPU bound, more concurrent extractions than CPUs only add latency
+        self._extract_slots = threading.Semaphore(n_extract_threads or os.cpu_count() or 1)
+
+        self.server = ThreadingHTTPServer((host, port), _RequestHandler)
+        self.server.daemon_threads = True
+        self.server.service = self
+
+    @property
+    def address(self):
+        """(str, int): host and port the service listens on
+        """
+        return self.server.server_address[:2]
+
+    def warmup(self):
+        """Runs one prediction on a second of noise, so that the first request does not pay for JIT compilation
+        """
+        sr = self.extractor.sample_rate
+        signal = np.random.default_rng(0).uniform(-0.5, 0.5, sr).astype(np.float32)
+        self.classify_signal(signal, sr)
+
+    def classify_signal(self, signal, sr):
+        """Classifies a decoded song
+
+        Args:
+            signal (numpy array): audio signal
+            sr (int): Sampling Rate of the signal
+
+        Raises:
+            ValueError: If the signal is shorter than a frame
+
+        Returns:
+            dict: predicted genre, probability of each genre and number of segments
+        """
+        with self._extract_slots:
+            rows = self.extractor.extract_signal(signal, sr)
+
+        if not len(rows):
+            raise ValueError("Audio is too short")
+
+        probabilities = self.batcher.submit(rows).mean(axis=0)
+
+        return {
+            "genre": self.classifier.labels[int(np.argmax(probabilities))],
+            "probabilities": dict(zip(self.classifier.labels, probabilities.tolist())),
+            "segments": len(rows),
+        }
+
+    def classify_path(self, song_path):
+        """Classifies an audio file
+
+        Args:
+            song_path (str): path of the audio file
+
+        Returns:
+            dict: see classify_signal
+        """
+        with self._extract_slots:
+            signal, sr = self.extractor._load(song_path)
+
+        return self.classify_signal(signal, sr)
+
+    def classify_bytes(self, data, extension="wav"):
+        """Classifies an uploaded audio file
+
+        Args:
+            data (bytes): content of the audio file
+            extension (str, optional): extension of the file, used to pick its decoder. Defaults to "wav".
+
+        Returns:
+            dict: see classify_signal
+        """
+        # Decoders of compressed formats need a file path
+        with tempfile.NamedTemporaryFile(suffix=f".{extension}", delete=False) as f:
+            f.write(data)
+
+        try:
+            return self.classify_path(f.name)
+        finally:
+            os.remove(f.name)
+
+    def get_stats(self):
+        """Returns latency, throughput and batching statistics
+
+        Returns:
+            dict: statistics of the service
+        """
+        stats = self.stats.summary()
+        stats["batching"] = self.batcher.get_stats()
+
+        return stats
+
+    def serve_forever(self):
+        """Answers requests till shutdown is called
+        """
+        self.server.serve_forever()
+
+    def start(self):
+        """Answers requests from a background thread
+
+        Returns:
+            threading.Thread: thread running the server
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """Stops answering requests and closes the socket
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+
+        if self.path == "/health":
+            self._send_json({"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(service.get_stats())
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        service = self.server.service
+        path, _, query = self.path.partition("?")
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path != "/predict":
+            self._send_json({"error": "not found"}, 404)
+            return
+
+        start = time.perf_counter()
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                result = service.classify_path(json.loads(body)["path"])
+            else:
+                params = dict(param.partition("=")[::2] for param in query.split("&") if param)
+                extension = params.get("format") or os.path.splitext(self.headers.get("X-Filename", ""))[1].lstrip(".") or "wav"
+                result = service.classify_bytes(body, extension)
+        except Exception as e:
+            service.stats.record(time.perf_counter() - start, error=True)
+            self._send_json({"error": repr(e)}, 400)
+            return
+
+        latency = time.perf_counter() - start
+        service.stats.record(latency)
+
+        result["latency_ms"] = latency * 1000
+        self._send_json(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves genre predictions of songs over HTTP")
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "ML", "genre_model.pkl"),
+                        help="pickled model, see GenreClassifier")
+    parser.add_argument("--labels", default=None, help="comma separated genre of each class, if the model file has none")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    # Resampling kernels are loaded from the disk cache instead of being compiled, see JitCache.enable
+    JitCache.enable()
+
+    labels = args.labels.split(",") if args.labels else None
+    service = InferenceService(args.model, labels, args.host, args.port, args.max_batch_size, args.max_wait_ms)
+    service.warmup()
+
+    host, port = service.address
+    print(f"Serving on http://{host}:{port}")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
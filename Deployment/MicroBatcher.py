@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class _Request:
+
+    def __init__(self, rows):
+        """Rows of a request waiting for their prediction
+
+        Args:
+            rows (numpy array): feature rows of the request
+        """
+        self.rows = rows
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+
+    def __init__(self, predict, max_batch_size=64, max_wait=0.005):
+        """Groups rows of concurrent requests into a single call of `predict`. A batch is sent as soon as it holds `max_batch_size`
+        rows or its first request waited `max_wait` seconds, so a lone request is delayed by at most `max_wait`
+
+        Args:
+            predict (callable): predict(rows) -> one result row per input row, e.g. GenreClassifier.predict_proba
+            max_batch_size (int, optional): maximum number of rows sent at once. A request with more rows is sent alone. Defaults to 64.
+            max_wait (float, optional): seconds the first request of a batch waits for others. Defaults to 0.005.
+        """
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._requests = queue.Queue()
+        # Request that did not fit in the previous batch, it starts the next one
+        self._carried = None
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "requests": 0, "rows": 0}
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, rows):
+        """Predicts rows, blocking till the batch they were sent in is done
+
+        Args:
+            rows (numpy array): feature rows of shape (n_rows, n_features)
+
+        Returns:
+            numpy array: result of each row
+        """
+        request = _Request(rows)
+        self._requests.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def get_stats(self):
+        """Returns batching statistics
+
+        Returns:
+            dict: number of batches, requests and rows predicted, and mean number of rows per batch
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats["mean_batch_rows"] = stats["rows"] / stats["batches"] if stats["batches"] else 0.0
+
+        return stats
+
+    def _collect(self):
+        """Waits for a request and gathers the requests arriving within `max_wait` after it
+
+        Returns:
+            list(_Request): requests of the batch
+        """
+        if self._carried is not None:
+            batch, self._carried = [self._carried], None
+        else:
+            batch = [self._requests.get()]
+        n_rows = len(batch[0].rows)
+        deadline = time.monotonic() + self.max_wait
+
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if n_rows + len(request.rows) > self.max_batch_size:
+                self._carried = request
+                break
+
+            batch.append(request)
+            n_rows += len(request.rows)
+
+        return batch
+
+    def _run(self):
+        """Sends batches to `predict` and hands every request its rows of the result
+        """
+        while True:
+            batch = self._collect()
+
+            try:
+                results = self.predict(np.concatenate([request.rows for request in batch]))
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            start = 0
+            for request in batch:
+                request.result = results[start:start + len(request.rows)]
+                start += len(request.rows)
+                request.done.set()
+
+            with self._lock:
+                self.stats["batches"] += 1
+                self.stats["requests"] += len(batch)
+                self.stats["rows"] += start
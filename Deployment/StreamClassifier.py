@@ -0,0 +1,120 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# FeatureExtraction modules import their siblings directly
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "FeatureExtraction"))
+
+import JitCache
+from FeatureExtractor import FeatureExtractor
+from GenreClassifier import GenreClassifier
+from StreamingExtractor import StreamingExtractor
+
+
+class StreamClassifier:
+
+    def __init__(self, model_path, labels=None, window_duration=30, chunk_duration=1.0):
+        """Classifies the genre of audio of any length, e.g. hour long mixes or live streams, with constant memory. Audio is decoded
+        chunk by chunk and features are kept as running moments, a prediction is made for every window and for the whole stream on demand
+
+        Args:
+            model_path (str): path of the pickled model, see GenreClassifier
+            labels (list(str), optional): genre of each class of the model, if the model file has none. Defaults to None.
+            window_duration (float, optional): seconds of audio per prediction, the segment duration the model was trained on. Defaults to 30.
+            chunk_duration (float, optional): seconds of audio decoded at once. Defaults to 1.0.
+        """
+        self.classifier = GenreClassifier(model_path, labels=labels)
+        self.extractor = FeatureExtractor(segment_duration=window_duration, use_cache=False, columns=self.classifier.columns)
+        self.stream = StreamingExtractor(self.extractor, window_duration)
+        self.chunk_duration = chunk_duration
+
+    def _predict(self, features):
+        """Predicts the genre of features
+
+        Args:
+            features (numpy array): features of the extractor, in the column order of the model
+
+        Returns:
+            dict: predicted genre and probability of each genre
+        """
+        probabilities = self.classifier.predict_proba(features[np.newaxis])[0]
+
+        return {
+            "genre": self.classifier.labels[int(np.argmax(probabilities))],
+            "probabilities": dict(zip(self.classifier.labels, probabilities.tolist())),
+        }
+
+    def _predict_windows(self, windows):
+        """Predicts the genre of completed windows
+
+        Args:
+            windows (list((float, float, numpy array))): start, end and features of each window
+
+        Yields:
+            dict: start and end in seconds, predicted genre and probability of each genre of each window
+        """
+        for start, end, features in windows:
+            yield {"start": start, "end": end, **self._predict(features)}
+
+    def classify_chunks(self, chunks):
+        """Classifies a stream given as chunks of samples
+
+        Args:
+            chunks (iterable): mono float32 samples at the sampling rate of the extractor
+
+        Yields:
+            dict: prediction of each window, as soon as it is complete
+        """
+        self.stream.reset()
+
+        for chunk in chunks:
+            yield from self._predict_windows(self.stream.feed(chunk))
+        yield from self._predict_windows(self.stream.flush())
+
+    def classify(self, song_path):
+        """Classifies an audio file or stream decoded by ffmpeg
+
+        Args:
+            song_path (str): path or url of the audio, `-` reads it from standard input
+
+        Yields:
+            dict: prediction of each window, as soon as it is complete
+        """
+        chunks = StreamingExtractor.iter_chunks(song_path, self.extractor.sample_rate, self.chunk_duration)
+        yield from self.classify_chunks(chunks)
+
+    def predict(self):
+        """Predicts the genre of the whole stream fed so far, can be called at any time
+
+        Returns:
+            dict: seconds of audio seen, predicted genre and probability of each genre
+        """
+        return {"seconds": self.stream.samples_seen / self.extractor.sample_rate, **self._predict(self.stream.features())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints the genre of every window of a song, stream or mix")
+    parser.add_argument("song", help="path or url of the audio, - reads it from standard input")
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "ML", "genre_model.pkl"),
+                        help="pickled model, see GenreClassifier")
+    parser.add_argument("--labels", default=None, help="comma separated genre of each class, if the model file has none")
+    parser.add_argument("--window", type=float, default=30, help="seconds of audio per prediction")
+    args = parser.parse_args()
+
+    # Resampling kernels are loaded from the disk cache instead of being compiled, see JitCache.enable
+    JitCache.enable()
+
+    labels = args.labels.split(",") if args.labels else None
+    classifier = StreamClassifier(args.model, labels, args.window)
+
+    for window in classifier.classify(args.song):
+        print(f"{window['start']:8.1f}s - {window['end']:8.1f}s  {window['genre']}", flush=True)
+
+    overall = classifier.predict()
+    print(f"Whole stream ({overall['seconds']:.1f}s): {overall['genre']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Version of the dataset layout, stored in schema.json
+FORMAT_VERSION = 1
+
+
+class ColumnarWriter:
+
+    def __init__(self, dataset_dir, columns):
+        """Writes a columnar feature dataset, one raw float32 file per feature column, genre as int16 codes into a list of categories
+        and names as utf-8 bytes with the offset of each name. Rows can be written in any number of batches, the dataset is written
+        next to `dataset_dir` and only replaces it on close, so readers never see a partial dataset
+
+        Args:
+            dataset_dir (str): directory of the dataset
+            columns (list(str)): name of each feature column
+        """
+        self.dataset_dir = dataset_dir
+        self.columns = list(columns)
+        self.n_rows = 0
+        self.categories = {}
+
+        self._temporary_dir = dataset_dir + ".tmp"
+        if os.path.isdir(self._temporary_dir):
+            shutil.rmtree(self._temporary_dir)
+        os.makedirs(self._temporary_dir)
+
+        self._files = {column: open(self._path(f"{column}.f32"), "wb") for column in self.columns}
+        self._genre_file = open(self._path("Genre.i16"), "wb")
+        self._name_file = open(self._path("Name.utf8"), "wb")
+        self._offset_file = open(self._path("Name.offsets.i64"), "wb")
+
+        # Offset of the end of each name, the first name starting at 0
+        self._name_offset = 0
+        self._offset_file.write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def _path(self, file_name):
+        return os.path.join(self._temporary_dir, file_name)
+
+    def write(self, names, genres, values):
+        """Appends rows
+
+        Args:
+            names (list(str)): Song Names
+            genres (list(str)): Genre of each song
+            values (numpy array): features of each song of shape (n_songs, n_columns)
+        """
+        values = np.asarray(values, dtype=np.float32).reshape(len(names), len(self.columns))
+
+        for i, column in enumerate(self.columns):
+            self._files[column].write(np.ascontiguousarray(values[:, i]).tobytes())
+
+        codes = [self.categories.setdefault(genre, len(self.categories)) for genre in genres]
+        self._genre_file.write(np.array(codes, dtype=np.int16).tobytes())
+
+        encoded = [str(name).encode("utf-8") for name in names]
+        self._name_file.write(b"".join(encoded))
+        offsets = self._name_offset + np.cumsum([len(name) for name in encoded], dtype=np.int64)
+        self._offset_file.write(offsets.tobytes())
+        if len(offsets):
+            self._name_offset = int(offsets[-1])
+
+        self.n_rows += len(names)
+
+    def close(self):
+        """Writes the schema and moves the dataset into place
+
+        Returns:
+            str: directory of the dataset
+        """
+        for f in [*self._files.values(), self._genre_file, self._name_file, self._offset_file]:
+            f.close()
+
+        schema = {
+            "version": FORMAT_VERSION,
+            "n_rows": self.n_rows,
+            "columns": self.columns,
+            "dtype": "float32",
+            "genres": sorted(self.categories, key=self.categories.get),
+        }
+        with open(self._path("schema.json"), "w") as f:
+            json.dump(schema, f, indent=1)
+
+        if os.path.isdir(self.dataset_dir):
+            shutil.rmtree(self.dataset_dir)
+        os.replace(self._temporary_dir, self.dataset_dir)
+
+        return self.dataset_dir
+
+
+class ColumnarDataset:
+
+    def __init__(self, dataset_dir):
+        """Reads a dataset written by ColumnarWriter. Columns are memory mapped, so opening a dataset costs nothing whatever its
+        size and only the columns that are used are read from disk
+
+        Args:
+            dataset_dir (str): directory of the dataset
+        """
+        self.dataset_dir = dataset_dir
+
+        with open(os.path.join(dataset_dir, "schema.json")) as f:
+            self.schema = json.load(f)
+
+        if self.schema["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset version {self.schema['version']}")
+
+        self.columns = self.schema["columns"]
+        self.genres = self.schema["genres"]
+
+    def __len__(self):
+        return self.schema["n_rows"]
+
+    def _memmap(self, file_name, dtype, length):
+        # Memory mapping an empty file fails
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.dataset_dir, file_name), dtype=dtype, mode="r", shape=(length,))
+
+    def column(self, column):
+        """Memory maps a feature column
+
+        Args:
+            column (str): name of the column
+
+        Returns:
+            numpy array: read-only float32 values of the column
+        """
+        if column not in self.columns:
+            raise KeyError(column)
+        return self._memmap(f"{column}.f32", np.float32, len(self))
+
+    def matrix(self, columns=None, rows=None):
+        """Reads feature columns into a matrix
+
+        Args:
+            columns (list(str), optional): columns to read. Defaults to None (all columns).
+            rows (slice or numpy array, optional): rows to read. Defaults to None (all rows).
+
+        Returns:
+            numpy array: float32 matrix of shape (n_rows, n_columns)
+        """
+        columns = self.columns if columns is None else columns
+        rows = slice(None) if rows is None else rows
+
+        first = self.column(columns[0])[rows]
+        matrix = np.empty((len(first), len(columns)), dtype=np.float32)
+        matrix[:, 0] = first
+        for i, column in enumerate(columns[1:], start=1):
+            matrix[:, i] = self.column(column)[rows]
+
+        return matrix
+
+    def genre_codes(self):
+        """Memory maps the genre column
+
+        Returns:
+            numpy array: read-only int16 code of the genre of each row, an index into `genres`
+        """
+        return self._memmap("Genre.i16", np.int16, len(self))
+
+    def genre_labels(self, rows=None):
+        """Reads genre names
+
+        Args:
+            rows (slice or numpy array, optional): rows to read. Defaults to None (all rows).
+
+        Returns:
+            numpy array: genre of each row
+        """
+        codes = self.genre_codes()[slice(None) if rows is None else rows]
+        return np.array(self.genres, dtype=object)[codes]
+
+    def names(self, start=0, end=None):
+        """Reads names of a range of rows
+
+        Args:
+            start (int, optional): first row. Defaults to 0.
+            end (int, optional): row after the last one. Defaults to None (last row).
+
+        Returns:
+            list(str): name of each row
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return []
+
+        offsets = self._memmap("Name.offsets.i64", np.int64, len(self) + 1)[start:end + 1]
+
+        with open(os.path.join(self.dataset_dir, "Name.utf8"), "rb") as f:
+            f.seek(int(offsets[0]))
+            data = f.read(int(offsets[-1] - offsets[0]))
+
+        offsets = offsets - offsets[0]
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(end - start)]
+
+    def to_dataframe(self, columns=None, names=False):
+        """Reads the dataset into a DataFrame with the columns of data.csv
+
+        Args:
+            columns (list(str), optional): feature columns to read. Defaults to None (all columns).
+            names (bool, optional): also read the Name column. Defaults to False.
+
+        Returns:
+            DataFrame: Genre and feature columns, and Name if asked
+        """
+        columns = self.columns if columns is None else columns
+
+        frame = pd.DataFrame(self.matrix(columns), columns=columns)
+        frame.insert(0, "Genre", self.genre_labels())
+        if names:
+            frame.insert(0, "Name", self.names())
+
+        return frame
+
+    @staticmethod
+    def from_csv(csv_path, dataset_dir, chunk_size=100000):
+        """Converts a data.csv file into a columnar dataset, reading it a chunk at a time
+
+        Args:
+            csv_path (str): path of the csv file
+            dataset_dir (str): directory of the dataset
+            chunk_size (int, optional): rows read at once. Defaults to 100000.
+
+        Returns:
+            ColumnarDataset: the converted dataset
+        """
+        writer = None
+
+        for chunk in pd.read_csv(csv_path, index_col=0, chunksize=chunk_size, keep_default_na=False, na_values=[""], dtype={"Name": str, "Genre": str}):
+            if writer is None:
+                writer = ColumnarWriter(dataset_dir, [column for column in chunk.columns if column not in ("Name", "Genre")])
+            writer.write(chunk["Name"].tolist(), chunk["Genre"].tolist(), chunk[writer.columns].to_numpy(dtype=np.float32))
+
+        if writer is None:
+            raise ValueError(f"{csv_path} has no rows")
+
+        return ColumnarDataset(writer.close())
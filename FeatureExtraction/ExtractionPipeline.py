@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+
+# Put into the queue once per compute worker when decoding is done
+_END = object()
+
+
+class ExtractionPipeline:
+
+    def __init__(self, decode, compute, on_result, on_error=None, decode_workers=2, compute_workers=4, queue_size=16):
+        """Two stage pipeline. Decode workers turn items into decoded data and put them into a bounded queue, compute workers take
+        them out and compute results. The bounded queue keeps at most `queue_size` decoded items in memory and blocks decoding
+        when computing falls behind.
+
+        Args:
+            decode (callable): decode(item) -> decoded data
+            compute (callable): compute(item, decoded) -> result
+            on_result (callable): on_result(item, result), called from compute workers
+            on_error (callable, optional): on_error(item, exception), called when decoding, computing or storing the result of an item fails. Defaults to None.
+            decode_workers (int, optional): number of decode threads. Defaults to 2.
+            compute_workers (int, optional): number of compute threads. Defaults to 4.
+            queue_size (int, optional): maximum number of decoded items waiting to be computed. Defaults to 16.
+        """
+        self.decode = decode
+        self.compute = compute
+        self.on_result = on_result
+        self.on_error = on_error
+        self.decode_workers = decode_workers
+        self.compute_workers = compute_workers
+        self.queue_size = queue_size
+
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def _new_stage_stats(self, workers):
+        """Creates statistics of a stage
+
+        Args:
+            workers (int): number of workers of the stage
+
+        Returns:
+            dict: statistics of the stage
+        """
+        return {"workers": workers, "items": 0, "errors": 0, "busy_seconds": 0.0, "wait_seconds": 0.0}
+
+    def _record(self, stage, busy=0.0, wait=0.0, items=0, errors=0):
+        """Adds to the statistics of a stage
+
+        Args:
+            stage (str): `decode` or `compute`
+            busy (float, optional): seconds spent working. Defaults to 0.0.
+            wait (float, optional): seconds spent waiting on the queue. Defaults to 0.0.
+            items (int, optional): number of processed items. Defaults to 0.
+            errors (int, optional): number of failed items. Defaults to 0.
+        """
+        with self._lock:
+            stats = self.stats[stage]
+            stats["busy_seconds"] += busy
+            stats["wait_seconds"] += wait
+            stats["items"] += items
+            stats["errors"] += errors
+
+    def _fail(self, item, exception):
+        """Reports a failed item
+
+        Args:
+            item: item that failed
+            exception (Exception): raised exception
+        """
+        if self.on_error is not None:
+            self.on_error(item, exception)
+
+    def _decode_worker(self, items, decoded_queue):
+        """Decodes items till there are none left
+
+        Args:
+            items (iterator): shared iterator of items
+            decoded_queue (Queue): queue of decoded items
+        """
+        while True:
+            with self._lock:
+                item = next(items, _END)
+            if item is _END:
+                return
+
+            start = time.perf_counter()
+            try:
+                decoded = self.decode(item)
+            except Exception as e:
+                self._record("decode", busy=time.perf_counter() - start, errors=1)
+                self._fail(item, e)
+                continue
+            decoded_at = time.perf_counter()
+
+            # Blocks while the queue is full
+            decoded_queue.put((item, decoded))
+            self._record("decode", busy=decoded_at - start, wait=time.perf_counter() - decoded_at, items=1)
+
+    def _compute_worker(self, decoded_queue):
+        """Computes decoded items till decoding is done
+
+        Args:
+            decoded_queue (Queue): queue of decoded items
+        """
+        while True:
+            start = time.perf_counter()
+            entry = decoded_queue.get()
+            got_at = time.perf_counter()
+            self._record("compute", wait=got_at - start)
+
+            if entry is _END:
+                return
+
+            item, decoded = entry
+            # A failing on_result, e.g. a full disk, must not end the worker, decoders would block on the full queue once every worker ended
+            try:
+                result = self.compute(item, decoded)
+                self.on_result(item, result)
+            except Exception as e:
+                self._record("compute", busy=time.perf_counter() - got_at, errors=1)
+                self._fail(item, e)
+                continue
+
+            self._record("compute", busy=time.perf_counter() - got_at, items=1)
+
+    def run(self, items):
+        """Runs every item through both stages
+
+        Args:
+            items (iterable): items to process
+
+        Returns:
+            dict: statistics of each stage, with utilization being the fraction of worker time spent working
+        """
+        self.stats = {
+            "decode": self._new_stage_stats(self.decode_workers),
+            "compute": self._new_stage_stats(self.compute_workers),
+        }
+
+        items = iter(items)
+        decoded_queue = queue.Queue(maxsize=self.queue_size)
+
+        decoders = [threading.Thread(target=self._decode_worker, args=(items, decoded_queue), daemon=True) for _ in range(self.decode_workers)]
+        computers = [threading.Thread(target=self._compute_worker, args=(decoded_queue,), daemon=True) for _ in range(self.compute_workers)]
+
+        start = time.perf_counter()
+        for worker in [*decoders, *computers]:
+            worker.start()
+
+        for decoder in decoders:
+            decoder.join()
+        for _ in computers:
+            decoded_queue.put(_END)
+        for computer in computers:
+            computer.join()
+
+        wall_seconds = time.perf_counter() - start
+        self.stats["wall_seconds"] = wall_seconds
+        for stage in ["decode", "compute"]:
+            stats = self.stats[stage]
+            stats["utilization"] = stats["busy_seconds"] / (wall_seconds * stats["workers"]) if wall_seconds > 0 else 0.0
+
+        return self.stats
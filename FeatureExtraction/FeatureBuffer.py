@@ -0,0 +1,197 @@
+import glob
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureBuffer:
+
+    def __init__(self, columns, capacity=1024):
+        """Thread safe columnar buffer of extracted features. Rows are stored in a preallocated float32 matrix that doubles its
+        capacity when full, so appending n rows costs O(n) overall. Rows that were not checkpointed yet can be written into
+        append-only shards, each checkpoint costing only as much as the rows added since the previous one.
+
+        Args:
+            columns (list(str)): name of each feature column
+            capacity (int, optional): number of rows preallocated. Defaults to 1024.
+        """
+        self.columns = list(columns)
+
+        self.names = []
+        self.genres = []
+        self.values = np.empty((capacity, len(self.columns)), dtype=np.float32)
+
+        # Number of rows already written into a shard
+        self.checkpointed = 0
+        self.n_shards = 0
+
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _grow(self, n_rows):
+        """Doubles the capacity of the buffer till `n_rows` fit in it
+
+        Args:
+            n_rows (int): number of rows that must fit
+        """
+        capacity = len(self.values)
+        if n_rows <= capacity:
+            return
+
+        while capacity < n_rows:
+            capacity *= 2
+
+        values = np.empty((capacity, len(self.columns)), dtype=np.float32)
+        values[:len(self)] = self.values[:len(self)]
+        self.values = values
+
+    def extend(self, names, genres, rows):
+        """Appends rows to the buffer
+
+        Args:
+            names (list(str)): Song Names
+            genres (list(str)): Genre of each song
+            rows (numpy array): features of each song of shape (n_songs, n_columns)
+
+        Returns:
+            int: number of rows in the buffer after appending
+        """
+        rows = np.asarray(rows, dtype=np.float32).reshape(len(names), len(self.columns))
+
+        with self._lock:
+            start = len(self)
+            self._grow(start + len(names))
+            self.values[start:start + len(names)] = rows
+            self.names.extend(names)
+            self.genres.extend(genres)
+
+            return len(self)
+
+    def append(self, name, genre, row):
+        """Appends a single row to the buffer
+
+        Args:
+            name (str): Song Name
+            genre (str): Genre of the song
+            row (numpy array): features of the song
+
+        Returns:
+            int: number of rows in the buffer after appending
+        """
+        return self.extend([name], [genre], [row])
+
+    def _to_dataframe(self, start, end):
+        """Creates a DataFrame of a range of rows
+
+        Args:
+            start (int): first row
+            end (int): row after the last one
+
+        Returns:
+            DataFrame: rows with Name, Genre and feature columns
+        """
+        frame = pd.DataFrame(self.values[start:end], columns=self.columns)
+        frame.insert(0, "Genre", self.genres[start:end])
+        frame.insert(0, "Name", self.names[start:end])
+        return frame
+
+    def to_dataframe(self):
+        """Creates a DataFrame of all rows in the buffer
+
+        Returns:
+            DataFrame: rows with Name, Genre and feature columns
+        """
+        with self._lock:
+            return self._to_dataframe(0, len(self))
+
+    def checkpoint(self, checkpoint_dir):
+        """Writes the rows added since the previous checkpoint into a new shard
+
+        Args:
+            checkpoint_dir (str): directory to store shards in
+
+        Returns:
+            str: path of the shard, None if there were no new rows
+        """
+        with self._checkpoint_lock:
+            with self._lock:
+                start, end = self.checkpointed, len(self)
+                if start == end:
+                    return None
+                new_rows = self._to_dataframe(start, end)
+
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            shard_path = os.path.join(checkpoint_dir, f"shard_{self.n_shards:06d}.csv")
+            new_rows.to_csv(shard_path, index=False)
+
+            self.checkpointed = end
+            self.n_shards += 1
+
+            return shard_path
+
+    def write_columnar(self, dataset_dir):
+        """Writes all rows into a columnar dataset, see ColumnarWriter
+
+        Args:
+            dataset_dir (str): directory of the dataset
+
+        Returns:
+            int: number of written rows
+        """
+        from ColumnarDataset import ColumnarWriter
+
+        writer = ColumnarWriter(dataset_dir, self.columns)
+
+        with self._lock:
+            writer.write(self.names, self.genres, self.values[:len(self)])
+            n_rows = len(self)
+
+        writer.close()
+        return n_rows
+
+    @staticmethod
+    def get_shards(checkpoint_dir):
+        """Returns shards of a checkpoint directory in the order they were written
+
+        Args:
+            checkpoint_dir (str): directory the shards are stored in
+
+        Returns:
+            list(str): path of each shard
+        """
+        return sorted(glob.glob(os.path.join(checkpoint_dir, "shard_*.csv")))
+
+    @staticmethod
+    def merge_shards(checkpoint_dir, output_path, remove=True, shards=None):
+        """Merges shards into a single csv file, one shard at a time, keeping the index column of the previous data.csv format
+
+        Args:
+            checkpoint_dir (str): directory the shards are stored in
+            output_path (str): path of the merged csv file
+            remove (bool, optional): remove shards after merging them. Defaults to True.
+            shards (list(str), optional): paths of the shards to merge, in this order. Defaults to None (every shard of `checkpoint_dir`).
+
+        Returns:
+            int: number of merged rows
+        """
+        if shards is None:
+            shards = FeatureBuffer.get_shards(checkpoint_dir)
+        n_rows = 0
+
+        with open(output_path, "w", newline="") as f:
+            for i, shard_path in enumerate(shards):
+                shard = pd.read_csv(shard_path, keep_default_na=False, na_values=[""], dtype={"Name": str, "Genre": str})
+                shard.index = range(n_rows, n_rows + len(shard))
+                shard.to_csv(f, header=(i == 0))
+                n_rows += len(shard)
+
+        if remove:
+            for shard_path in shards:
+                os.remove(shard_path)
+
+        return n_rows
@@ -0,0 +1,165 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class FeatureCache:
+
+    def __init__(self, cache_path):
+        """Persistent cache of extracted features stored in a SQLite database. Entries are keyed by the hash of the content of a clip
+        and the parameters of the extractor, so renamed or re-downloaded clips with the same content are not extracted again
+
+        Args:
+            cache_path (str): path of the SQLite database
+        """
+        self.cache_path = cache_path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "content_hash TEXT NOT NULL, "
+            "params TEXT NOT NULL, "
+            "features BLOB NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (content_hash, params))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS features_params ON features (params)")
+        self._connection.commit()
+
+    @staticmethod
+    def hash_file(path, block_size=1 << 20):
+        """Hashes the content of a file
+
+        Args:
+            path (str): path of the file
+            block_size (int, optional): number of bytes read at once. Defaults to 1 MiB.
+
+        Returns:
+            str: hex digest of the content
+        """
+        digest = hashlib.blake2b(digest_size=16)
+
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_name(name):
+        """Hashes a name, used as key of entries that have no file to hash, e.g. songs extracted from memory whose original was removed
+
+        Args:
+            name (str): name of the entry
+
+        Returns:
+            str: hex digest of the name, never equal to a content hash
+        """
+        return hashlib.blake2b(f"name:{name}".encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def make_params_key(**params):
+        """Creates the key of a set of extractor parameters
+
+        Args:
+            **params: parameters that change the extracted values
+
+        Returns:
+            str: key of the parameters, e.g. `frame_size=1024;hop_length=512`
+        """
+        return ";".join(f"{name}={params[name]}" for name in sorted(params))
+
+    def get_many(self, content_hashes, params):
+        """Looks up features of many clips
+
+        Args:
+            content_hashes (list(str)): hashes of the clips
+            params (str): key of the extractor parameters
+
+        Returns:
+            dict: hash as key and float32 features as value, for cached clips only
+        """
+        found = {}
+        content_hashes = list(content_hashes)
+
+        with self._lock:
+            # SQLite limits the number of parameters of a query
+            for i in range(0, len(content_hashes), 500):
+                batch = content_hashes[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT content_hash, features FROM features WHERE params = ? AND content_hash IN ({placeholders})",
+                    [params, *batch],
+                ).fetchall()
+
+                for content_hash, features in rows:
+                    found[content_hash] = np.frombuffer(features, dtype=np.float32)
+
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE features SET last_used = ? WHERE content_hash = ? AND params = ?",
+                    [(now, content_hash, params) for content_hash in found],
+                )
+                self._connection.commit()
+
+        return found
+
+    def put_many(self, content_hashes, params, rows):
+        """Stores features of many clips in one transaction
+
+        Args:
+            content_hashes (list(str)): hashes of the clips
+            params (str): key of the extractor parameters
+            rows (numpy array): features of each clip
+        """
+        now = time.time()
+        entries = [(content_hash, params, np.asarray(row, dtype=np.float32).tobytes(), now) for content_hash, row in zip(content_hashes, rows)]
+
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)", entries)
+            self._connection.commit()
+
+    def params_keys(self):
+        """Returns parameter sets stored in the cache
+
+        Returns:
+            dict: key of the parameters as key and number of cached clips as value
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT params, COUNT(*) FROM features GROUP BY params").fetchall()
+
+        return dict(rows)
+
+    def evict(self, keep_params=(), unused_for=None):
+        """Removes entries of parameter sets no longer used
+
+        Args:
+            keep_params (list(str), optional): keys of parameter sets to keep. Defaults to () (remove everything).
+            unused_for (float, optional): if given, entries of kept parameter sets not used for this many seconds are removed too. Defaults to None.
+
+        Returns:
+            int: number of removed entries
+        """
+        keep_params = list(keep_params)
+        placeholders = ",".join("?" * len(keep_params))
+
+        with self._lock:
+            removed = self._connection.execute(f"DELETE FROM features WHERE params NOT IN ({placeholders})", keep_params).rowcount
+
+            if unused_for is not None:
+                removed += self._connection.execute("DELETE FROM features WHERE last_used < ?", (time.time() - unused_for,)).rowcount
+
+            self._connection.commit()
+
+        return removed
+
+    def close(self):
+        """Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
@@ -1,38 +1,222 @@
+import json
+import math
 import os
+import pickle
+import sys
+import threading
 import warnings
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import lru_cache
 
+import JitCache
 import librosa
 import numpy as np
-import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 
-from progressBar import printProgressBar
+from ExtractionPipeline import ExtractionPipeline
+from FeatureBuffer import FeatureBuffer
+from FeatureCache import FeatureCache
+
+# Monitoring modules are shared with SongCollection
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Monitoring"))
+
+from MemoryBudget import MemoryBudget
+from Metrics import Metrics
+from ProgressReporter import ProgressReporter
 
 warnings.filterwarnings('ignore')
+
+# Version of the feature computation, part of the cache key so that cached values of an older computation are not reused
+FEATURE_VERSION = 1
+
+# Peak memory of decoding a second of audio, measured with librosa 0.9.2 on 44.1 kHz songs resampled with kaiser_best
+DECODE_BYTES_PER_SECOND = 1.5e6
+# Peak memory of the frame level features of a sample at `sample_rate`: STFTs, spectrograms and mel spectrogram, measured the same way
+DSP_BYTES_PER_SAMPLE = 40
+
+# Extractor living in each worker process of the process pool, built once by `_init_worker`
+_worker_extractor = None
+
+
+def _init_worker(params, song_dir):
+    """Initializes a worker process of the process pool. Imports librosa, builds the extractor once and runs it on a
+    short synthetic signal so that numba kernels are loaded from the cache (or compiled) before the first real song arrives
+
+    Args:
+        params (dict): keyword arguments used to build the FeatureExtractor of the worker
+        song_dir (str): song directory of the parent extractor
+    """
+    global _worker_extractor
+
+    warnings.filterwarnings('ignore')
+    JitCache.enable()
+    _worker_extractor = FeatureExtractor(**params)
+    _worker_extractor.song_dir = song_dir
+
+    JitCache.warmup(_worker_extractor)
+
+
+def _extract_chunk(song_names):
+    """Extracts features of a chunk of songs inside a worker process
+
+    Args:
+        song_names (list(str)): names of songs in the song directory
+
+    Returns:
+        (list(str), list(str), numpy array, list(str), dict): names, genres, float32 feature rows of shape (n_songs, n_columns), names of songs that failed
+            and metrics of the chunk
+    """
+    names, genres, rows, failed = [], [], [], []
+
+    for song_name in song_names:
+        try:
+            genre, name, features = _worker_extractor._process_song(song_name)
+        except Exception as e:
+            _worker_extractor.metrics.increment("extract_errors", type=type(e).__name__)
+            failed.append(song_name)
+            continue
+
+        names.append(name)
+        genres.append(genre)
+        rows.append(features)
+
+    rows = np.array(rows, dtype=np.float32).reshape(len(rows), len(_worker_extractor.features) - 2)
+    return names, genres, rows, failed, _worker_extractor.metrics.drain()
+
+
+@lru_cache(maxsize=None)
+def _mel_basis(sr, n_fft, n_mels=128):
+    """Mel filterbank, cached per sampling rate and FFT size
+
+    Args:
+        sr (int): Sampling Rate
+        n_fft (int): FFT size of the spectrogram
+        n_mels (int, optional): number of mel bands. Defaults to 128 (same as librosa).
+
+    Returns:
+        numpy array: filterbank of shape (n_mels, n_fft // 2 + 1)
+    """
+    return librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n_mfcc, n_mels=128):
+    """Orthonormal DCT-II matrix, the same transform librosa applies to the log mel spectrogram for MFCCs
+
+    Args:
+        n_mfcc (int): number of coefficients to keep
+        n_mels (int, optional): number of mel bands. Defaults to 128.
+
+    Returns:
+        numpy array: matrix of shape (n_mfcc, n_mels)
+    """
+    k = np.arange(n_mfcc)[:, np.newaxis]
+    n = np.arange(n_mels)[np.newaxis, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2 / n_mels)
+    basis[0] /= np.sqrt(2)
+
+    return basis.astype(np.float32)
+
+
 class FeatureExtractor():
 
-    def __init__(self, segment_duration=30, n_threads=10, frame_size = 1024, hop_length = 512, split_frequency = 2000):
+    def __init__(self, segment_duration=30, n_threads=10, frame_size = 1024, hop_length = 512, split_frequency = 2000, n_processes=0, chunk_size=None, mfcc_n_fft=2048, sample_rate=22050, use_cache=True,
+                 decode_threads=0, queue_size=32, native_rate_decode=False, res_type="kaiser_best", checkpoint_every=100,
+                 output_format="both", metrics=None, columns=None, memory_limit=None):
         """
 
         Args:
             segment_duration (int, optional): Dataset to be used. Uses segmented into `segment_duration` seconds. Defaults to 30.
-            n_threads (int, optional): number of threads to use. Defaults to 10.
+            n_threads (int, optional): number of threads to use. Used by the compute stage if `decode_threads` is set. Defaults to 10.
             frame_size (int, optional): .Defaults to 1024.
             hop_length (int, optional): Defaults to 512.
             split_frequency (int, optional): Split frequency for Band Energy Ratio. Defaults to 2000.
+            n_processes (int, optional): number of worker processes to use. If greater than 0, a process pool is used instead of threads. Defaults to 0.
+            chunk_size (int, optional): number of songs sent to a worker process at once. Defaults to None (chosen from number of songs and processes).
+            mfcc_n_fft (int, optional): FFT size of the mel spectrogram used for MFCCs. If equal to `frame_size`, MFCCs reuse the spectrogram of the other spectral features
+                and a single STFT is computed per clip, at the cost of MFCC values differing from librosa's default. Defaults to 2048 (same as librosa).
+            sample_rate (int, optional): Sampling Rate songs are loaded at. Defaults to 22050 (same as librosa).
+            use_cache (bool, optional): reuse features of clips extracted in a previous run, looked up by content and parameters. Defaults to True.
+            decode_threads (int, optional): if greater than 0, songs are decoded by this many threads and handed to `n_threads` compute threads
+                through a bounded queue. Defaults to 0 (each thread decodes and computes).
+            queue_size (int, optional): maximum number of decoded songs waiting to be computed. Defaults to 32.
+            native_rate_decode (bool, optional): decode songs at their native rate and resample them in the compute stage with `res_type`. Defaults to False.
+            res_type (str, optional): resampler used by librosa, e.g. `kaiser_fast` or `polyphase` which are much faster than the default. Defaults to "kaiser_best".
+            checkpoint_every (int, optional): number of rows between two checkpoint shards. Defaults to 100.
+            output_format (str, optional): `csv` writes data.csv, `columnar` writes the memory mappable `dataset` directory (see ColumnarDataset)
+                and `both` writes both. Defaults to "both".
+            metrics (Metrics, optional): metrics updated with stage timings, counters and errors, and flushed at every checkpoint. Defaults to None (own metrics).
+            columns (list(str) or str, optional): feature columns to extract, in this order, or path of a model artifact (pickle written by
+                ML/Trainer.py or ML/model.ipynb, or directory written by FlatForest.export) whose columns are extracted. Intermediate results
+                no column needs, e.g. the power spectrogram of the Band Energy Ratio, are never computed. Defaults to None (all 38 features).
+            memory_limit (int or str, optional): ceiling of the resident memory of the process, e.g. `2G`. Songs are admitted only while
+                their estimated footprint fits and the number of songs extracted at once adapts to the measured memory (see MemoryBudget).
+                Worker processes of `n_processes` extract one song at a time and are not covered. With glibc, call `return_freed_memory`
+                of MemoryBudget first, as main.py does. Defaults to None (no limit).
         """
         
+        self.segment_duration = segment_duration
         self.root_dir, self.song_dir = self._get_song_dir(segment_duration)
-        self.features = self._create_feature_list()
+        self.features = ["Name", "Genre", *self._select_columns(columns)]
+        self._plan_computations()
         self.n_threads = n_threads
+        self.n_processes = n_processes
+        self.chunk_size = chunk_size
         self.frame_size = frame_size
         self.hop_length = hop_length
         self.split_frequency = split_frequency
-        self.data = self._create_dataframe()
+        self.mfcc_n_fft = mfcc_n_fft
+        self.sample_rate = sample_rate
+        self.decode_threads = decode_threads
+        self.queue_size = queue_size
+        self.native_rate_decode = native_rate_decode
+        self.res_type = res_type
+
+        # Features of already extracted clips, opened when extraction starts
+        self.use_cache = use_cache
+        self.cache = None
+        self.cache_path = os.path.join(self.root_dir, "feature_cache.sqlite")
+        cache_params = {"frame_size": frame_size, "hop_length": hop_length, "split_frequency": split_frequency, "mfcc_n_fft": mfcc_n_fft,
+                        "sr": sample_rate, "res_type": res_type, "version": FEATURE_VERSION}
+        # Rows of a subset of columns are cached apart, all 38 features keep the key they always had
+        if self.features != self._create_feature_list():
+            cache_params["columns"] = ",".join(self.features[2:])
+        self.cache_params = FeatureCache.make_params_key(**cache_params)
+        self.song_hashes = {}
+
+        # Rows waiting to be cached, written in one transaction at each checkpoint instead of one per song
+        self._pending_cache = []
+        self._pending_cache_lock = threading.Lock()
+
+        # Index of segments written by SongDownloader, used instead of listing the song directory when it exists
+        self.manifest_path = os.path.join(os.path.dirname(self.song_dir), "manifest.sqlite")
+        self.manifest = None
+
+        # Extracted rows, checkpointed every `checkpoint_every` rows into shards which are merged into data.csv at the end
+        self.buffer = FeatureBuffer(self.features[2:])
+        self.checkpoint_dir = os.path.join(self.root_dir, "checkpoints")
+        self.checkpoint_every = checkpoint_every
+
+        if output_format not in ("csv", "columnar", "both"):
+            raise ValueError(f"Unknown output format {output_format}")
+        self.output_format = output_format
 
         # To keep track of progress
-        self.extracted_data = 0
         self.total_data = 0
+        self.failed_songs = []
+        self.stage_stats = {}
+
+        # Stage timings, counters and errors, and progress of extract_features
+        self.metrics = metrics or Metrics()
+        self.progress = None
+
+        # Shared by every thread extracting songs, and by SongDownloader when it feeds this extractor
+        self.memory_budget = None
+        if memory_limit is not None:
+            # Kernels are compiled first, so that memory taken by JIT compilation is part of the baseline and not mistaken for songs
+            JitCache.warmup(self)
+            self.memory_budget = MemoryBudget(memory_limit, max(n_threads, decode_threads), metrics=self.metrics)
  
 
     def _get_song_dir(self, segment_duration):
@@ -74,129 +258,941 @@ class FeatureExtractor():
         all_features = [*song_info, *all_features]
         return all_features
 
-    def _create_dataframe(self):
-        """Creates empty DataFrame
+    @staticmethod
+    def _read_model_columns(model_path):
+        """Reads the feature columns a model was trained on
+
+        Args:
+            model_path (str): pickled model or artifact dict, or directory written by FlatForest.export
+
+        Raises:
+            ValueError: If the model does not name its columns
 
         Returns:
-            DataFrame: Empty DataFrame
+            list(str): columns in the order the model expects them
         """
-        return pd.DataFrame(columns=self.features)
-        
-    def _amplitude_envelope(self, signal):
-        """Calculates amplitude evnelope of a signal
+        if os.path.isdir(model_path):
+            with open(os.path.join(model_path, "meta.json")) as f:
+                columns = json.load(f).get("columns")
+        else:
+            with open(model_path, "rb") as f:
+                artifact = pickle.load(f)
+
+            if isinstance(artifact, dict):
+                columns = artifact.get("columns")
+                artifact = artifact["model"] if columns is None else artifact
+            else:
+                columns = None
+
+            if columns is None:
+                columns = getattr(artifact, "feature_names_in_", None)
+
+        if columns is None:
+            raise ValueError(f"{model_path} does not name the columns it was trained on, give them as a list")
+
+        return [str(column) for column in columns]
+
+    def _select_columns(self, columns):
+        """Validates the feature columns to extract
 
         Args:
-            signal (numpy array): audio signal
+            columns (list(str) or str): columns, or path of a model artifact. None for all features
+
+        Raises:
+            ValueError: If a column is not a feature of the extractor, or is given twice
+
+        Returns:
+            list(str): columns to extract
+        """
+        available = self._create_feature_list()[2:]
+        if columns is None:
+            return available
+
+        if isinstance(columns, str):
+            columns = self._read_model_columns(columns)
+        columns = [str(column) for column in columns]
+
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            raise ValueError(f"Unknown feature columns {unknown}, available columns are {available}")
+        if not columns or len(set(columns)) != len(columns):
+            raise ValueError("Feature columns must be given once each, and at least one")
+
+        return columns
+
+    def _plan_computations(self):
+        """Works out which frame level features the selected columns need, extract_features_batch computing only those and
+        the spectrograms they are computed from
+        """
+        # Frame level feature of each column, e.g. `SC` for `SC_Std`
+        self._frame_features = {column.rsplit("_", 1)[0] for column in self.features[2:]}
+        self._mfcc_coefficients = sorted(int(name[4:]) for name in self._frame_features if name.startswith("MFCC"))
+
+    @property
+    def data(self):
+        """DataFrame of extracted features
 
         Returns:
-            numpy array: amplitude envelope
+            DataFrame: Name, Genre and features of each extracted song
         """
-        return np.array([max(signal[i:i+self.frame_size]) for i in range(0, len(signal), self.hop_length)])
+        return self.buffer.to_dataframe()
 
+    @property
+    def extracted_data(self):
+        """Number of extracted songs
+
+        Returns:
+            int: number of rows in the buffer
+        """
+        return len(self.buffer)
+
+    def _frames(self, signals, frame_length, hop_length):
+        """Strided view of frames of a batch of signals, without copying them
+
+        Args:
+            signals (numpy array): signals of shape (n_clips, samples)
+            frame_length (int): length of each frame
+            hop_length (int): number of samples between the start of two frames
+
+        Returns:
+            numpy array: frames of shape (n_clips, n_frames, frame_length)
+        """
+        return sliding_window_view(signals, frame_length, axis=-1)[:, ::hop_length]
+
+    def _amplitude_envelope(self, signals):
+        """Calculates amplitude evnelope of a batch of signals. Frames start every `hop_length` samples and the last ones are cut short
+        by the end of the signal
+
+        Args:
+            signals (numpy array): audio signals of shape (n_clips, samples)
+
+        Returns:
+            numpy array: amplitude envelope of shape (n_clips, frames)
+        """
+        # Padding with -inf so that frames running past the end only see the remaining samples
+        padded = np.pad(signals, ((0, 0), (0, self.frame_size - 1)), constant_values=-np.inf)
+        return self._frames(padded, self.frame_size, self.hop_length).max(axis=-1)
+
+    def _root_mean_square(self, signals):
+        """Calculates root mean square energy of a batch of signals, same as librosa.feature.rms with centered frames
+
+        Frame length of `hop_length` and hop of 512 are what the previous positional call to librosa.feature.rms resolved to
+
+        Args:
+            signals (numpy array): audio signals of shape (n_clips, samples)
+
+        Returns:
+            numpy array: root mean square energy of shape (n_clips, frames)
+        """
+        frame_length = self.hop_length
+        padded = np.pad(signals, ((0, 0), (frame_length // 2, frame_length // 2)))
+        frames = self._frames(padded, frame_length, 512)
+
+        return np.sqrt(np.mean(np.abs(frames) ** 2, axis=-1))
+
+    def _zero_crossing_rate(self, signals):
+        """Calculates zero crossing rate of a batch of signals, same as librosa.feature.zero_crossing_rate with centered frames.
+        Crossings are counted once over the whole signal and summed per frame with a cumulative sum
+
+        Args:
+            signals (numpy array): audio signals of shape (n_clips, samples)
+
+        Returns:
+            numpy array: zero crossing rate of shape (n_clips, frames)
+        """
+        padded = np.pad(signals, ((0, 0), (self.frame_size // 2, self.frame_size // 2)), mode="edge")
+
+        # Values close to 0 count as positive, as in librosa.zero_crossings
+        signbit = np.signbit(np.where(np.abs(padded) <= 1e-10, 0, padded))
+        crossings = np.cumsum(signbit[:, 1:] != signbit[:, :-1], axis=-1, dtype=np.int32)
+        crossings = np.pad(crossings, ((0, 0), (1, 0)))
+
+        # Crossings inside a frame, the first sample of a frame has no crossing
+        n_frames = 1 + (padded.shape[-1] - self.frame_size) // self.hop_length
+        starts = np.arange(n_frames) * self.hop_length
+        counts = crossings[:, starts + self.frame_size - 1] - crossings[:, starts]
+
+        return counts / self.frame_size
 
     def _calculate_split_frequency_bins(self, spectrogram, sr):
         """Calculated split frequency bins for Band Energy Ratio
 
         Args:
-            spectrogram (Numpy array of complex numbers): Spectrogram of the signal
+            spectrogram (Numpy array): Spectrogram of the signal of shape (..., frequency bins, frames)
             sr (int): Sampling Rate
 
         Returns:
             int: Split Frequency Bin
         """
         frequency_range = sr / 2
-        frequency_delta_per_bin = frequency_range / spectrogram.shape[0]
+        frequency_delta_per_bin = frequency_range / spectrogram.shape[-2]
         split_frequency_bin = np.floor(self.split_frequency / frequency_delta_per_bin)
 
         return int(split_frequency_bin)
 
 
-    def _calculate_band_enery_ratio(self, spectrogram, sr):
+    def _calculate_band_enery_ratio(self, power_spectrogram, sr):
         """Calculates Band Energy Ratio
 
         Args:
-            spectrogram (Numpy array of complex numbers): Spectrogram
+            power_spectrogram (Numpy array): Power Spectrogram of shape (..., frequency bins, frames)
             sr (int): Sampling Rate
 
         Returns:
-            Numpy array: Band Energy Ratio
+            Numpy array: Band Energy Ratio of shape (..., frames). Frames with no energy at all are NaN
         """
-        split_frequency_bin = self._calculate_split_frequency_bins(spectrogram,  sr)
-
-        # Move to the power spectrogram
-
-        spec_2 = np.square(np.abs(spectrogram))
-        spec_2 = spec_2.T
-
-        # Time, Freq
-        upper = [np.sum(mag[:split_frequency_bin]) for mag in spec_2]
-        lower = [np.sum(mag[split_frequency_bin:]) for mag in spec_2]
+        split_frequency_bin = self._calculate_split_frequency_bins(power_spectrogram,  sr)
 
-        BER = np.divide(upper, lower)
+        upper = power_spectrogram[..., :split_frequency_bin, :].sum(axis=-2)
+        lower = power_spectrogram[..., split_frequency_bin:, :].sum(axis=-2)
 
-        # Some values turn into NaN when divided by 0
-        BER_no_nan = BER[~np.isnan(BER)]
-
-        return BER_no_nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return upper / lower
 
     def _get_song_list(self):
-        """Returns list of songs in the song directory
+        """Returns list of songs in the song directory, from the segment manifest if there is one. Segments made before the manifest
+        existed are imported into it the first time, see SegmentManifest.import_segment_dir
 
         Returns:
             Numpy Array: list of songs
         """
-        song_list = np.array(os.listdir(self.song_dir))
+        if os.path.isfile(self.manifest_path):
+            from SongCollection.SegmentManifest import SegmentManifest
+
+            self.manifest = SegmentManifest(self.manifest_path)
+            self.manifest.import_segment_dir(self.song_dir, self.segment_duration, os.path.join(os.path.dirname(self.song_dir), "original"))
+            song_list = np.array([file_name for file_name, _, _ in self.manifest.get_segments(self.segment_duration)], dtype=str)
+        else:
+            song_list = np.array(os.listdir(self.song_dir))
+
         self.total_data = len(song_list)
         return song_list
+
+    def _update_manifest(self, song_list):
+        """Records in the segment manifest which songs were extracted and which failed
+
+        Args:
+            song_list (Numpy Array): list of songs
+        """
+        if self.manifest is None:
+            return
+
+        failed = set(self.failed_songs)
+        self.manifest.set_segment_state([song_name for song_name in song_list if song_name not in failed], "extracted")
+        self.manifest.set_segment_state(list(failed), "failed")
     
     def _dump_data(self):
-        """Dumps data into a csv file
+        """Writes rows extracted since the previous checkpoint into a new checkpoint shard and into the cache, and flushes metrics
+        """
+        with self.metrics.timer("extract_checkpoint"):
+            self.buffer.checkpoint(self.checkpoint_dir)
+            self._flush_cache()
+
+        self.metrics.flush()
+
+    def save_data(self):
+        """Checkpoints remaining rows and merges all checkpoint shards into a csv file, and writes all rows into a columnar dataset,
+        depending on `output_format`
         """
-        self.data.to_csv(os.path.join(self.root_dir, 'data.csv'))
+        self._dump_data()
+
+        with self.metrics.timer("extract_save"):
+            if self.output_format in ("columnar", "both"):
+                self.buffer.write_columnar(os.path.join(self.root_dir, "dataset"))
+
+            if self.output_format == "columnar":
+                self.clear_checkpoints()
+            else:
+                data_path = os.path.join(self.root_dir, 'data.csv')
+                if FeatureBuffer.get_shards(self.checkpoint_dir):
+                    FeatureBuffer.merge_shards(self.checkpoint_dir, data_path)
+                else:
+                    self.data.to_csv(data_path)
+
+        self.metrics.flush()
+
+    def clear_checkpoints(self):
+        """Removes checkpoint shards left by a previous run
+        """
+        for shard_path in FeatureBuffer.get_shards(self.checkpoint_dir):
+            os.remove(shard_path)
+
+    def _worker_params(self):
+        """Parameters needed to rebuild this extractor inside a worker process
+
+        Returns:
+            dict: keyword arguments of FeatureExtractor
+        """
+        return {
+            "segment_duration": self.segment_duration,
+            "n_threads": 1,
+            "frame_size": self.frame_size,
+            "hop_length": self.hop_length,
+            "split_frequency": self.split_frequency,
+            "mfcc_n_fft": self.mfcc_n_fft,
+            "sample_rate": self.sample_rate,
+            "use_cache": False,
+            "native_rate_decode": self.native_rate_decode,
+            "res_type": self.res_type,
+            "columns": self.features[2:],
+        }
+
+    def _get_chunks(self, song_list):
+        """Splits song list into chunks for the worker processes. Several chunks per process keep all processes busy till the end
+
+        Args:
+            song_list (Numpy Array): list of songs
+
+        Returns:
+            list(list(str)): chunks of song names
+        """
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(len(song_list) / (self.n_processes * 4)))
+
+        return [list(song_list[i:i+chunk_size]) for i in range(0, len(song_list), chunk_size)]
 
     def extract_features(self):
-        """Extract features and stores it into a DataFrame and dumps it into a csv file. Used multithreading to speed up the process
+        """Extract features and stores it into a buffer, checkpointed into shards which are merged into a csv file. Used multithreading, or multiprocessing if `n_processes` is set, to speed up the process
         """
-        song_list = self._get_song_list()
-        printProgressBar(self.extracted_data, self.total_data, prefix = f'{self.extracted_data:6.0f}{self.total_data:6.0f} Progress:', suffix = 'Complete', length = 50)
+        # Resampling kernels are loaded from the disk cache instead of being compiled, librosa being imported already
+        JitCache.enable()
 
+        all_songs = self._get_song_list()
+        self.clear_checkpoints()
 
-        with ThreadPoolExecutor(max_workers=self.n_threads) as thread:
-            thread.map(self._extract_features_per_sample, song_list)
+        # Songs fed through extract_song have no known total and report no progress
+        self.progress = ProgressReporter(self.total_data, prefix="Extracting:")
 
-        self._dump_data()
+        song_list = all_songs
+        if self.use_cache:
+            song_list = self._load_cached(song_list)
 
-    def _extract_features_per_sample(self, song_name):
-        """Extracts features for a single song and appends it to the DataFrame
+        if self.n_processes > 0:
+            self._extract_features_multiprocess(song_list)
+        elif self.decode_threads > 0:
+            self._extract_features_staged(song_list)
+        else:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as thread:
+                thread.map(self._extract_features_per_sample, song_list)
+
+        self.progress.close()
+        self.progress = None
+
+        self.save_data()
+        self._update_manifest(all_songs)
+
+    def _extract_features_multiprocess(self, song_list):
+        """Extracts features using a pool of worker processes. Each worker gets chunks of the song list and sends back numeric rows,
+        which are appended to the buffer by this process only
+
+        Args:
+            song_list (Numpy Array): list of songs
+        """
+        chunks = self._get_chunks(song_list)
+        if not chunks:
+            return
+
+        with ProcessPoolExecutor(max_workers=self.n_processes, initializer=_init_worker, initargs=(self._worker_params(), self.song_dir)) as pool:
+            futures = {pool.submit(_extract_chunk, chunk): chunk for chunk in chunks}
+
+            for future in as_completed(futures):
+                names, genres, rows, failed, metrics = future.result()
+                self.metrics.merge(metrics)
+                self.failed_songs.extend(failed)
+                if self.progress is not None:
+                    self.progress.update(len(failed), failed=len(failed))
+                self._append_rows(names, genres, rows)
+
+                extracted = [song_name for song_name in futures[future] if song_name not in failed]
+                self._cache_rows(extracted, rows)
+
+    def _extract_features_staged(self, song_list):
+        """Extracts features with separate decode and compute stages connected by a bounded queue, and prints the utilization of each stage
+
+        Args:
+            song_list (Numpy Array): list of songs
+        """
+        decode, on_result, on_error = self._decode_song, self._store_song_features, self._fail_song
+
+        # Reserved from decoding till stored or failed, so that decoded songs waiting in the queue count too
+        if self.memory_budget is not None:
+            footprint = self.estimate_footprint(self.segment_duration)
+
+            def decode(song_name):
+                self.memory_budget.acquire(footprint)
+                return self._decode_song(song_name)
+
+            # A song that fails to be stored goes to on_error, which releases its footprint
+            def on_result(song_name, result):
+                self._store_song_features(song_name, result)
+                self.memory_budget.release(footprint)
+
+            def on_error(song_name, exception):
+                try:
+                    self._fail_song(song_name, exception)
+                finally:
+                    self.memory_budget.release(footprint)
+
+        pipeline = ExtractionPipeline(decode, self._compute_song, on_result, on_error,
+                                      decode_workers=self.decode_threads, compute_workers=self.n_threads, queue_size=self.queue_size)
+        self.stage_stats = pipeline.run(song_list)
+
+        for stage in ["decode", "compute"]:
+            self.metrics.set("extract_stage_utilization", self.stage_stats[stage]["utilization"], stage=stage)
+            self.metrics.set("extract_stage_queue_wait_seconds", self.stage_stats[stage]["wait_seconds"], stage=stage)
+
+        self.progress.close()
+        for stage in ["decode", "compute"]:
+            stats = self.stage_stats[stage]
+            print(f"{stage.capitalize():8} {stats['workers']:3.0f} workers {stats['items']:6.0f} songs {stats['errors']:4.0f} errors "
+                  f"{100 * stats['utilization']:5.1f}% busy {stats['wait_seconds']:8.1f}s waiting on queue")
+
+    def _store_song_features(self, song_name, result):
+        """Appends features of an extracted song to the buffer and the cache
 
         Args:
             song_name (str): Song Name
+            result (str, str, numpy array): genre, name and the features of the song
+        """
+        genre, name, features = result
+        self._append_rows([name], [genre], features[np.newaxis])
+        self._cache_rows([song_name], features[np.newaxis])
+
+    def _fail_song(self, song_name, exception):
+        """Records a song whose features could not be extracted
+
+        Args:
+            song_name (str): Song Name
+            exception (Exception): raised exception
+        """
+        self.failed_songs.append(song_name)
+        self.metrics.increment("extract_errors", type=type(exception).__name__)
+
+        if self.progress is not None:
+            self.progress.update(failed=1)
+
+    def _open_cache(self):
+        """Opens the feature cache if not already opened
+
+        Returns:
+            FeatureCache: feature cache
+        """
+        if self.cache is None:
+            self.cache = FeatureCache(self.cache_path)
+        return self.cache
+
+    def _load_cached(self, song_list):
+        """Appends features of songs found in the cache to the buffer
+
+        Args:
+            song_list (Numpy Array): list of songs
+
+        Returns:
+            Numpy Array: list of songs not found in the cache, songs that could not be read being recorded as failed
+        """
+        cache = self._open_cache()
+
+        def hash_song(song_name):
+            try:
+                return FeatureCache.hash_file(os.path.join(self.song_dir, song_name))
+            except OSError as e:
+                return e
+
+        with self.metrics.timer("extract_cache_lookup"):
+            with ThreadPoolExecutor(max_workers=self.n_threads) as thread:
+                hashes = dict(zip(song_list, thread.map(hash_song, song_list)))
+
+            # Missing or unreadable files, e.g. segments of the manifest that were deleted, fail like songs that can not be decoded
+            self.song_hashes = {}
+            for song_name, content_hash in hashes.items():
+                if isinstance(content_hash, Exception):
+                    self._fail_song(song_name, content_hash)
+                else:
+                    self.song_hashes[song_name] = content_hash
+
+            cached = cache.get_many(set(self.song_hashes.values()), self.cache_params)
+
+        names, genres, rows, missing = [], [], [], []
+        for song_name in song_list:
+            if song_name not in self.song_hashes:
+                continue
+
+            content_hash = self.song_hashes[song_name]
+            if content_hash not in cached:
+                missing.append(song_name)
+                continue
+
+            genre, name = self._parse_song_name(song_name)
+            names.append(name)
+            genres.append(genre)
+            rows.append(cached[content_hash])
+
+        self.metrics.increment("extract_cache_hits", len(rows))
+        self.metrics.increment("extract_cache_misses", len(missing))
+        self._append_rows(names, genres, np.array(rows, dtype=np.float32).reshape(len(rows), len(self.buffer.columns)))
+
+        return np.array(missing, dtype=song_list.dtype)
+
+    def _cache_rows(self, song_names, rows):
+        """Queues features of extracted songs for the cache, written at the next checkpoint
+
+        Args:
+            song_names (list(str)): songs in the song directory
+            rows (numpy array): features of each song
+        """
+        if self.cache is None or len(song_names) == 0:
+            return
+
+        with self._pending_cache_lock:
+            self._pending_cache.extend((self.song_hashes[song_name], row) for song_name, row in zip(song_names, rows))
+
+    def _flush_cache(self):
+        """Writes queued rows into the cache in one transaction
+        """
+        with self._pending_cache_lock:
+            pending, self._pending_cache = self._pending_cache, []
+
+        if self.cache is None or not pending:
+            return
+
+        self.cache.put_many([content_hash for content_hash, _ in pending], self.cache_params, [row for _, row in pending])
+
+    def evict_cache(self, keep_params=None, unused_for=None):
+        """Removes cached features of parameter sets no longer used
+
+        Args:
+            keep_params (list(str), optional): keys of parameter sets to keep. Defaults to None (only the parameters of this extractor).
+            unused_for (float, optional): if given, entries not used for this many seconds are removed too. Defaults to None.
+
+        Returns:
+            int: number of removed entries
+        """
+        if keep_params is None:
+            keep_params = [self.cache_params]
+
+        return self._open_cache().evict(keep_params, unused_for)
+
+    def _append_rows(self, names, genres, rows):
+        """Appends feature rows to the buffer, checkpointing every `checkpoint_every` rows
+
+        Args:
+            names (list(str)): Song Names
+            genres (list(str)): Genre of each song
+            rows (numpy array): features of each song of shape (n_songs, n_columns)
+        """
+        if len(names) == 0:
+            return
+
+        extracted_data = self.buffer.extend(names, genres, rows)
+        self.metrics.increment("extract_rows", len(names))
+
+        if self.progress is not None:
+            self.progress.update(len(names))
+
+        if extracted_data // self.checkpoint_every != (extracted_data - len(names)) // self.checkpoint_every:
+            self._dump_data()
+
+    def _parse_song_name(self, song_name):
+        """Parses genre and name from file name of a segmented song
+
+        Args:
+            song_name (str): file name of the form <genre>_<segment>_<name>
+
+        Returns:
+            (str, str): genre and name
         """
-    
         splitted_name = song_name.split("_")
         genre = splitted_name[0]
         name = " ".join(splitted_name[1:])
-        song_path = os.path.join(self.song_dir, song_name)
+        return genre, name
 
-        signal , sr = librosa.load(song_path)
-        
-        spectrogram = librosa.stft(signal, n_fft=self.frame_size, hop_length=self.hop_length)
+    def _load(self, song_path):
+        """Loads an audio file, at its native rate if `native_rate_decode` is set
 
-        AE = self._amplitude_envelope(signal)
-        RMS = librosa.feature.rms(signal, self.frame_size, self.hop_length)[0]
-        ZCR = librosa.feature.zero_crossing_rate(signal, self.frame_size, self.hop_length)[0]   
+        Args:
+            song_path (str): path of the audio file
 
-        BER = self._calculate_band_enery_ratio(spectrogram, sr)
-        SC = librosa.feature.spectral_centroid(y=signal, sr=sr, n_fft=self.frame_size, hop_length=self.hop_length)[0]
-        BW = librosa.feature.spectral_bandwidth(y=signal, sr=sr, n_fft=self.frame_size, hop_length=self.hop_length)[0]
+        Returns:
+            (numpy array, int): signal and its Sampling Rate
+        """
+        with self.metrics.timer("extract_decode"):
+            if self.native_rate_decode:
+                signal, sr = librosa.load(song_path, sr=None)
+            else:
+                signal, sr = librosa.load(song_path, sr=self.sample_rate, res_type=self.res_type)
 
-        MFCCs = librosa.feature.mfcc(signal, n_mfcc=13, sr=sr) # -> (13, bins)
+        self.metrics.increment("extract_audio_seconds", len(signal) / sr)
+        return signal, sr
 
-        row_data = pd.Series([name, genre, AE.mean(), AE.std(), RMS.mean(), RMS.std(), ZCR.mean(), ZCR.std(), BER.mean(), BER.std(), SC.mean(), SC.std(), BW.mean(), BW.std(), MFCCs[0].mean(), MFCCs[0].std(), MFCCs[1].mean(), MFCCs[1].std(), MFCCs[2].mean(), MFCCs[2].std(), MFCCs[3].mean(), MFCCs[3].std(), MFCCs[4].mean(), MFCCs[4].std(), MFCCs[5].mean(), MFCCs[5].std(), MFCCs[6].mean(), MFCCs[6].std(), MFCCs[7].mean(), MFCCs[7].std(), MFCCs[8].mean(), MFCCs[8].std(), MFCCs[9].mean(), MFCCs[9].std(), MFCCs[10].mean(), MFCCs[10].std(), MFCCs[11].mean(), MFCCs[11].std(), MFCCs[12].mean(), MFCCs[12].std()], index=self.features)
-        self.data = pd.concat([self.data, row_data.to_frame().T], ignore_index=True)
+    def _resample(self, signal, sr):
+        """Resamples a signal to `sample_rate` if needed
 
-        self.extracted_data += 1
-        if self.extracted_data % 100 == 0:
-            self._dump_data()
-            printProgressBar(self.extracted_data, self.total_data, prefix = f'{self.extracted_data:6.0f}{self.total_data:6.0f} Progress:', suffix = 'Complete', length = 50)
-        
+        Args:
+            signal (numpy array): audio signal
+            sr (int): Sampling Rate of the signal
+
+        Returns:
+            (numpy array, int): signal and its Sampling Rate
+        """
+        if sr != self.sample_rate:
+            with self.metrics.timer("extract_resample"):
+                signal = librosa.resample(signal, orig_sr=sr, target_sr=self.sample_rate, res_type=self.res_type)
+            sr = self.sample_rate
+
+        return signal, sr
+
+    def estimate_footprint(self, duration):
+        """Estimates the peak memory of extracting a song, the larger of decoding it and of computing its frame level features
+
+        Args:
+            duration (float): duration of the song in seconds
+
+        Returns:
+            int: estimated bytes
+        """
+        # The decoded signal is kept while its features are computed
+        dsp_bytes = self.sample_rate * (4 + DSP_BYTES_PER_SAMPLE)
+        return int(duration * max(DECODE_BYTES_PER_SECOND, dsp_bytes))
+
+    def _reserve(self, duration):
+        """Reserves the footprint of a song in the memory budget, if there is one
+
+        Args:
+            duration (float): duration of the song in seconds
+
+        Returns:
+            context manager: holds the reservation for the body of a `with` block
+        """
+        if self.memory_budget is None:
+            return nullcontext()
+        return self.memory_budget.reserve(self.estimate_footprint(duration))
+
+    def _decode_song(self, song_name):
+        """Loads a song of the song directory
+
+        Args:
+            song_name (str): Song Name
+
+        Returns:
+            (numpy array, int): signal and its Sampling Rate
+        """
+        return self._load(os.path.join(self.song_dir, song_name))
+
+    def _compute_song(self, song_name, decoded):
+        """Resamples a decoded song if needed and computes its features
+
+        Args:
+            song_name (str): Song Name
+            decoded (numpy array, int): signal and its Sampling Rate
+
+        Returns:
+            (str, str, numpy array): genre, name and the features of the song
+        """
+        genre, name = self._parse_song_name(song_name)
+        signal, sr = self._resample(*decoded)
+
+        with self.metrics.timer("extract_dsp"):
+            return genre, name, self._compute_features(signal, sr)
+
+    def _segment_signal(self, signal, sr):
+        """Cuts a signal into consecutive `segment_duration` second segments, like the ffmpeg segmentation of SongDownloader does on disk
+
+        Args:
+            signal (numpy array): audio signal
+            sr (int): Sampling Rate
+
+        Returns:
+            (numpy array, numpy array): full segments of shape (n_segments, samples) and the shorter last segment, empty if there is none
+                or if it is shorter than a frame
+        """
+        segment_length = int(self.segment_duration * sr)
+        n_segments = len(signal) // segment_length
+
+        segments = signal[:n_segments * segment_length].reshape(n_segments, segment_length)
+        remainder = signal[n_segments * segment_length:]
+
+        if len(remainder) < self.frame_size:
+            remainder = remainder[:0]
+
+        return segments, remainder
+
+    def extract_signal(self, signal, sr):
+        """Computes features of every segment of a decoded signal, without storing them
+
+        Args:
+            signal (numpy array): audio signal
+            sr (int): Sampling Rate of the signal
+
+        Returns:
+            numpy array: features of each segment of shape (n_segments, n_columns), empty if the signal is shorter than a frame
+        """
+        signal, sr = self._resample(signal, sr)
+        segments, remainder = self._segment_signal(signal, sr)
+
+        with self.metrics.timer("extract_dsp"):
+            rows = [self.extract_features_batch(segments, sr)] if len(segments) else []
+            if len(remainder):
+                rows.append(self._compute_features(remainder, sr)[np.newaxis])
+
+        if not rows:
+            return np.empty((0, len(self.features) - 2), dtype=np.float32)
+        return np.concatenate(rows)
+
+    def extract_song(self, song_path, genre, song_name, duration=None):
+        """Extracts features of every segment of an original song. The song is decoded once and segments are cut from memory,
+        so no segment files are written. Rows are named as if the segments had been extracted from `segment_<n>`
+
+        Args:
+            song_path (str): path of the original song
+            genre (str): genre of the song
+            song_name (str): name of the song
+            duration (float, optional): duration of the song in seconds, used to estimate its footprint if `memory_limit` is set.
+                Defaults to None (read from the file).
+
+        Returns:
+            int: number of extracted segments
+        """
+        if self.memory_budget is not None and duration is None:
+            duration = librosa.get_duration(filename=song_path)
+
+        with self._reserve(duration):
+            rows = self.extract_signal(*self._load(song_path))
+        if not len(rows):
+            return 0
+
+        # Same names as segment files `<genre>_<segment>_<name>.mp3` would get
+        parsed = [self._parse_song_name(f"{genre}_{i:02d}_{song_name}.mp3") for i in range(len(rows))]
+        self._append_rows([name for _, name in parsed], [genre for genre, _ in parsed], rows)
+
+        # Rows of the whole song are cached as one entry, so that `load_song` finds them once the original was removed
+        if self.use_cache:
+            self._open_cache()
+            with self._pending_cache_lock:
+                self._pending_cache.append((self._song_key(genre, song_name), rows.ravel()))
+
+        return len(rows)
+
+    def _song_key(self, genre, song_name):
+        """Cache key of the rows of a song extracted by `extract_song`
+
+        Args:
+            genre (str): genre of the song
+            song_name (str): name of the song
+
+        Returns:
+            str: key of the song and segment duration
+        """
+        return FeatureCache.hash_name(f"{genre}/{song_name}/{self.segment_duration}")
+
+    def load_song(self, genre, song_name):
+        """Appends rows of a song cached by `extract_song` of an earlier run, without the original song
+
+        Args:
+            genre (str): genre of the song
+            song_name (str): name of the song
+
+        Returns:
+            int: number of appended segments, 0 if the song is not cached
+        """
+        if not self.use_cache:
+            return 0
+
+        cached = self._open_cache().get_many([self._song_key(genre, song_name)], self.cache_params)
+        if not cached:
+            return 0
+
+        rows = next(iter(cached.values())).reshape(-1, len(self.buffer.columns))
+        parsed = [self._parse_song_name(f"{genre}_{i:02d}_{song_name}.mp3") for i in range(len(rows))]
+        self.metrics.increment("extract_cache_hits", len(rows))
+        self._append_rows([name for _, name in parsed], [genre for genre, _ in parsed], rows)
+
+        return len(rows)
+
+    def _process_song(self, song_name):
+        """Loads a song and computes its features
+
+        Args:
+            song_name (str): Song Name
+
+        Returns:
+            (str, str, numpy array): genre, name and the features of the song
+        """
+        return self._compute_song(song_name, self._decode_song(song_name))
+
+    def _spectral_features(self, magnitude, sr, bandwidth=True):
+        """Calculates Spectral Centroid and Bandwidth from a magnitude spectrogram, the same way librosa does from the signal
+
+        Args:
+            magnitude (numpy array): Magnitude Spectrogram of shape (..., frame_size // 2 + 1, frames)
+            sr (int): Sampling Rate
+            bandwidth (bool, optional): compute the Bandwidth too. Defaults to True.
+
+        Returns:
+            (numpy array, numpy array): Spectral Centroid and Bandwidth of each frame, Bandwidth being None if not computed
+        """
+        frequencies = librosa.fft_frequencies(sr=sr, n_fft=self.frame_size).astype(magnitude.dtype)[:, np.newaxis]
+
+        # Normalizing each frame to sum to 1, leaving silent frames as they are
+        norm = magnitude.sum(axis=-2, keepdims=True)
+        norm[norm < np.finfo(magnitude.dtype).tiny] = 1
+        weights = magnitude / norm
+
+        SC = np.sum(frequencies * weights, axis=-2)
+        if not bandwidth:
+            return SC, None
+
+        BW = np.sqrt(np.sum(weights * (frequencies - SC[..., np.newaxis, :]) ** 2, axis=-2))
+
+        return SC, BW
+
+    def _mfcc(self, power_spectrogram, sr, coefficients=None):
+        """Calculates 13 MFCCs, or some of them, from a power spectrogram using cached mel filterbank and DCT matrices
+
+        Args:
+            power_spectrogram (numpy array): Power Spectrogram of shape (n_clips, n_fft // 2 + 1, frames)
+            sr (int): Sampling Rate
+            coefficients (list(int), optional): coefficients to compute. Defaults to None (all 13).
+
+        Returns:
+            numpy array: MFCCs of shape (n_clips, n_coefficients, frames)
+        """
+        n_fft = 2 * (power_spectrogram.shape[-2] - 1)
+
+        # tensordot runs as a single matrix product, a broadcasted matmul loops over the clips
+        mel_spectrogram = np.moveaxis(np.tensordot(_mel_basis(sr, n_fft), power_spectrogram, axes=([1], [-2])), 0, -2)
+
+        # Same as librosa.power_to_db with ref=1.0, amin=1e-10 and top_db=80, the maximum being taken per clip
+        log_mel = 10 * np.log10(np.maximum(mel_spectrogram, 1e-10))
+        log_mel = np.maximum(log_mel, log_mel.max(axis=(-2, -1), keepdims=True) - 80)
+
+        dct = _dct_matrix(13)
+        if coefficients is not None and len(coefficients) < 13:
+            dct = dct[coefficients]
+
+        return np.moveaxis(np.tensordot(dct, log_mel, axes=([1], [-2])), 0, -2)
+
+    def frame_level_features(self, signals, sr):
+        """Computes the frame level features needed by the selected columns for a batch of equal length signals, e.g. the segmented
+        clips of a song. Every frame level feature is computed for the whole batch at once with strided views and array reductions.
+
+        The STFT is computed once and shared by BER, SC, BW and, if `mfcc_n_fft` equals `frame_size`, MFCCs. Otherwise MFCCs need a
+        second STFT of size `mfcc_n_fft`. RMS, AE and ZCR are time domain features. Only frame level features, spectrograms and
+        MFCC coefficients needed by the selected columns are computed, e.g. no STFT of size `frame_size` if none of BER, SC and BW is selected.
+
+        Frame `i` of every feature is at sample `i * hop`, the hop being given by `frame_hops`
+
+        Args:
+            signals (numpy array): audio signals of shape (n_clips, samples)
+            sr (int): Sampling Rate
+
+        Returns:
+            dict: frame level features by name, e.g. `SC` or `MFCC3`, each of shape (n_clips, frames)
+        """
+        signals = np.asarray(signals, dtype=np.float32)
+        needed = self._frame_features
+        mfcc_shares_stft = self.mfcc_n_fft == self.frame_size
+
+        frame_features = {}
+
+        if needed & {"BER", "SC", "BW"} or (self._mfcc_coefficients and mfcc_shares_stft):
+            magnitude = np.abs(librosa.stft(signals, n_fft=self.frame_size, hop_length=self.hop_length))
+
+            if "BER" in needed or (self._mfcc_coefficients and mfcc_shares_stft):
+                power_spectrogram = magnitude ** 2
+
+            if "BER" in needed:
+                frame_features["BER"] = self._calculate_band_enery_ratio(power_spectrogram, sr)
+
+            if needed & {"SC", "BW"}:
+                frame_features["SC"], frame_features["BW"] = self._spectral_features(magnitude, sr, bandwidth="BW" in needed)
+
+        if "AE" in needed:
+            frame_features["AE"] = self._amplitude_envelope(signals)
+        if "RMS" in needed:
+            frame_features["RMS"] = self._root_mean_square(signals)
+        if "ZCR" in needed:
+            frame_features["ZCR"] = self._zero_crossing_rate(signals)
+
+        if self._mfcc_coefficients:
+            if mfcc_shares_stft:
+                mfcc_power_spectrogram = power_spectrogram
+            else:
+                mfcc_power_spectrogram = np.abs(librosa.stft(signals, n_fft=self.mfcc_n_fft, hop_length=512)) ** 2
+
+            MFCCs = self._mfcc(mfcc_power_spectrogram, sr, self._mfcc_coefficients) # -> (n_clips, n_coefficients, bins)
+            for i, n in enumerate(self._mfcc_coefficients):
+                frame_features[f"MFCC{n}"] = MFCCs[:, i]
+
+        # Frame level features not needed by any column, e.g. SC computed along BW, are left out
+        return {name: values for name, values in frame_features.items() if name in needed}
+
+    @property
+    def frame_hops(self):
+        """dict: number of samples between two frames of each frame level feature computed by `frame_level_features`
+        """
+        # RMS and MFCCs always use a hop of 512, see _root_mean_square
+        hops = {name: self.hop_length for name in ["AE", "ZCR", "BER", "SC", "BW"]}
+        hops["RMS"] = 512
+        hops.update({f"MFCC{n}": 512 for n in range(13)})
+
+        return {name: hop for name, hop in hops.items() if name in self._frame_features}
+
+    def extract_features_batch(self, signals, sr):
+        """Computes the features of a batch of equal length signals, e.g. the segmented clips of a song, as the Mean and Standard
+        Deviation of the frame level features of `frame_level_features`.
+
+        With `mfcc_n_fft` at its default the result matches the previous per feature librosa calls (librosa 0.9.2) within a relative
+        tolerance of 1e-4 (absolute tolerance of 1e-3 for values close to 0, e.g. MFCC means), the difference coming from float32
+        summation order only.
+
+        Args:
+            signals (numpy array): audio signals of shape (n_clips, samples)
+            sr (int): Sampling Rate
+
+        Returns:
+            numpy array: float32 matrix of shape (n_clips, n_columns), Mean or Standard Deviation of features in the order of `self.features`
+        """
+        frame_features = self.frame_level_features(signals, sr)
+
+        columns = []
+        for column in self.features[2:]:
+            name, statistic = column.rsplit("_", 1)
+
+            # BER of frames with no energy is NaN and left out of its statistics
+            if name == "BER":
+                reduce = np.nanmean if statistic == "Mean" else np.nanstd
+            else:
+                reduce = np.mean if statistic == "Mean" else np.std
+
+            columns.append(reduce(frame_features[name], axis=-1))
+
+        return np.column_stack(columns).astype(np.float32)
+
+    def _compute_features(self, signal, sr):
+        """Computes the features of a single signal
+
+        Args:
+            signal (numpy array): audio signal
+            sr (int): Sampling Rate
+
+        Returns:
+            numpy array: Mean and Standard Deviation of each feature, in the order of `self.features`
+        """
+        return self.extract_features_batch(signal[np.newaxis], sr)[0]
+
+    def _extract_features_per_sample(self, song_name):
+        """Extracts features for a single song and appends it to the buffer
+
+        Args:
+            song_name (str): Song Name
+        """
+        try:
+            # Segments are at most `segment_duration` long
+            with self._reserve(self.segment_duration):
+                result = self._process_song(song_name)
+        except Exception as e:
+            self._fail_song(song_name, e)
+            return
+
+        self._store_song_features(song_name, result)
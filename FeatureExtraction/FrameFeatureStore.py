@@ -0,0 +1,310 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from ColumnarDataset import ColumnarDataset, ColumnarWriter
+
+# Monitoring modules are shared with SongCollection
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Monitoring"))
+
+from ProgressReporter import ProgressReporter
+
+# Version of the store layout, stored in index.json
+FORMAT_VERSION = 1
+
+
+class FrameFeatureStore:
+
+    def __init__(self, store_dir, extractor):
+        """Frame level features of whole original songs, computed once per song so that features of any window length or hop can be
+        produced without segmenting and extracting songs again. Each song is stored in its own `.npz` file holding, for every group
+        of frame level features sharing a hop, the float32 frame values and prefix sums of the values, of their squares and of the
+        number of finite values (BER is NaN for silent frames). Mean and Standard Deviation of the frames of a window are then a
+        subtraction of two prefix sums, O(1) per window whatever its length.
+
+        Frames of a window are the frames of the song whose position falls in the window, so features of a window differ slightly
+        from features of the same segment extracted on its own: frames at the edges of the window see the neighbouring samples of the
+        song instead of padding, and the MFCC floor of 80 dB below the loudest frame is taken over the whole song
+
+        Args:
+            store_dir (str): directory of the store, created if missing
+            extractor (FeatureExtractor): extractor whose parameters and columns are used, songs of the store must have been
+                computed with the same parameters
+        """
+        self.store_dir = store_dir
+        self.extractor = extractor
+        self.sample_rate = extractor.sample_rate
+
+        # Frame level features grouped by hop, in the order of the columns of the extractor
+        self.groups = {}
+        for name, hop in extractor.frame_hops.items():
+            self.groups.setdefault(hop, []).append(name)
+
+        # (hop, index in its group, is Mean) of each column
+        self._column_plan = []
+        for column in extractor.features[2:]:
+            name, statistic = column.rsplit("_", 1)
+            hop = extractor.frame_hops[name]
+            self._column_plan.append((hop, self.groups[hop].index(name), statistic == "Mean"))
+
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(store_dir, "index.json")
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.songs = []
+        if os.path.isfile(self._index_path):
+            with open(self._index_path) as f:
+                index = json.load(f)
+
+            if index["version"] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported frame store version {index['version']}")
+            if index["params"] != extractor.cache_params:
+                raise ValueError(f"{store_dir} was computed with other parameters ({index['params']}), use another directory")
+
+            self.songs = index["songs"]
+
+        self._stored = {(song["genre"], song["name"]) for song in self.songs}
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __contains__(self, song):
+        genre, name = song
+        return (genre, name) in self._stored
+
+    def save(self):
+        """Writes the index of stored songs next to the target and moves it over it, so readers never see a partial index
+        """
+        with self._lock:
+            index = {
+                "version": FORMAT_VERSION,
+                "params": self.extractor.cache_params,
+                "sr": self.sample_rate,
+                "groups": {str(hop): names for hop, names in self.groups.items()},
+                "songs": list(self.songs),
+            }
+
+        temporary_path = self._index_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(temporary_path, self._index_path)
+
+    @staticmethod
+    def _prefix_sums(values):
+        """Prefix sums of a group of frame level features. Values are shifted by their mean first, so that sums of squares of features
+        far from 0 (e.g. MFCC0) do not lose the precision of the variance to cancellation
+
+        Args:
+            values (numpy array): frame level features of shape (n_frames, n_features), NaN for missing values
+
+        Returns:
+            (numpy array, numpy array, numpy array, numpy array): shift of each feature, and prefix sums of the shifted values, of
+                their squares and of the number of finite values, each of shape (n_frames + 1, n_features)
+        """
+        finite = np.isfinite(values)
+        counts = finite.sum(axis=0)
+
+        shift = np.divide(np.where(finite, values, 0).sum(axis=0, dtype=np.float64), counts, out=np.zeros(values.shape[1]), where=counts > 0)
+        shifted = np.where(finite, values - shift, 0).astype(np.float64)
+
+        def prefix(array, dtype):
+            return np.concatenate([np.zeros((1, array.shape[1]), dtype=dtype), np.cumsum(array, axis=0, dtype=dtype)])
+
+        return shift, prefix(shifted, np.float64), prefix(shifted ** 2, np.float64), prefix(finite, np.int32)
+
+    def add(self, genre, name, signal, sr):
+        """Computes frame level features of a song and stores them, replacing the song if it is stored already
+
+        Args:
+            genre (str): genre of the song
+            name (str): name of the song
+            signal (numpy array): audio signal of the whole song
+            sr (int): Sampling Rate of the signal
+
+        Returns:
+            bool: whether the song was stored, songs shorter than a frame are not
+        """
+        signal, sr = self.extractor._resample(signal, sr)
+        if len(signal) < self.extractor.frame_size:
+            return False
+
+        with self.extractor.metrics.timer("frames_dsp"):
+            frame_features = self.extractor.frame_level_features(signal[np.newaxis], sr)
+
+            arrays = {}
+            for hop, names in self.groups.items():
+                # Frame counts of features sharing a hop differ by one at most, e.g. AE frames are not centered
+                n_frames = min(frame_features[name].shape[-1] for name in names)
+                values = np.column_stack([frame_features[name][0, :n_frames] for name in names]).astype(np.float32)
+
+                arrays[f"values_{hop}"] = values
+                arrays[f"shift_{hop}"], arrays[f"sums_{hop}"], arrays[f"squares_{hop}"], arrays[f"counts_{hop}"] = self._prefix_sums(values)
+
+        with self._lock:
+            if (genre, name) in self._stored:
+                song = next(song for song in self.songs if (song["genre"], song["name"]) == (genre, name))
+            else:
+                song = {"genre": genre, "name": name, "file": f"{len(self.songs):06d}.npz"}
+                self.songs.append(song)
+                self._stored.add((genre, name))
+            song["n_samples"] = len(signal)
+
+        path = os.path.join(self.store_dir, song["file"])
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+        self.extractor.metrics.increment("frames_songs")
+        self.extractor.metrics.increment("frames_audio_seconds", len(signal) / sr)
+        return True
+
+    def add_song(self, song_path, genre, name):
+        """Decodes a song and stores its frame level features
+
+        Args:
+            song_path (str): path of the original song
+            genre (str): genre of the song
+            name (str): name of the song
+
+        Returns:
+            bool: whether the song was stored
+        """
+        return self.add(genre, name, *self.extractor._load(song_path))
+
+    def build(self, songs, save_every=20):
+        """Stores frame level features of songs that are not stored yet, `n_threads` of the extractor at a time. Failed songs are
+        reported and skipped
+
+        Args:
+            songs (list((str, str, str))): path, genre and name of each original song
+            save_every (int, optional): number of stored songs between two writes of the index. Defaults to 20.
+
+        Returns:
+            list((str, Exception)): path and error of each failed song
+        """
+        songs = [(path, genre, name) for path, genre, name in songs if (genre, name) not in self]
+        failed = []
+
+        progress = ProgressReporter(len(songs), prefix="Frames:")
+        with ThreadPoolExecutor(max_workers=self.extractor.n_threads) as thread:
+            futures = {thread.submit(self.add_song, *song): song[0] for song in songs}
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    future.result()
+                    progress.update()
+                except Exception as e:
+                    failed.append((futures[future], e))
+                    self.extractor.metrics.increment("frames_errors", type=type(e).__name__)
+                    progress.update(failed=1)
+
+                if done % save_every == 0:
+                    self.save()
+
+        progress.close()
+        self.save()
+
+        return failed
+
+    def build_from_manifest(self):
+        """Stores frame level features of every original song recorded in the segment manifest of SongDownloader that is still on disk
+
+        Returns:
+            list((str, Exception)): path and error of each failed song
+        """
+        from SongCollection.SegmentManifest import SegmentManifest
+
+        manifest = SegmentManifest(self.extractor.manifest_path)
+        songs = [(path, genre, name) for path, genre, name in manifest.get_originals() if os.path.isfile(path)]
+        manifest.close()
+
+        return self.build(songs)
+
+    def _window_bounds(self, n_samples, window_duration, hop_duration, keep_partial):
+        """Start and end samples of the windows of a song
+
+        Args:
+            n_samples (int): length of the song
+            window_duration (float): length of each window in seconds
+            hop_duration (float): seconds between the start of two windows
+            keep_partial (bool): keep a last window cut short by the end of the song, if it is at least a frame long
+
+        Returns:
+            (numpy array, numpy array): start and end of each window
+        """
+        window_length = int(window_duration * self.sample_rate)
+        hop = int(hop_duration * self.sample_rate)
+
+        starts = np.arange(0, n_samples - window_length + 1, hop, dtype=np.int64)
+
+        # Same as the remainder FeatureExtractor.extract_signal keeps after the full segments
+        next_start = starts[-1] + hop if len(starts) else 0
+        if keep_partial and n_samples - next_start >= self.extractor.frame_size:
+            starts = np.append(starts, next_start)
+
+        return starts, np.minimum(starts + window_length, n_samples)
+
+    def window_features(self, song, window_duration, hop_duration=None, keep_partial=True):
+        """Computes features of the windows of a stored song from its prefix sums
+
+        Args:
+            song (dict): entry of `songs`
+            window_duration (float): length of each window in seconds, e.g. a segment duration
+            hop_duration (float, optional): seconds between the start of two windows. Defaults to None (consecutive windows, like segments).
+            keep_partial (bool, optional): keep a last window cut short by the end of the song. Defaults to True.
+
+        Returns:
+            numpy array: float32 matrix of shape (n_windows, n_columns) in the order of the columns of the extractor
+        """
+        starts, ends = self._window_bounds(song["n_samples"], window_duration, hop_duration or window_duration, keep_partial)
+
+        statistics = {}
+        with np.load(os.path.join(self.store_dir, song["file"])) as arrays:
+            for hop in self.groups:
+                shift, sums, squares, counts = (arrays[f"{array}_{hop}"] for array in ["shift", "sums", "squares", "counts"])
+                n_frames = len(counts) - 1
+
+                # Frames whose position falls in the window, frame `i` being at sample `i * hop`
+                first = np.minimum(-(-starts // hop), n_frames)
+                last = np.minimum(ends // hop + 1, n_frames)
+
+                count = counts[last] - counts[first]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = (sums[last] - sums[first]) / count
+                    variance = (squares[last] - squares[first]) / count - mean ** 2
+
+                # Windows without any finite frame are NaN, like np.nanmean
+                statistics[hop] = (mean + shift, np.sqrt(np.maximum(variance, 0)))
+
+        if not len(starts):
+            return np.empty((0, len(self._column_plan)), dtype=np.float32)
+
+        return np.column_stack([statistics[hop][0 if is_mean else 1][:, i] for hop, i, is_mean in self._column_plan]).astype(np.float32)
+
+    def to_dataset(self, dataset_dir, window_duration, hop_duration=None, keep_partial=True):
+        """Writes features of the windows of every stored song into a columnar dataset (see ColumnarDataset), rows being named like the
+        segments of `window_duration` seconds FeatureExtractor would have extracted
+
+        Args:
+            dataset_dir (str): directory of the dataset
+            window_duration (float): length of each window in seconds
+            hop_duration (float, optional): seconds between the start of two windows. Defaults to None (consecutive windows).
+            keep_partial (bool, optional): keep a last window cut short by the end of each song. Defaults to True.
+
+        Returns:
+            ColumnarDataset: the written dataset
+        """
+        writer = ColumnarWriter(dataset_dir, self.extractor.features[2:])
+
+        for song in self.songs:
+            rows = self.window_features(song, window_duration, hop_duration, keep_partial)
+
+            # Same names as segment files `<genre>_<segment>_<name>.mp3` would get
+            parsed = [self.extractor._parse_song_name(f"{song['genre']}_{i:02d}_{song['name']}.mp3") for i in range(len(rows))]
+            writer.write([name for _, name in parsed], [genre for genre, _ in parsed], rows)
+
+        return ColumnarDataset(writer.close())
@@ -0,0 +1,100 @@
+import os
+import time
+
+# Compiled kernels are kept in the cache directory of the user, so every run and every worker process reuses them
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "MusicGenreClassification", "numba")
+
+# Releases of resampy whose kernels `_cache_resampy_kernels` replaces, checked against their resampy/interpn.py
+RESAMPY_VERSIONS = ("0.4.2", "0.4.3")
+
+_enabled = False
+
+
+def enable(cache_dir=None):
+    """Makes numba keep compiled kernels on disk, so that only the first process ever pays JIT compilation. Called by the commands
+    of main.py, by worker processes and by `warmup`, importing FeatureExtractor does not call it. Kernels of librosa are only covered
+    if it is called before librosa is imported, the cache directory being inherited by child processes through NUMBA_CACHE_DIR.
+
+    Kernels of librosa are compiled with `cache=True` but are cached next to librosa, which is often not writable. Kernels of resampy,
+    used by the default `kaiser_best` resampler, are not cached at all and take over a second to compile in every process, so they
+    are compiled again here with `cache=True`, on the releases of RESAMPY_VERSIONS only
+
+    Args:
+        cache_dir (str, optional): directory of compiled kernels. Defaults to None (NUMBA_CACHE_DIR if set, else DEFAULT_CACHE_DIR).
+    """
+    global _enabled
+
+    if _enabled:
+        return
+    _enabled = True
+
+    cache_dir = cache_dir or os.environ.get("NUMBA_CACHE_DIR") or DEFAULT_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["NUMBA_CACHE_DIR"] = cache_dir
+
+    import numba
+
+    # numba reads NUMBA_CACHE_DIR once, when it is first imported
+    numba.config.CACHE_DIR = cache_dir
+
+    _cache_resampy_kernels()
+
+
+def _cache_resampy_kernels():
+    """Replaces the resampling kernels of resampy with the same kernels compiled with `cache=True`. These are private functions of
+    resampy, so nothing is replaced if resampy is not installed, is not a release of RESAMPY_VERSIONS or its kernels are not where expected
+    """
+    try:
+        import numba
+        import resampy
+        from resampy import core, interpn
+    except ImportError:
+        return
+
+    if resampy.__version__ not in RESAMPY_VERSIONS:
+        return
+
+    resample_loop = getattr(interpn, "_resample_loop", None)
+    if resample_loop is None or not hasattr(core, "resample_f_s") or not hasattr(core, "resample_f_p"):
+        return
+
+    # Same kernels and signatures as resampy/interpn.py
+    resample_loop_s = numba.jit(nopython=True, nogil=True, parallel=False, cache=True)(resample_loop)
+    resample_loop_p = numba.jit(nopython=True, nogil=True, parallel=True, cache=True)(resample_loop)
+
+    @numba.guvectorize("(n),(m),(p),(p),(),()->(m)", nopython=True, cache=True)
+    def resample_f_s(x, t_out, interp_win, interp_delta, num_table, scale, y):
+        resample_loop_s(x, t_out, interp_win, interp_delta, num_table, scale, y)
+
+    @numba.guvectorize("(n),(m),(p),(p),(),()->(m)", nopython=True, cache=True)
+    def resample_f_p(x, t_out, interp_win, interp_delta, num_table, scale, y):
+        resample_loop_p(x, t_out, interp_win, interp_delta, num_table, scale, y)
+
+    core.resample_f_s = resample_f_s
+    core.resample_f_p = resample_f_p
+
+
+def warmup(extractor, source_rate=44100):
+    """Runs resampling and every feature of an extractor on a short synthetic signal, so that every kernel on the feature path is
+    compiled and written to the cache
+
+    Args:
+        extractor (FeatureExtractor): extractor whose parameters are warmed up
+        source_rate (int, optional): Sampling Rate of the synthetic signal, resampled to the rate of the extractor. Defaults to 44100.
+
+    Returns:
+        float: seconds taken
+    """
+    import numpy as np
+
+    enable()
+    start = time.perf_counter()
+
+    # Two seconds of noise, long enough for a full MFCC frame at every frame size
+    signal = np.random.default_rng(0).uniform(-0.5, 0.5, 2 * source_rate).astype(np.float32)
+    signal, sr = extractor._resample(signal, source_rate)
+
+    extractor._compute_features(signal, sr)
+    extractor.extract_features_batch(signal[np.newaxis], sr)
+
+    return time.perf_counter() - start
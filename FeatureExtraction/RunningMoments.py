@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class RunningMoments:
+
+    def __init__(self, n_features):
+        """Running count, mean and sum of squared deviations of several features, updated one batch of frames at a time by merging
+        the moments of the batch into the running ones (Welford's online algorithm, in the parallel form of Chan et al.). Memory does
+        not depend on the number of frames seen and NaN values are left out, like np.nanmean and np.nanstd do
+
+        Args:
+            n_features (int): number of features
+        """
+        self.count = np.zeros(n_features, dtype=np.int64)
+        self._mean = np.zeros(n_features, dtype=np.float64)
+        self._m2 = np.zeros(n_features, dtype=np.float64)
+
+    def update(self, values, columns=slice(None)):
+        """Adds a batch of frames
+
+        Args:
+            values (numpy array): values of shape (n_frames, n_columns)
+            columns (slice or list(int), optional): features the columns of `values` belong to. Defaults to all features.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        valid = ~np.isnan(values)
+        batch_count = valid.sum(axis=0)
+        if not batch_count.any():
+            return
+
+        with np.errstate(invalid='ignore'):
+            batch_mean = np.where(batch_count > 0, np.nansum(values, axis=0) / np.maximum(batch_count, 1), 0.0)
+        batch_m2 = np.nansum((values - batch_mean) ** 2, axis=0)
+
+        count = self.count[columns]
+        mean = self._mean[columns]
+        total = count + batch_count
+
+        delta = batch_mean - mean
+        ratio = np.divide(batch_count, total, out=np.zeros(len(total)), where=total > 0)
+
+        self._mean[columns] = mean + delta * ratio
+        self._m2[columns] = self._m2[columns] + batch_m2 + delta ** 2 * count * ratio
+        self.count[columns] = total
+
+    @property
+    def mean(self):
+        """numpy array: mean of each feature, NaN for features without any value
+        """
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    @property
+    def std(self):
+        """numpy array: population standard deviation of each feature, like np.std, NaN for features without any value
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, np.sqrt(self._m2 / self.count), np.nan)
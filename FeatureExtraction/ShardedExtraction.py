@@ -0,0 +1,290 @@
+import os
+import socket
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ColumnarDataset import ColumnarWriter
+from FeatureBuffer import FeatureBuffer
+import JitCache
+from FeatureExtractor import FeatureExtractor
+from WorkQueue import WorkQueue
+
+
+def _run_worker(queue_path, shard_dir, n_threads, song_dir):
+    """Runs a worker inside a local worker process
+
+    Args:
+        queue_path (str): path of the work queue
+        shard_dir (str): directory of the result shards
+        n_threads (int): songs extracted at once
+        song_dir (str): song directory, None for the one of the coordinator
+
+    Returns:
+        (int, dict): number of items done and metrics of the worker
+    """
+    warnings.filterwarnings('ignore')
+    JitCache.enable()
+
+    sharded = ShardedExtraction(queue_path, shard_dir)
+    extractor = sharded.make_extractor(n_threads, song_dir)
+    n_items = sharded.work(extractor)
+    sharded.close()
+
+    return n_items, extractor.metrics.drain()
+
+
+class ShardedExtraction:
+
+    def __init__(self, queue_path, shard_dir=None):
+        """Feature extraction split across any number of worker processes on any number of machines, coordinated through a WorkQueue
+        on a shared directory. The coordinator splits the song list into items of a few songs, workers lease items, extract their songs
+        and write the rows of each item into its own shard, and the merge step writes the shards of every item into data.csv and the
+        columnar dataset, in the order of the song list whatever order items were extracted in.
+
+        A crashed worker loses nothing but its current item, which is leased again once its lease expires. An item extracted twice
+        writes the same shard twice, shards being moved into place in one step
+
+        Args:
+            queue_path (str): path of the SQLite work queue, on a directory every worker can reach
+            shard_dir (str, optional): directory of the result shards. Defaults to None (`shards` next to the queue).
+        """
+        self.queue_path = queue_path
+        self.shard_dir = shard_dir or os.path.join(os.path.dirname(os.path.abspath(queue_path)), "shards")
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+        self.queue = WorkQueue(queue_path)
+
+        # Leases of every worker last as long as the coordinator decided
+        self.queue.lease_seconds = self.queue.get_meta("lease_seconds", self.queue.lease_seconds)
+        self.queue.max_attempts = self.queue.get_meta("max_attempts", self.queue.max_attempts)
+
+    def coordinate(self, extractor, item_size=20, lease_seconds=300, max_attempts=3):
+        """Starts a new run: queues the songs of the song directory of an extractor and removes shards of a previous run.
+        Workers build their extractor with the parameters of this one
+
+        Args:
+            extractor (FeatureExtractor): extractor whose songs, parameters and output are used
+            item_size (int, optional): number of songs of each work item. Defaults to 20.
+            lease_seconds (float, optional): seconds a lease lasts without being renewed by its worker. Defaults to 300.
+            max_attempts (int, optional): number of leases of an item before it is given up. Defaults to 3.
+
+        Returns:
+            int: number of queued items
+        """
+        song_list = [str(song_name) for song_name in extractor._get_song_list()]
+        items = [song_list[i:i+item_size] for i in range(0, len(song_list), item_size)]
+
+        for shard_path in FeatureBuffer.get_shards(self.shard_dir):
+            os.remove(shard_path)
+
+        meta = {
+            "params": extractor._worker_params(),
+            "song_dir": extractor.song_dir,
+            "root_dir": extractor.root_dir,
+            "output_format": extractor.output_format,
+            "manifest_path": extractor.manifest_path if extractor.manifest is not None else None,
+            "lease_seconds": lease_seconds,
+            "max_attempts": max_attempts,
+        }
+        self.queue.reset(items, meta)
+
+        self.queue.lease_seconds = lease_seconds
+        self.queue.max_attempts = max_attempts
+
+        return len(items)
+
+    def make_extractor(self, n_threads=4, song_dir=None):
+        """Builds an extractor with the parameters of the coordinator
+
+        Args:
+            n_threads (int, optional): songs extracted at once. Defaults to 4.
+            song_dir (str, optional): song directory, if it is mounted elsewhere on this machine. Defaults to None (the one of the coordinator).
+
+        Returns:
+            FeatureExtractor: the extractor
+        """
+        params = self.queue.get_meta("params")
+        if params is None:
+            raise ValueError(f"{self.queue_path} has no run, start one with coordinate")
+
+        extractor = FeatureExtractor(**{**params, "n_threads": n_threads})
+        extractor.song_dir = song_dir or self.queue.get_meta("song_dir")
+
+        return extractor
+
+    def _extract_item(self, extractor, item_id, song_names):
+        """Extracts the songs of an item and writes their rows into the shard of the item
+
+        Args:
+            extractor (FeatureExtractor): extractor of the worker
+            item_id (int): id of the item
+            song_names (list(str)): names of songs in the song directory
+
+        Returns:
+            dict: file name of the shard, number of rows and songs that failed
+        """
+        def process(song_name):
+            try:
+                return extractor._process_song(song_name)
+            except Exception as e:
+                extractor.metrics.increment("extract_errors", type=type(e).__name__)
+                return None
+
+        with ThreadPoolExecutor(max_workers=extractor.n_threads) as thread:
+            results = list(thread.map(process, song_names))
+
+        buffer = FeatureBuffer(extractor.features[2:])
+        for genre, name, features in (result for result in results if result is not None):
+            buffer.append(name, genre, features)
+
+        # Written next to its final path and moved into place, so the merge never reads a partial shard
+        shard_name = f"shard_{item_id:06d}.csv"
+        shard_path = os.path.join(self.shard_dir, shard_name)
+        buffer.to_dataframe().to_csv(shard_path + ".tmp", index=False)
+        os.replace(shard_path + ".tmp", shard_path)
+
+        extractor.metrics.increment("extract_rows", len(buffer))
+        return {"shard": shard_name, "rows": len(buffer), "failed": [song_name for song_name, result in zip(song_names, results) if result is None]}
+
+    def work(self, extractor, worker=None, poll_interval=5, max_items=None):
+        """Leases and extracts items till every item is done or failed. The lease of the current item is renewed in the background,
+        and the worker waits for items leased by other workers, which come back to the queue if their worker crashes
+
+        Args:
+            extractor (FeatureExtractor): extractor built by `make_extractor`
+            worker (str, optional): id of the worker. Defaults to None (`<host>:<pid>`).
+            poll_interval (float, optional): seconds between two checks for expired leases of other workers. Defaults to 5.
+            max_items (int, optional): stop after this many items. Defaults to None (no limit).
+
+        Returns:
+            int: number of items done by this worker
+        """
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        n_items = 0
+
+        while max_items is None or n_items < max_items:
+            claimed = self.queue.claim(worker)
+            if claimed is None:
+                if self.queue.is_finished():
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            item_id, song_names = claimed
+
+            # Renewing the lease three times per lease duration, so one late renewal does not lose it
+            stop = threading.Event()
+            def renew_lease():
+                while not stop.wait(self.queue.lease_seconds / 3):
+                    if not self.queue.renew(item_id, worker):
+                        return
+            heartbeat = threading.Thread(target=renew_lease, daemon=True)
+            heartbeat.start()
+
+            try:
+                with extractor.metrics.timer("queue_item"):
+                    result = self._extract_item(extractor, item_id, song_names)
+            except Exception as e:
+                self.queue.fail(item_id, worker, f"{type(e).__name__}: {e}")
+                extractor.metrics.increment("queue_items", state="failed")
+                continue
+            finally:
+                stop.set()
+                heartbeat.join()
+
+            # The lease expired and the item went to another worker, which writes the same shard
+            if not self.queue.complete(item_id, worker, result):
+                extractor.metrics.increment("queue_items", state="lost")
+                continue
+
+            extractor.metrics.increment("queue_items", state="done")
+            n_items += 1
+
+        return n_items
+
+    def work_locally(self, n_processes, n_threads=4, song_dir=None, metrics=None):
+        """Runs workers in local processes till every item is done or failed, e.g. to test a run on one machine
+
+        Args:
+            n_processes (int): number of worker processes
+            n_threads (int, optional): songs extracted at once by each worker. Defaults to 4.
+            song_dir (str, optional): song directory. Defaults to None (the one of the coordinator).
+            metrics (Metrics, optional): metrics the metrics of every worker are merged into. Defaults to None.
+
+        Returns:
+            int: number of items done
+        """
+        with ProcessPoolExecutor(max_workers=n_processes) as pool:
+            futures = [pool.submit(_run_worker, self.queue_path, self.shard_dir, n_threads, song_dir) for _ in range(n_processes)]
+            results = [future.result() for future in futures]
+
+        if metrics is not None:
+            for _, snapshot in results:
+                metrics.merge(snapshot)
+
+        return sum(n_items for n_items, _ in results)
+
+    def merge(self, root_dir=None, output_format=None, allow_unfinished=False):
+        """Writes rows of every done item into data.csv and the columnar dataset, in the order items were queued, and records
+        extracted and failed songs in the segment manifest
+
+        Args:
+            root_dir (str, optional): directory data.csv and `dataset` are written to. Defaults to None (the one of the coordinator).
+            output_format (str, optional): `csv`, `columnar` or `both`. Defaults to None (the one of the coordinator).
+            allow_unfinished (bool, optional): merge even if some items are still pending or leased. Defaults to False.
+
+        Returns:
+            (int, list(str)): number of merged rows and songs that were not extracted
+        """
+        if not allow_unfinished and not self.queue.is_finished():
+            raise ValueError(f"Items of {self.queue_path} are still pending or leased: {self.queue.counts()}")
+
+        root_dir = root_dir or self.queue.get_meta("root_dir")
+        output_format = output_format or self.queue.get_meta("output_format")
+
+        shards, extracted, failed = [], [], []
+        for _, state, song_names, result, _ in self.queue.get_items():
+            if state != "done":
+                failed.extend(song_names)
+                continue
+
+            shards.append(os.path.join(self.shard_dir, result["shard"]))
+            failed.extend(result["failed"])
+            extracted.extend(song_name for song_name in song_names if song_name not in result["failed"])
+
+        n_rows = 0
+        if output_format in ("csv", "both"):
+            n_rows = FeatureBuffer.merge_shards(self.shard_dir, os.path.join(root_dir, "data.csv"), remove=False, shards=shards)
+
+        if output_format in ("columnar", "both"):
+            writer = None
+            for shard_path in shards:
+                shard = pd.read_csv(shard_path, keep_default_na=False, na_values=[""], dtype={"Name": str, "Genre": str})
+                if writer is None:
+                    writer = ColumnarWriter(os.path.join(root_dir, "dataset"), [column for column in shard.columns if column not in ("Name", "Genre")])
+                writer.write(shard["Name"].tolist(), shard["Genre"].tolist(), shard[writer.columns].to_numpy(dtype=np.float32))
+
+            if writer is not None:
+                n_rows = writer.n_rows
+                writer.close()
+
+        manifest_path = self.queue.get_meta("manifest_path")
+        if manifest_path is not None and os.path.isfile(manifest_path):
+            from SongCollection.SegmentManifest import SegmentManifest
+
+            manifest = SegmentManifest(manifest_path)
+            manifest.set_segment_state(extracted, "extracted")
+            manifest.set_segment_state(failed, "failed")
+            manifest.close()
+
+        return n_rows, failed
+
+    def close(self):
+        """Closes the work queue
+        """
+        self.queue.close()
@@ -0,0 +1,259 @@
+import subprocess
+
+import librosa
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from FeatureExtractor import _dct_matrix, _mel_basis
+from RunningMoments import RunningMoments
+
+# Order of the frame level features, their Mean and Std interleaved give the 38 features of FeatureExtractor
+FRAME_FEATURES = ["AE", "RMS", "ZCR", "BER", "SC", "BW", *[f"MFCC{n}" for n in range(13)]]
+
+
+class StreamingExtractor:
+
+    def __init__(self, extractor, window_duration=None):
+        """Computes the features of FeatureExtractor over an audio stream fed in chunks, with memory that does not grow with the
+        length of the stream. Frame level features of each chunk are merged into running moments and dropped, only the samples of
+        frames that are not complete yet are carried over to the next chunk.
+
+        Frames are not centered, so that no frame needs samples from before the stream or after the current chunk, and the MFCC
+        floor of 80 dB below the loudest frame uses the loudest frame seen so far. Features of a clip fed at once therefore differ
+        slightly from FeatureExtractor.extract_features_batch, by the few frames at its edges
+
+        Args:
+            extractor (FeatureExtractor): extractor whose parameters (frame size, hop length, split frequency, MFCC FFT size and sampling rate) are used
+            window_duration (float, optional): if given, features are also computed per consecutive window of this many seconds, e.g. the
+                segment duration the model was trained on. Defaults to None (whole stream only).
+        """
+        self.extractor = extractor
+        self.sr = extractor.sample_rate
+
+        # Every frame level feature is kept as running moments, only the columns of the extractor are returned
+        self.column_indices = [extractor._create_feature_list().index(column) - 2 for column in extractor.features[2:]]
+        self.window_length = int(window_duration * self.sr) if window_duration else None
+
+        # (frame length, hop) of each frame grid, frames of a grid are computed together
+        self.grids = {
+            "spectrum": (extractor.frame_size, extractor.hop_length), # AE, ZCR, BER, SC, BW
+            "rms": (extractor.hop_length, 512), # RMS, same frame length and hop as FeatureExtractor._root_mean_square
+            "mfcc": (extractor.mfcc_n_fft, 512),
+        }
+        self._windows = {
+            "spectrum": librosa.filters.get_window("hann", extractor.frame_size, fftbins=True).astype(np.float32),
+            "mfcc": librosa.filters.get_window("hann", extractor.mfcc_n_fft, fftbins=True).astype(np.float32),
+        }
+
+        self.reset()
+
+    def reset(self):
+        """Forgets the stream fed so far
+        """
+        # Samples not used by every grid yet, starting at sample `_buffer_start` of the stream
+        self._buffer = np.empty(0, dtype=np.float32)
+        self._buffer_start = 0
+
+        # Start of the next frame of each grid
+        self._next_start = {grid: 0 for grid in self.grids}
+
+        # Loudest log mel power seen so far, used for the 80 dB floor of MFCCs
+        self._max_log_mel = -np.inf
+
+        self.samples_seen = 0
+        self.moments = RunningMoments(len(FRAME_FEATURES))
+        self._window_moments = {}
+
+    def _spectrum_features(self, frames):
+        """Computes AE, ZCR, BER, SC and BW of frames
+
+        Args:
+            frames (numpy array): frames of shape (n_frames, frame_size)
+
+        Returns:
+            numpy array: features of shape (n_frames, 5)
+        """
+        AE = frames.max(axis=-1)
+
+        # Values close to 0 count as positive, as in librosa.zero_crossings
+        signbit = np.signbit(np.where(np.abs(frames) <= 1e-10, 0, frames))
+        ZCR = np.count_nonzero(signbit[:, 1:] != signbit[:, :-1], axis=-1) / frames.shape[-1]
+
+        magnitude = np.abs(np.fft.rfft(frames * self._windows["spectrum"], axis=-1)).T.astype(np.float32)
+        BER = self.extractor._calculate_band_enery_ratio(magnitude ** 2, self.sr)
+        SC, BW = self.extractor._spectral_features(magnitude, self.sr)
+
+        return np.column_stack([AE, ZCR, BER, SC, BW])
+
+    def _mfcc_features(self, frames):
+        """Computes 13 MFCCs of frames
+
+        Args:
+            frames (numpy array): frames of shape (n_frames, mfcc_n_fft)
+
+        Returns:
+            numpy array: MFCCs of shape (n_frames, 13)
+        """
+        power_spectrogram = np.abs(np.fft.rfft(frames * self._windows["mfcc"], axis=-1)) ** 2
+        mel_spectrogram = power_spectrogram.astype(np.float32) @ _mel_basis(self.sr, frames.shape[-1]).T
+
+        log_mel = 10 * np.log10(np.maximum(mel_spectrogram, 1e-10))
+        self._max_log_mel = max(self._max_log_mel, float(log_mel.max()))
+        log_mel = np.maximum(log_mel, self._max_log_mel - 80)
+
+        return log_mel @ _dct_matrix(13).T
+
+    def _grid_frames(self, grid):
+        """Takes the complete frames of a grid out of the buffer
+
+        Args:
+            grid (str): name of the grid
+
+        Returns:
+            (numpy array, numpy array): frames of shape (n_frames, frame_length) and start of each frame in the stream
+        """
+        frame_length, hop = self.grids[grid]
+        offset = self._next_start[grid] - self._buffer_start
+
+        if len(self._buffer) - offset < frame_length:
+            return np.empty((0, frame_length), dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        frames = sliding_window_view(self._buffer[offset:], frame_length)[::hop]
+        starts = self._next_start[grid] + hop * np.arange(len(frames))
+        self._next_start[grid] += hop * len(frames)
+
+        return frames, starts
+
+    def _update(self, values, starts, columns):
+        """Merges frame level features into the moments of the stream and of the windows the frames start in
+
+        Args:
+            values (numpy array): features of shape (n_frames, n_columns)
+            starts (numpy array): start of each frame in the stream
+            columns (list(int)): index of each column in FRAME_FEATURES
+        """
+        self.moments.update(values, columns)
+
+        if self.window_length is None:
+            return
+
+        window_indices = starts // self.window_length
+        for window_index in np.unique(window_indices):
+            if window_index not in self._window_moments:
+                self._window_moments[window_index] = RunningMoments(len(FRAME_FEATURES))
+            self._window_moments[window_index].update(values[window_indices == window_index], columns)
+
+    def _pop_windows(self, final=False):
+        """Removes windows no frame can be added to anymore
+
+        Args:
+            final (bool, optional): the stream ended, every window is complete. Defaults to False.
+
+        Returns:
+            list((float, float, numpy array)): start and end in seconds and the features of each completed window
+        """
+        completed = []
+        next_start = min(self._next_start.values())
+
+        for window_index in sorted(self._window_moments):
+            window_end = (window_index + 1) * self.window_length
+            if not final and next_start < window_end:
+                break
+
+            moments = self._window_moments.pop(window_index)
+            end = min(window_end, self.samples_seen)
+            completed.append((window_index * self.window_length / self.sr, end / self.sr, self._to_features(moments)))
+
+        return completed
+
+    def _to_features(self, moments):
+        """Interleaves means and standard deviations like FeatureExtractor.extract_features_batch
+
+        Args:
+            moments (RunningMoments): moments of the frame level features
+
+        Returns:
+            numpy array: float32 array of the features of the extractor
+        """
+        features = np.stack([moments.mean, moments.std], axis=-1).reshape(-1).astype(np.float32)
+        return features[self.column_indices]
+
+    def feed(self, samples):
+        """Adds a chunk of the stream
+
+        Args:
+            samples (numpy array): mono samples at `sample_rate` of the extractor
+
+        Returns:
+            list((float, float, numpy array)): start and end in seconds and the features of each window completed by this chunk
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        self._buffer = np.concatenate([self._buffer, samples])
+        self.samples_seen += len(samples)
+
+        frames, starts = self._grid_frames("spectrum")
+        if len(frames):
+            self._update(self._spectrum_features(frames), starts, [0, 2, 3, 4, 5])
+
+        frames, starts = self._grid_frames("rms")
+        if len(frames):
+            RMS = np.sqrt(np.mean(frames ** 2, axis=-1))
+            self._update(RMS[:, np.newaxis], starts, [1])
+
+        frames, starts = self._grid_frames("mfcc")
+        if len(frames):
+            self._update(self._mfcc_features(frames), starts, list(range(6, 19)))
+
+        # Samples before the next frame of every grid are not needed anymore
+        keep_from = min(self._next_start.values())
+        self._buffer = self._buffer[keep_from - self._buffer_start:].copy()
+        self._buffer_start = keep_from
+
+        return self._pop_windows() if self.window_length else []
+
+    def flush(self):
+        """Ends the stream. Samples too few for a complete frame are left out
+
+        Returns:
+            list((float, float, numpy array)): start and end in seconds and the features of each remaining window
+        """
+        return self._pop_windows(final=True) if self.window_length else []
+
+    def features(self):
+        """Features of the whole stream fed so far
+
+        Returns:
+            numpy array: float32 array of the features of the extractor
+        """
+        return self._to_features(self.moments)
+
+    @staticmethod
+    def iter_chunks(song_path, sr=22050, chunk_duration=1.0):
+        """Decodes an audio file or stream chunk by chunk with ffmpeg, so that it never has to be in memory at once
+
+        Args:
+            song_path (str): path or url of the audio, `-` reads it from standard input
+            sr (int, optional): Sampling Rate to decode at. Defaults to 22050.
+            chunk_duration (float, optional): duration in seconds of each chunk. Defaults to 1.0.
+
+        Yields:
+            numpy array: mono float32 samples of each chunk
+        """
+        chunk_bytes = int(chunk_duration * sr) * 4
+
+        process = subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", "-i", "pipe:0" if song_path == "-" else song_path, "-f", "f32le", "-ac", "1", "-ar", str(sr), "pipe:1"],
+            stdout=subprocess.PIPE,
+            stdin=None if song_path == "-" else subprocess.DEVNULL,
+        )
+
+        try:
+            while True:
+                data = process.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
@@ -0,0 +1,239 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class WorkQueue:
+
+    def __init__(self, queue_path, lease_seconds=300, max_attempts=3):
+        """Queue of work items stored in a SQLite database, shared by any number of worker processes on any number of machines through
+        a shared directory, without a broker. A worker claims an item by taking a lease on it and renews the lease while working. Items
+        whose lease expired, e.g. because their worker crashed, are claimed again by the next worker, up to `max_attempts` times.
+
+        Every claim runs in an immediate transaction, so two workers never lease the same item. The rollback journal is used instead of
+        WAL, which does not work on network file systems
+
+        Args:
+            queue_path (str): path of the SQLite database
+            lease_seconds (float, optional): seconds a lease lasts without being renewed. Defaults to 300.
+            max_attempts (int, optional): number of leases of an item before it is marked as failed. Defaults to 3.
+        """
+        self.queue_path = queue_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        # Transactions are opened explicitly, waiting up to a minute for other processes holding the database
+        self._connection = sqlite3.connect(queue_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS items_state ON items (state);
+            """
+        )
+
+    def _transaction(self, statements):
+        """Runs statements in an immediate transaction, which holds the write lock of the database from its start
+
+        Args:
+            statements (function): called with the connection inside the transaction
+
+        Returns:
+            object: result of `statements`
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._connection)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+        return result
+
+    def reset(self, payloads, meta=None):
+        """Replaces every item of the queue, starting a new run
+
+        Args:
+            payloads (list): JSON serializable payload of each item, e.g. a list of song names
+            meta (dict, optional): JSON serializable values shared by every worker, e.g. extractor parameters. Defaults to None.
+        """
+        def statements(connection):
+            connection.execute("DELETE FROM items")
+            connection.execute("DELETE FROM meta")
+            connection.executemany("INSERT INTO items (payload, state) VALUES (?, 'pending')", [(json.dumps(payload),) for payload in payloads])
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [(key, json.dumps(value)) for key, value in (meta or {}).items()])
+
+        self._transaction(statements)
+
+    def get_meta(self, key, default=None):
+        """Reads a value shared by every worker
+
+        Args:
+            key (str): key of the value
+            default (object, optional): returned if the key is missing. Defaults to None.
+
+        Returns:
+            object: the value
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+        return default if row is None else json.loads(row[0])
+
+    def _expire_leases(self, connection):
+        """Puts items whose lease expired back in the queue, or marks them as failed if they were leased `max_attempts` times
+
+        Args:
+            connection (Connection): connection inside a transaction
+        """
+        now = time.time()
+        connection.execute(
+            "UPDATE items SET state = 'failed', worker = NULL, error = 'lease expired' WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, self.max_attempts),
+        )
+        connection.execute("UPDATE items SET state = 'pending', worker = NULL WHERE state = 'leased' AND lease_expires < ?", (now,))
+
+    def claim(self, worker):
+        """Leases the next pending item
+
+        Args:
+            worker (str): id of the worker, e.g. `<host>:<pid>`
+
+        Returns:
+            (int, object): id and payload of the item, None if no item is pending
+        """
+        def statements(connection):
+            self._expire_leases(connection)
+
+            row = connection.execute("SELECT id, payload FROM items WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                "UPDATE items SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, time.time() + self.lease_seconds, row[0]),
+            )
+            return row[0], json.loads(row[1])
+
+        return self._transaction(statements)
+
+    def renew(self, item_id, worker):
+        """Extends the lease of an item
+
+        Args:
+            item_id (int): id of the item
+            worker (str): id of the worker holding the lease
+
+        Returns:
+            bool: whether the worker still held the lease
+        """
+        def statements(connection):
+            return connection.execute(
+                "UPDATE items SET lease_expires = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                (time.time() + self.lease_seconds, item_id, worker),
+            ).rowcount == 1
+
+        return self._transaction(statements)
+
+    def complete(self, item_id, worker, result=None):
+        """Marks a leased item as done
+
+        Args:
+            item_id (int): id of the item
+            worker (str): id of the worker holding the lease
+            result (object, optional): JSON serializable result of the item, e.g. the path of its shard. Defaults to None.
+
+        Returns:
+            bool: whether the worker still held the lease, the item being left as it is otherwise
+        """
+        def statements(connection):
+            return connection.execute(
+                "UPDATE items SET state = 'done', worker = NULL, lease_expires = NULL, result = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                (json.dumps(result), item_id, worker),
+            ).rowcount == 1
+
+        return self._transaction(statements)
+
+    def fail(self, item_id, worker, error):
+        """Gives up a leased item, which is put back in the queue unless it was leased `max_attempts` times
+
+        Args:
+            item_id (int): id of the item
+            worker (str): id of the worker holding the lease
+            error (str): description of the error
+
+        Returns:
+            bool: whether the worker still held the lease
+        """
+        def statements(connection):
+            return connection.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, lease_expires = NULL, error = ? "
+                "WHERE id = ? AND state = 'leased' AND worker = ?",
+                (self.max_attempts, error, item_id, worker),
+            ).rowcount == 1
+
+        return self._transaction(statements)
+
+    def counts(self):
+        """Counts items in each state, after putting back items whose lease expired
+
+        Returns:
+            dict: state as key (`pending`, `leased`, `done` or `failed`) and number of items as value
+        """
+        def statements(connection):
+            self._expire_leases(connection)
+            return dict(connection.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+
+        return {"pending": 0, "leased": 0, "done": 0, "failed": 0, **self._transaction(statements)}
+
+    def is_finished(self):
+        """Checks whether every item is done or failed
+
+        Returns:
+            bool: no item is pending or leased
+        """
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+    def get_items(self, states=None):
+        """Lists items
+
+        Args:
+            states (list(str), optional): only list items in these states. Defaults to None (all states).
+
+        Returns:
+            list((int, str, object, object, str)): id, state, payload, result and error of each item, in the order they were queued
+        """
+        query = "SELECT id, state, payload, result, error FROM items"
+        params = []
+
+        if states is not None:
+            query += f" WHERE state IN ({','.join('?' * len(states))})"
+            params.extend(states)
+
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY id", params).fetchall()
+
+        return [(item_id, state, json.loads(payload), None if result is None else json.loads(result), error) for item_id, state, payload, result, error in rows]
+
+    def close(self):
+        """Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,144 @@
+import math
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import ParameterSampler, StratifiedKFold
+
+
+def _fit_and_score(estimator, params, X, y, train, test, n_samples, deadline, seed, sampler=None):
+    """Fits a candidate on a subsample of a fold and scores it on the validation part of the fold. The subsample is resampled
+    on its own, so that copies of a row never end up on both sides of the fold
+
+    Args:
+        estimator (estimator): unfitted estimator
+        params (dict): parameters of the candidate
+        X (numpy array): features
+        y (numpy array): labels
+        train (numpy array): training rows of the fold
+        test (numpy array): validation rows of the fold
+        n_samples (int): number of training rows used
+        deadline (float): time.time() after which the candidate is not fitted anymore
+        seed (int): seed of the subsample
+        sampler (sampler, optional): imbalanced-learn sampler applied to the subsample. Defaults to None.
+
+    Returns:
+        float: macro F1 score, None if the deadline passed before the fit started
+    """
+    if time.time() > deadline:
+        return None
+
+    if n_samples < len(train):
+        train = np.random.default_rng(seed).choice(train, n_samples, replace=False)
+
+    X_train, y_train = X[train], y[train]
+    if sampler is not None:
+        X_train, y_train = clone(sampler).fit_resample(X_train, y_train)
+
+    model = clone(estimator).set_params(**params)
+    model.fit(X_train, y_train)
+
+    return f1_score(y[test], model.predict(X[test]), average="macro")
+
+
+class SuccessiveHalving:
+
+    def __init__(self, estimator, param_distributions, n_candidates=32, factor=3, min_samples=None, cv=3, budget=None, n_jobs=-1, random_state=0,
+                 sampler=None):
+        """Hyperparameter search by successive halving. Every candidate is first scored on few training rows, then only the best
+        1/`factor` of them are scored again on `factor` times more rows, till one candidate is left or all rows are used.
+        Fits of a round run in parallel on all cores, and no fit starts once `budget` seconds are spent, the best candidate of
+        the last completed round being kept
+
+        Args:
+            estimator (estimator): scikit-learn compatible estimator, single threaded fits are best since fits run in parallel
+            param_distributions (dict): parameter name as key and list or distribution of values as value, as in RandomizedSearchCV
+            n_candidates (int, optional): number of sampled candidates of the first round. Defaults to 32.
+            factor (int, optional): fraction of candidates kept and growth of training rows per round. Defaults to 3.
+            min_samples (int, optional): training rows of the first round. Defaults to None (chosen so that the last round uses all rows).
+            cv (int, optional): number of stratified folds. Defaults to 3.
+            budget (float, optional): seconds the search may take. Defaults to None (no limit).
+            n_jobs (int, optional): number of parallel fits. Defaults to -1 (all cores).
+            random_state (int, optional): seed of sampled candidates, folds and subsamples. Defaults to 0.
+            sampler (sampler, optional): imbalanced-learn sampler balancing the training rows of each fold, e.g. RandomOverSampler.
+                Rows given to `fit` must not be resampled already, copies of a row would be in training and validation rows. Defaults to None.
+        """
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.min_samples = min_samples
+        self.cv = cv
+        self.budget = budget
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.sampler = sampler
+
+        self.best_params_ = None
+        self.best_score_ = None
+        self.history_ = []
+
+    def fit(self, X, y):
+        """Runs the search
+
+        Args:
+            X (numpy array): features
+            y (numpy array): labels
+
+        Returns:
+            SuccessiveHalving: self, with `best_params_`, `best_score_` and `history_` (one entry per round) set
+        """
+        start = time.time()
+        deadline = start + self.budget if self.budget is not None else math.inf
+
+        folds = list(StratifiedKFold(self.cv, shuffle=True, random_state=self.random_state).split(X, y))
+        n_train = min(len(train) for train, _ in folds)
+
+        candidates = list(ParameterSampler(self.param_distributions, self.n_candidates, random_state=self.random_state))
+        n_rounds = max(1, math.ceil(math.log(len(candidates), self.factor)) + 1)
+        n_samples = self.min_samples or max(len(np.unique(y)) * 10, n_train // self.factor ** (n_rounds - 1))
+
+        self.history_ = []
+        self.best_params_, self.best_score_ = candidates[0], None
+
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            for round_index in range(n_rounds):
+                n_samples = min(n_samples, n_train)
+
+                scores = parallel(
+                    delayed(_fit_and_score)(self.estimator, params, X, y, train, test, n_samples, deadline, self.random_state + round_index, self.sampler)
+                    for params in candidates for train, test in folds
+                )
+                scores = np.array([np.nan if score is None else score for score in scores], dtype=float).reshape(len(candidates), len(folds))
+
+                # Candidates missing a fold because of the budget are not ranked
+                mean_scores = scores.mean(axis=1)
+                completed = ~np.isnan(mean_scores)
+                if not completed.any():
+                    break
+
+                ranking = [i for i in np.argsort(-np.where(completed, mean_scores, -np.inf)) if completed[i]]
+
+                # A round cut short by the budget only replaces the best candidate if no round was completed before
+                if completed.all() or self.best_score_ is None:
+                    self.best_params_, self.best_score_ = candidates[ranking[0]], float(mean_scores[ranking[0]])
+
+                self.history_.append({
+                    "round": round_index,
+                    "candidates": len(candidates),
+                    "completed": int(completed.sum()),
+                    "n_samples": n_samples,
+                    "best_score": float(mean_scores[ranking[0]]),
+                    "best_params": candidates[ranking[0]],
+                    "elapsed": time.time() - start,
+                })
+
+                if not completed.all() or time.time() > deadline or len(ranking) == 1 or n_samples == n_train:
+                    break
+
+                candidates = [candidates[i] for i in ranking[:max(1, len(ranking) // self.factor)]]
+                n_samples *= self.factor
+
+        return self
@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+from scipy.stats import loguniform, randint, uniform
+from sklearn.metrics import classification_report, f1_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+# FeatureExtraction modules import their siblings directly
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "FeatureExtraction"))
+
+from ColumnarDataset import ColumnarDataset
+from SuccessiveHalving import SuccessiveHalving
+
+# Band Energy Ratio is left out, its values have multiple discrepancies
+DROPPED_COLUMNS = ["BER_Mean", "BER_Std"]
+
+# Version of the preprocessing, part of the cache key
+PREPROCESSING_VERSION = 2
+
+
+def _make_model(model, params=None, n_jobs=1):
+    """Creates an unfitted model
+
+    Args:
+        model (str): `rfc` (RandomForestClassifier), `xgb` (XGBClassifier) or `lr` (LogisticRegression)
+        params (dict, optional): parameters of the model. Defaults to None.
+        n_jobs (int, optional): threads used by the model. Defaults to 1.
+
+    Returns:
+        estimator: unfitted model
+    """
+    params = params or {}
+
+    if model == "rfc":
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(n_jobs=n_jobs, random_state=0, **params)
+    if model == "xgb":
+        from xgboost import XGBClassifier
+        return XGBClassifier(n_jobs=n_jobs, random_state=0, **params)
+    if model == "lr":
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(max_iter=1000, **params)
+
+    raise ValueError(f"Unknown model {model}")
+
+
+# Search spaces, the RandomForest one being the RandomizedSearchCV of ML/model.ipynb
+PARAM_DISTRIBUTIONS = {
+    "rfc": {
+        "n_estimators": list(range(50, 300, 10)),
+        "min_samples_leaf": list(range(1, 50)),
+        "max_depth": list(range(2, 20)),
+        "bootstrap": [True, False],
+    },
+    "xgb": {
+        "n_estimators": randint(100, 1000),
+        "learning_rate": loguniform(0.01, 0.3),
+        "max_depth": randint(2, 10),
+        "subsample": uniform(0.5, 0.5),
+        "colsample_bytree": uniform(0.5, 0.5),
+    },
+    "lr": {
+        "C": loguniform(1e-3, 1e2),
+    },
+}
+
+
+class Trainer:
+
+    def __init__(self, dataset_path, cache_dir, sampler="over", test_size=0.3, random_state=0):
+        """Training pipeline of ML/model.ipynb: Name and Band Energy Ratio columns are dropped, genres are label encoded, features
+        are standardized and the training rows are balanced by random over or under sampling. Preprocessed matrices are cached by
+        content of the dataset and preprocessing parameters, so retraining on an unchanged dataset skips preprocessing.
+
+        Unlike the notebook, rows are split into training and test rows before scaling and resampling, so no duplicated or scaled
+        test rows leak into training and the test score is not inflated. For the same reason the search resamples the training part
+        of each fold, and only the final fit uses all resampled training rows
+
+        Args:
+            dataset_path (str): columnar dataset directory (see ColumnarDataset) or data.csv file
+            cache_dir (str): directory of cached preprocessed matrices
+            sampler (str, optional): `over` (RandomOverSampler), `under` (RandomUnderSampler) or `none`. Defaults to "over".
+            test_size (float, optional): fraction of rows kept for testing. Defaults to 0.3.
+            random_state (int, optional): seed of split, resampling and search. Defaults to 0.
+        """
+        self.dataset_path = dataset_path
+        self.cache_dir = cache_dir
+        self.sampler = sampler
+        self.test_size = test_size
+        self.random_state = random_state
+
+    def _load_dataset(self):
+        """Loads feature columns and genres of the dataset
+
+        Returns:
+            (numpy array, numpy array, list(str)): float32 features, genre of each row and name of each column
+        """
+        if os.path.isdir(self.dataset_path):
+            dataset = ColumnarDataset(self.dataset_path)
+            columns = [column for column in dataset.columns if column not in DROPPED_COLUMNS]
+            return dataset.matrix(columns), dataset.genre_labels(), columns
+
+        import pandas as pd
+
+        data = pd.read_csv(self.dataset_path, index_col=0)
+        columns = [column for column in data.columns if column not in ["Name", "Genre", *DROPPED_COLUMNS]]
+        return data[columns].to_numpy(dtype=np.float32), data["Genre"].to_numpy(), columns
+
+    def _dataset_hash(self):
+        """Hashes the content of the dataset
+
+        Returns:
+            str: hex digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+
+        paths = [self.dataset_path]
+        if os.path.isdir(self.dataset_path):
+            paths = [os.path.join(self.dataset_path, file_name) for file_name in sorted(os.listdir(self.dataset_path))]
+
+        for path in paths:
+            digest.update(os.path.basename(path).encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+
+        return digest.hexdigest()
+
+    def _make_sampler(self):
+        """Creates the sampler balancing genres of training rows
+
+        Returns:
+            sampler: unfitted imbalanced-learn sampler, None if rows are not resampled
+        """
+        if self.sampler == "none":
+            return None
+
+        from imblearn.over_sampling import RandomOverSampler
+        from imblearn.under_sampling import RandomUnderSampler
+
+        if self.sampler == "over":
+            return RandomOverSampler(random_state=self.random_state)
+        if self.sampler == "under":
+            return RandomUnderSampler(random_state=self.random_state)
+
+        raise ValueError(f"Unknown sampler {self.sampler}")
+
+    def _resample(self, X, y):
+        """Balances genres of the training rows
+
+        Args:
+            X (numpy array): features
+            y (numpy array): labels
+
+        Returns:
+            (numpy array, numpy array): resampled features and labels
+        """
+        sampler = self._make_sampler()
+        if sampler is None:
+            return X, y
+
+        return sampler.fit_resample(X, y)
+
+    def preprocess(self):
+        """Preprocesses the dataset, or loads the cached result of a previous run on the same content and parameters
+
+        Returns:
+            dict: X_train, y_train (not resampled), X_test, y_test, scaler, columns, labels and cache_key
+        """
+        key = hashlib.blake2b(json.dumps({
+            "dataset": self._dataset_hash(),
+            "test_size": self.test_size,
+            "random_state": self.random_state,
+            "version": PREPROCESSING_VERSION,
+        }, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+        cache_path = os.path.join(self.cache_dir, f"preprocessed_{key}.pkl")
+        if os.path.isfile(cache_path):
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+
+        X, genres, columns = self._load_dataset()
+
+        # Rows with missing features can not be used by the models
+        complete = ~np.isnan(X).any(axis=1)
+        X, genres = X[complete], genres[complete]
+
+        label_encoder = LabelEncoder()
+        y = label_encoder.fit_transform(genres)
+
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=self.test_size, stratify=y, random_state=self.random_state)
+
+        scaler = StandardScaler().fit(X_train)
+
+        preprocessed = {
+            "X_train": scaler.transform(X_train).astype(np.float32),
+            "y_train": y_train,
+            "X_test": scaler.transform(X_test).astype(np.float32),
+            "y_test": y_test,
+            "scaler": scaler,
+            "columns": columns,
+            "labels": list(label_encoder.classes_),
+            "cache_key": key,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(cache_path + ".tmp", "wb") as f:
+            pickle.dump(preprocessed, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + ".tmp", cache_path)
+
+        return preprocessed
+
+    def train(self, model="rfc", budget=600, n_candidates=32, factor=3, n_jobs=-1):
+        """Preprocesses the dataset, searches hyperparameters by successive halving and fits the best candidate on all training rows
+
+        Args:
+            model (str, optional): `rfc`, `xgb` or `lr`. Defaults to "rfc".
+            budget (float, optional): seconds the hyperparameter search may take. Defaults to 600.
+            n_candidates (int, optional): number of sampled candidates. Defaults to 32.
+            factor (int, optional): halving factor. Defaults to 3.
+            n_jobs (int, optional): number of parallel fits. Defaults to -1 (all cores).
+
+        Returns:
+            dict: artifact with model, scaler, columns, labels, params and metrics, readable by Deployment/GenreClassifier
+        """
+        start = time.time()
+        data = self.preprocess()
+        preprocessed_at = time.time()
+
+        search = SuccessiveHalving(
+            _make_model(model), PARAM_DISTRIBUTIONS[model], n_candidates=n_candidates, factor=factor,
+            budget=budget, n_jobs=n_jobs, random_state=self.random_state, sampler=self._make_sampler(),
+        ).fit(data["X_train"], data["y_train"])
+        searched_at = time.time()
+
+        final_model = _make_model(model, search.best_params_, n_jobs=n_jobs)
+        final_model.fit(*self._resample(data["X_train"], data["y_train"]))
+
+        predictions = final_model.predict(data["X_test"])
+
+        return {
+            "model": final_model,
+            "scaler": data["scaler"],
+            "columns": data["columns"],
+            "labels": data["labels"],
+            "params": search.best_params_,
+            "metrics": {
+                "test_f1_macro": f1_score(data["y_test"], predictions, average="macro"),
+                "search_f1_macro": search.best_score_,
+                "report": classification_report(data["y_test"], predictions, target_names=data["labels"], output_dict=True, zero_division=0),
+                "search_history": search.history_,
+                "preprocess_seconds": preprocessed_at - start,
+                "search_seconds": searched_at - preprocessed_at,
+                "fit_seconds": time.time() - searched_at,
+                "cache_key": data["cache_key"],
+            },
+        }
+
+
+def main():
+    ml_dir = os.path.dirname(os.path.realpath(__file__))
+    root_dir = os.path.dirname(ml_dir)
+
+    parser = argparse.ArgumentParser(description="Trains the genre classifier")
+    parser.add_argument("--data", default=os.path.join(root_dir, "dataset"), help="columnar dataset directory or data.csv file")
+    parser.add_argument("--model", default="rfc", choices=["rfc", "xgb", "lr"])
+    parser.add_argument("--sampler", default="over", choices=["over", "under", "none"])
+    parser.add_argument("--budget", type=float, default=600, help="seconds the hyperparameter search may take")
+    parser.add_argument("--candidates", type=int, default=32)
+    parser.add_argument("--jobs", type=int, default=-1)
+    parser.add_argument("--cache-dir", default=os.path.join(ml_dir, "cache"))
+    parser.add_argument("--output", default=os.path.join(ml_dir, "genre_model.pkl"))
+    args = parser.parse_args()
+
+    trainer = Trainer(args.data, args.cache_dir, args.sampler)
+    artifact = trainer.train(args.model, args.budget, args.candidates, n_jobs=args.jobs)
+
+    with open(args.output, "wb") as f:
+        pickle.dump(artifact, f)
+
+    metrics = artifact["metrics"]
+    with open(os.path.splitext(args.output)[0] + "_metrics.json", "w") as f:
+        json.dump({"params": artifact["params"], **metrics}, f, indent=1, default=str)
+
+    for entry in metrics["search_history"]:
+        print(f"Round {entry['round']}: {entry['completed']}/{entry['candidates']} candidates on {entry['n_samples']} rows, best F1 {entry['best_score']:.3f} ({entry['elapsed']:.0f}s)")
+    print(f"Best parameters: {artifact['params']}")
+    print(f"Test F1: {metrics['test_f1_macro']:.3f}, model saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
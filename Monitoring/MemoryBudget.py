@@ -0,0 +1,204 @@
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# mallopt parameter of the size from which glibc allocates with mmap
+M_MMAP_THRESHOLD = -3
+
+# Multipliers of the size suffixes accepted by `parse_size`
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def read_rss():
+    """Reads the resident set size of this process from /proc
+
+    Returns:
+        int: resident memory in bytes, None where /proc is not available (e.g. Windows)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def return_freed_memory(threshold=1 << 20):
+    """Makes glibc allocate blocks of `threshold` bytes or more (e.g. signals and spectrograms) with mmap, so that their memory goes
+    back to the system as soon as they are freed. By default glibc raises this threshold up to 32 MiB after the first large block is
+    freed, and blocks under it are kept in per thread heaps, so RSS keeps growing with the number of threads although the memory is
+    free. Does nothing on other C libraries
+
+    Args:
+        threshold (int, optional): size in bytes from which blocks are allocated with mmap. Defaults to 1 MiB.
+
+    Returns:
+        bool: whether the threshold was set
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        return bool(libc.mallopt(M_MMAP_THRESHOLD, threshold))
+    except (OSError, AttributeError, TypeError):
+        return False
+
+
+def parse_size(size):
+    """Parses a number of bytes with an optional binary suffix
+
+    Args:
+        size (str or int): e.g. `512M`, `2G` or `1073741824`
+
+    Returns:
+        int: number of bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    size = size.strip().upper().rstrip("B").rstrip("I")
+    unit = size[-1] if size and size[-1] in SIZE_UNITS else ""
+    return int(float(size[:len(size) - len(unit)]) * SIZE_UNITS[unit])
+
+
+class MemoryBudget:
+
+    def __init__(self, limit, max_workers, min_workers=1, high_watermark=0.9, low_watermark=0.75, interval=0.25, metrics=None):
+        """Keeps the resident memory of the process under a ceiling while running as many items at once as it allows. Each item
+        reserves its estimated footprint before it starts and is admitted only if the memory in use, the larger of the measured RSS and
+        the reservations, leaves room for it. An item larger than the whole budget runs alone instead of never running.
+
+        The number of items allowed at once also adapts to the measured RSS, which catches footprints that were underestimated: it
+        starts at `min_workers`, grows by one at each measurement while RSS stays under `low_watermark` of the limit and items are
+        waiting, and is halved when RSS goes over `high_watermark`. Where RSS cannot be measured, concurrency only grows and only
+        the reservations are used.
+
+        With glibc, RSS includes memory freed by earlier items unless `return_freed_memory` was called, which the commands of main.py
+        do. It changes the allocator of the whole process, so the budget does not call it itself
+
+        Args:
+            limit (int or str): ceiling of the resident memory of the process in bytes, or a size such as `2G`
+            max_workers (int): largest number of items at once, e.g. the number of threads
+            min_workers (int, optional): smallest number of items at once. Defaults to 1.
+            high_watermark (float, optional): fraction of the limit above which concurrency is halved. Defaults to 0.9.
+            low_watermark (float, optional): fraction of the limit under which concurrency may grow. Defaults to 0.75.
+            interval (float, optional): minimum seconds between two RSS measurements, waiting items check again this often. Defaults to 0.25.
+            metrics (Metrics, optional): metrics updated with RSS, reservations, concurrency and admission waits. Defaults to None.
+        """
+        self.limit = parse_size(limit)
+        self.max_workers = max(1, max_workers)
+        self.min_workers = max(1, min(min_workers, self.max_workers))
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self.metrics = metrics
+
+        # Starting low and growing while RSS allows, so that footprints that were underestimated are seen before too many items run
+        self.concurrency = self.min_workers
+        self.active = 0
+        self.reserved = 0
+        self.waiting = 0
+
+        # Memory used before any item, e.g. by imported modules
+        self.baseline = read_rss() or 0
+        self.rss = self.baseline
+        self.peak_rss = self.baseline
+        self._measured_at = 0
+
+        self._condition = threading.Condition()
+
+    def _measure(self, force=False):
+        """Measures RSS at most every `interval` seconds and adapts concurrency, called with the condition held
+
+        Args:
+            force (bool, optional): measure even if the previous measurement is recent. Defaults to False.
+        """
+        now = time.monotonic()
+        if not force and now - self._measured_at < self.interval:
+            return
+        self._measured_at = now
+
+        rss = read_rss()
+        if rss is not None:
+            self.rss = rss
+            self.peak_rss = max(self.peak_rss, rss)
+
+        # Halved again only once the items running at the previous decrease are done, their memory being part of this RSS
+        if rss is not None and rss > self.high_watermark * self.limit and self.active <= self.concurrency:
+            self.concurrency = max(self.min_workers, self.concurrency // 2)
+        elif (rss is None or rss < self.low_watermark * self.limit) and self.waiting and self.active >= self.concurrency:
+            self.concurrency = min(self.max_workers, self.concurrency + 1)
+
+        if self.metrics is not None:
+            self.metrics.set("memory_rss_bytes", self.rss)
+            self.metrics.set("memory_peak_rss_bytes", self.peak_rss)
+            self.metrics.set("memory_reserved_bytes", self.reserved)
+            self.metrics.set("memory_concurrency", self.concurrency)
+
+    def _admits(self, nbytes):
+        """Checks whether an item fits, called with the condition held
+
+        Args:
+            nbytes (int): estimated footprint of the item
+
+        Returns:
+            bool: the item may start
+        """
+        if self.active == 0:
+            return True
+
+        in_use = max(self.rss, self.baseline + self.reserved)
+        return self.active < self.concurrency and in_use + nbytes <= self.limit
+
+    def acquire(self, nbytes):
+        """Waits till an item fits in the budget and reserves its footprint
+
+        Args:
+            nbytes (int): estimated footprint of the item in bytes
+        """
+        nbytes = int(nbytes)
+        start = time.perf_counter()
+
+        with self._condition:
+            self._measure()
+            if not self._admits(nbytes):
+                self.waiting += 1
+                if self.metrics is not None:
+                    self.metrics.increment("memory_admission_waits")
+
+                # Memory freed outside of releases, e.g. by the garbage collector, is seen at the next measurement
+                while not self._admits(nbytes):
+                    self._condition.wait(self.interval)
+                    self._measure()
+                self.waiting -= 1
+
+            self.active += 1
+            self.reserved += nbytes
+
+        if self.metrics is not None:
+            self.metrics.observe("memory_admission_wait", time.perf_counter() - start)
+
+    def release(self, nbytes):
+        """Gives back the footprint reserved by `acquire` once an item is done
+
+        Args:
+            nbytes (int): footprint given to `acquire`
+        """
+        with self._condition:
+            self.active -= 1
+            self.reserved -= int(nbytes)
+            self._measure(force=True)
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """Reserves the footprint of an item for the body of a `with` block
+
+        Args:
+            nbytes (int): estimated footprint of the item in bytes
+        """
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
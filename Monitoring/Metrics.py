@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+
+    def __init__(self, namespace="music_genre", path=None):
+        """Thread safe counters, gauges and timers, shared by any number of threads and exported as a JSON snapshot or as a
+        Prometheus text file (e.g. for the textfile collector of node_exporter)
+
+        Args:
+            namespace (str, optional): prefix of every metric name in Prometheus format. Defaults to "music_genre".
+            path (str, optional): file written by `flush`, in Prometheus format if it ends with `.prom` and JSON otherwise.
+                Defaults to None (`flush` does nothing).
+        """
+        self.namespace = namespace
+        self.path = path
+
+        # (name, labels) as key, labels being a sorted tuple of (label, value)
+        self._counters = {}
+        self._gauges = {}
+        # [count, total seconds, max seconds] of each timer
+        self._timers = {}
+
+        self._started = time.time()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        """Adds to a counter
+
+        Args:
+            name (str): name of the counter, e.g. `extract_songs`
+            value (float, optional): amount added. Defaults to 1.
+            **labels: labels of the counter, e.g. `stage="decode"`
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Sets a gauge
+
+        Args:
+            name (str): name of the gauge
+            value (float): value of the gauge
+            **labels: labels of the gauge
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        """Records a duration
+
+        Args:
+            name (str): name of the timer, e.g. `extract_decode`
+            seconds (float): duration in seconds
+            **labels: labels of the timer
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            timer = self._timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the body of a `with` block, also when it raises
+
+        Args:
+            name (str): name of the timer
+            **labels: labels of the timer
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """Returns the value of a counter
+
+        Args:
+            name (str): name of the counter
+            **labels: labels of the counter
+
+        Returns:
+            float: value of the counter, 0 if it was never incremented
+        """
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self):
+        """Copies every metric
+
+        Returns:
+            dict: `counters`, `gauges` and `timers` lists, each entry having `name`, `labels` and its values, and `uptime_s`
+        """
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            timers = [(key, list(timer)) for key, timer in self._timers.items()]
+
+        return {
+            "timestamp": time.time(),
+            "uptime_s": time.time() - self._started,
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in gauges],
+            "timers": [
+                {"name": name, "labels": dict(labels), "count": count, "total_s": total, "mean_ms": 1000 * total / count, "max_ms": 1000 * longest}
+                for (name, labels), (count, total, longest) in timers
+            ],
+        }
+
+    def merge(self, snapshot):
+        """Adds counters and timers of a snapshot taken in another process, gauges of the snapshot replace the current ones
+
+        Args:
+            snapshot (dict): result of `snapshot` or `drain`
+        """
+        with self._lock:
+            for entry in snapshot["counters"]:
+                key = self._key(entry["name"], entry["labels"])
+                self._counters[key] = self._counters.get(key, 0) + entry["value"]
+
+            for entry in snapshot["gauges"]:
+                self._gauges[self._key(entry["name"], entry["labels"])] = entry["value"]
+
+            for entry in snapshot["timers"]:
+                timer = self._timers.setdefault(self._key(entry["name"], entry["labels"]), [0, 0.0, 0.0])
+                timer[0] += entry["count"]
+                timer[1] += entry["total_s"]
+                timer[2] = max(timer[2], entry["max_ms"] / 1000)
+
+    def drain(self):
+        """Takes a snapshot and resets every metric, so that a worker process can send only what changed since its previous snapshot
+
+        Returns:
+            dict: snapshot of the metrics before the reset
+        """
+        with self._lock:
+            snapshot_metrics = Metrics(self.namespace)
+            snapshot_metrics._counters, self._counters = self._counters, {}
+            snapshot_metrics._gauges, self._gauges = self._gauges, {}
+            snapshot_metrics._timers, self._timers = self._timers, {}
+
+        return snapshot_metrics.snapshot()
+
+    def to_json(self):
+        """Formats a snapshot as JSON
+
+        Returns:
+            str: JSON document
+        """
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_prometheus(self):
+        """Formats a snapshot in the Prometheus text exposition format. Counters get a `_total` suffix and timers are summaries in seconds
+
+        Returns:
+            str: Prometheus text
+        """
+        snapshot = self.snapshot()
+
+        def labels_text(labels):
+            if not labels:
+                return ""
+            # Backslashes, quotes and new lines are escaped in label values
+            escaped = {label: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for label, value in labels.items()}
+            return "{" + ",".join(f'{label}="{value}"' for label, value in escaped.items()) + "}"
+
+        lines = []
+        typed = set()
+
+        def add(name, kind, labels, value):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{name}{labels_text(labels)} {value}")
+
+        for entry in sorted(snapshot["counters"], key=lambda entry: entry["name"]):
+            add(f"{self.namespace}_{entry['name']}_total", "counter", entry["labels"], entry["value"])
+
+        for entry in sorted(snapshot["gauges"], key=lambda entry: entry["name"]):
+            add(f"{self.namespace}_{entry['name']}", "gauge", entry["labels"], entry["value"])
+
+        for entry in sorted(snapshot["timers"], key=lambda entry: entry["name"]):
+            name = f"{self.namespace}_{entry['name']}_seconds"
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            lines.append(f"{name}_count{labels_text(entry['labels'])} {entry['count']}")
+            lines.append(f"{name}_sum{labels_text(entry['labels'])} {entry['total_s']}")
+
+        add(f"{self.namespace}_uptime_seconds", "gauge", {}, snapshot["uptime_s"])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes a snapshot next to the target and moves it over it, so readers never see a partial file
+
+        Args:
+            path (str): file to write, in Prometheus format if it ends with `.prom` and JSON otherwise
+        """
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+
+        temporary_path = path + ".tmp"
+        with self._write_lock:
+            with open(temporary_path, "w") as f:
+                f.write(text)
+            os.replace(temporary_path, path)
+
+    def flush(self):
+        """Writes a snapshot to `path`, if one was given
+        """
+        if self.path is not None:
+            self.write(self.path)
@@ -0,0 +1,83 @@
+import sys
+import threading
+import time
+
+
+class ProgressReporter:
+
+    def __init__(self, total=None, prefix="Progress:", interval=0.5, length=50, fill="█", stream=None):
+        """Thread safe terminal progress bar. Any number of threads report completed items, the bar is redrawn at most every
+        `interval` seconds and once more when done, with the rate of completed items and the remaining time
+
+        Args:
+            total (int, optional): number of items. Defaults to None (unknown, only the count and rate are shown).
+            prefix (str, optional): text before the bar. Defaults to "Progress:".
+            interval (float, optional): minimum seconds between two redraws. Defaults to 0.5.
+            length (int, optional): character length of the bar. Defaults to 50.
+            fill (str, optional): bar fill character. Defaults to "█".
+            stream (file, optional): stream the bar is written to. Defaults to None (standard output).
+        """
+        self.total = total or None
+        self.prefix = prefix
+        self.interval = interval
+        self.length = length
+        self.fill = fill
+        self.stream = stream or sys.stdout
+
+        self.completed = 0
+        self.failed = 0
+
+        self._started = time.monotonic()
+        self._drawn_at = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def update(self, completed=1, failed=0):
+        """Reports finished items
+
+        Args:
+            completed (int, optional): number of items finished. Defaults to 1.
+            failed (int, optional): number of those items that failed. Defaults to 0.
+        """
+        with self._lock:
+            self.completed += completed
+            self.failed += failed
+
+            now = time.monotonic()
+            if now - self._drawn_at >= self.interval or self.completed == self.total:
+                self._draw(now)
+
+    def _draw(self, now):
+        """Redraws the bar, called with the lock held
+
+        Args:
+            now (float): time.monotonic() of the redraw
+        """
+        self._drawn_at = now
+        elapsed = now - self._started
+        rate = self.completed / elapsed if elapsed > 0 else 0
+        failed = f" {self.failed} failed" if self.failed else ""
+
+        if self.total is None:
+            line = f"\r{self.prefix} {self.completed}{failed} {rate:.1f}/s"
+        else:
+            fraction = min(1, self.completed / self.total)
+            filled = int(self.length * fraction)
+            bar = self.fill * filled + "-" * (self.length - filled)
+            eta = f" ETA {(self.total - self.completed) / rate:.0f}s" if 0 < rate and self.completed < self.total else ""
+            line = f"\r{self.prefix} |{bar}| {100 * fraction:.1f}% {self.completed}/{self.total}{failed} {rate:.1f}/s{eta}"
+
+        self.stream.write(line)
+        self.stream.flush()
+
+    def close(self):
+        """Draws the final state of the bar and ends its line
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            self._draw(time.monotonic())
+            self.stream.write("\n")
+            self.stream.flush()
@@ -1,25 +1,60 @@
 import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from RateLimiter import RateLimiter
+from SongCatalog import SongCatalog
+
+# Monitoring modules are shared with FeatureExtraction
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Monitoring"))
+
+from Metrics import Metrics
 
 
 class APICall:
 
-    def __init__(self, genres, amount_each, num_youtube_api_keys=1):
+    def __init__(self, genres, amount_each, num_youtube_api_keys=1, n_threads=8, requests_per_second=10,
+                 spotify_base_url="https://api.spotify.com/v1", spotify_token_url="https://accounts.spotify.com/api/token", metrics=None):
         """
 
         Args:
             genres (list(str)): Genres of which to get song names and URLs of
             amount_each (int): number of songs to get from each genre
             num_youtube_api_keys (int, optional): Amount of Youtube API Keys stored in .env file. Defaults to 1.
+            n_threads (int, optional): number of requests sent to Spotify at once. Defaults to 8.
+            requests_per_second (float, optional): maximum number of requests sent to Spotify per second. Defaults to 10.
+            spotify_base_url (str, optional): base url of Spotify API, can point to a local stub server. Defaults to "https://api.spotify.com/v1".
+            spotify_token_url (str, optional): url of Spotify token API. Defaults to "https://accounts.spotify.com/api/token".
+            metrics (Metrics, optional): metrics updated with API calls, their latency and Youtube quota used. Defaults to None (own metrics).
         """
+        self.metrics = metrics or Metrics()
+
         # Spotify API
-        self.spotify_base_url = "https://api.spotify.com/v1"
+        self.spotify_base_url = spotify_base_url
+        self.spotify_token_url = spotify_token_url
         # Youtube API
         self.youtube_search_base_url = "https://www.googleapis.com/youtube/v3/search"
         # Youtube video url
         self.youtube_video_base_url = "https://www.youtube.com/watch?v="
 
+        # One keep-alive session shared by all threads, with a connection per thread
+        self.n_threads = n_threads
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=n_threads))
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=n_threads))
+        self.spotify_rate_limiter = RateLimiter(requests_per_second)
+
+        # Spotify access token, reused till it expires
+        self._spotify_token = None
+        self._spotify_token_expiry = 0
+        self._spotify_token_lock = threading.Lock()
+
         # Check if genres provided by user is a valid genre
         self.genres = self._validate_genres(genres)
 
@@ -31,6 +66,11 @@ class APICall:
 
         self.song_name_dir= self._make_song_list_url_dir()
 
+        # Song names and urls, imported once from name_list.txt written by previous versions
+        self.catalog = SongCatalog(os.path.join(os.path.dirname(self.song_name_dir), "catalog.sqlite"))
+        if len(self.catalog) == 0 and os.path.isfile(self.song_name_dir):
+            self.catalog.import_text(self.song_name_dir)
+
         self.song_list = {}
 
     def _make_song_list_url_dir(self):
@@ -49,53 +89,41 @@ class APICall:
 
         return song_name_list_dir
     
-    def get_song_name_url(self):
-        """Parses song name and url from text file and returns it
+    def get_song_name_url(self, genres=None):
+        """Returns song name and url of songs that have a url from the catalog
+
+        Args:
+            genres (list(str), optional): genres to return. Defaults to None (genres of this object).
 
         Returns:
             (dict, dict): dict of song name and url with genre as keys
         """
+        if genres is None:
+            genres = self.genres
 
         # Dict to store song name and url
-        song_name = {}
-        song_url = {}
-
-        with open(self.song_name_dir, "r") as f:
-            text = f.read()
-
-        # Seperate into lists by genre with first item being `GENRE=<genre>`
-        genre_list = text.split("----")
-        if "\n" in genre_list:
-            genre_list.remove("\n") # Last contains empty string
-
-        # Last item of genre_list contains empty string
-        for genre in genre_list:
-
-            split = genre.split("\n")
-            split.remove('')
+        song_name = {genre: [] for genre in genres}
+        song_url = {genre: [] for genre in genres}
 
-            songs = split[1:]
-            genre_name = split[0].split("=")[1]
+        for genre, name, url in self.catalog.iter_songs(genres):
+            song_name[genre].append(name)
+            song_url[genre].append(url)
 
-            if '' in songs:
-                songs.remove('')
-
-            genre_song_list = []
-            genre_songs_url = []
+        return song_name, song_url
 
-            for song in songs:
-                if song == '':
-                    continue
-                name, url = song.split("->")
+    def iter_song_name_url(self, genres=None):
+        """Iterates lazily over songs that have a url, to be passed to SongDownloader.download_songs
 
-                genre_song_list.append(name)
-                genre_songs_url.append(url)
+        Args:
+            genres (list(str), optional): genres to iterate over. Defaults to None (genres of this object).
 
-            song_name[genre_name] = genre_song_list
-            song_url[genre_name] = genre_songs_url
-        
-        return song_name, song_url
+        Returns:
+            iterator: (genre, name, url) of each song
+        """
+        if genres is None:
+            genres = self.genres
 
+        return self.catalog.iter_songs(genres)
 
 
     def _validate_genres(self, genres):
@@ -111,11 +139,7 @@ class APICall:
             list(str): validated_genres
         """
 
-        # Generate auth token
-        auth_token = self._get_spotify_access_token()
-        header = {"Authorization": f"Bearer {auth_token}"}
-
-        response = requests.get(f"{self.spotify_base_url}/recommendations/available-genre-seeds", headers=header)
+        response = self._spotify_get(f"{self.spotify_base_url}/recommendations/available-genre-seeds")
 
         j = response.json()
         available_genres = j["genres"]
@@ -127,12 +151,30 @@ class APICall:
         return genres
 
 
-    def _get_spotify_access_token(self):
-        """Generates access token using spotify token API using Client Id and Client Secret
+    def _get_spotify_access_token(self, refresh=False):
+        """Returns the cached Spotify access token, generating a new one if there is none or it expired
+
+        Args:
+            refresh (bool, optional): generate a new token even if the cached one has not expired. Defaults to False.
 
         Returns:
             str: access token
         """
+        with self._spotify_token_lock:
+            if refresh or self._spotify_token is None or time.monotonic() >= self._spotify_token_expiry:
+                self._spotify_token, expires_in = self._request_spotify_access_token()
+
+                # Refreshing a minute early so requests in flight do not use an expired token
+                self._spotify_token_expiry = time.monotonic() + max(0, expires_in - 60)
+
+            return self._spotify_token
+
+    def _request_spotify_access_token(self):
+        """Generates access token using spotify token API using Client Id and Client Secret
+
+        Returns:
+            (str, int): access token and seconds till it expires
+        """
         import base64
 
         import dotenv
@@ -153,32 +195,85 @@ class APICall:
         auth_data = {"grant_type": "client_credentials"}
 
         # Getting Access Token
-        auth_request = requests.post("https://accounts.spotify.com/api/token", headers=auth_header, data=auth_data)
+        with self.metrics.timer("api_request", api="spotify_token"):
+            auth_request = self.session.post(self.spotify_token_url, headers=auth_header, data=auth_data)
+        self.metrics.increment("api_calls", api="spotify_token", status=auth_request.status_code)
 
         # Get the token
         auth_response = auth_request.json()
         auth_token = auth_response["access_token"]
 
-        return auth_token
+        return auth_token, auth_response.get("expires_in", 3600)
+
+    def _spotify_get(self, url, max_retries=5):
+        """Sends a GET request to Spotify API under the rate limit, refreshing the token if it was rejected and waiting if rate limited
+
+        Args:
+            url (str): url of the request
+            max_retries (int, optional): number of times a rejected or rate limited request is retried. Defaults to 5.
+
+        Returns:
+            Response: response of the request
+        """
+        refresh = False
+
+        for _ in range(max_retries):
+            self.spotify_rate_limiter.acquire()
+
+            header = {"Authorization": f"Bearer {self._get_spotify_access_token(refresh)}"}
+            with self.metrics.timer("api_request", api="spotify"):
+                response = self.session.get(url, headers=header)
+            self.metrics.increment("api_calls", api="spotify", status=response.status_code)
+
+            if response.status_code == 401:
+                refresh = True
+                continue
+            if response.status_code == 429:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+
+            return response
+
+        return response
 
     def _store_song_name(self, song_name):
         """
-        Stores song name in text file
+        Adds song names to the catalog, songs already in it are kept as they are
         
         Args:
-            song_name (str): song name
+            song_name (dict): genre as key and list of song names as values
+        """
+        for genre in song_name.keys():
+            self.catalog.add_songs(genre, song_name[genre])
+
+    def _fetch_song_page(self, genre, offset, year_range):
+        """Fetches one page of song names of a genre from Spotify API
+
+        Args:
+            genre (str): genre of the songs
+            offset (int): index of the first song of the page
+            year_range (str): release years of the songs, e.g. `2000-2022`
+
+        Raises:
+            ValueError: If the response doesn't send OK 200 status code
+
+        Returns:
+            list(str): song names
         """
+        response = self._spotify_get(f"{self.spotify_base_url}/search/?q=genre:{genre}+year:{year_range}&type=track&limit={min(50,self.amount_each)}&offset={offset}")
 
+        if response.status_code != 200:
+            raise ValueError(f"Error fetching song names for {genre}.\nStatus code: {response.status_code}")
 
-        with open(self.song_name_dir, "w") as f:
-            for genre in song_name.keys():
-                f.write(f"GENRE={genre}\n")
-                for song in song_name[genre]:
-                    f.write(f"{song}\n")
-                f.write("----\n")
+        # Converting to json
+        j = response.json()
+        j = j["tracks"]
+
+        return [item["name"] for item in j["items"]]
 
     def generate_song_list(self):
-        """Generates a dictionary of song names as value and genre as key by pulling values from Spotify API and stores them in a file
+        """Generates a dictionary of song names as value and genre as key by pulling values from Spotify API and stores them in the catalog.
+        Pages of all genres are fetched at once by `n_threads` threads under the rate limit
 
         Raises:
             ValueError: If the response doesn't send OK 200 status code
@@ -189,10 +284,7 @@ class APICall:
         import datetime
 
         current_year = datetime.datetime.now().year
-
-
-        auth_token = self._get_spotify_access_token()
-        header = {"Authorization": f"Bearer {auth_token}"}
+        year_range = f"2000-{current_year}"
 
 
         # Maximum amount of songs retuned at once in 50, so divide into multiple requests if more amount requested
@@ -202,144 +294,183 @@ class APICall:
         if self.amount_each % 50 != 0:
             n_request_calls += 1
 
-        for genre in self.genres:
-            song_list = []
-
-            print(f"Getting song names for {genre}")
-            for i in range(n_request_calls):
-                offset= i * 50
-
-                response = requests.get(f"{self.spotify_base_url}/search/?q=genre:{genre}+year:2000-{current_year}&type=track&limit={min(50,self.amount_each)}&offset={offset}", headers=header)
+        pages = [(genre, i * 50) for genre in self.genres for i in range(n_request_calls)]
 
-                if response.status_code != 200:
-                    raise ValueError(f"Error fetching song names for {genre}.\nStatus code: {response.status_code}")
-                # Converting to json
-                j = response.json()
-                j = j["tracks"]
+        print(f"Getting song names for {', '.join(self.genres)}")
+        with ThreadPoolExecutor(max_workers=self.n_threads) as thread:
+            page_songs = list(thread.map(lambda page: self._fetch_song_page(*page, year_range), pages))
 
-                # Adding all songs names to a list
-                for item in j["items"]:
-                    song_list.append(item["name"])
+        # Pages are returned in order, so songs keep the order of the search results
+        for genre in self.genres:
+            self.song_list[genre] = []
+        for (genre, _), songs in zip(pages, page_songs):
+            self.song_list[genre].extend(songs)
 
-            # Adding the list to song_list dictionary
-            self.song_list[genre] = song_list
-            print(f"Got {len(song_list)} song names for {genre}\n{'-'*50}")
+        for genre in self.genres:
+            print(f"Got {len(self.song_list[genre])} song names for {genre}\n{'-'*50}")
         
         self._store_song_name(self.song_list)
-        
+
+        return self.song_list
     
 
-    def generate_song_url(self):
-        """Generates a dictionary of song urls as value and genre as key by pulling values from Youtube API and stores them in a file
+    def _get_youtube_api_keys(self):
+        """Reads Youtube API keys YOUTUBE_API_KEY0 to YOUTUBE_API_KEY<num_youtube_api_keys - 1> from .env file
 
         Raises:
-            ValueError: If the response doesn't send OK 200 status code
+            ValueError: If no Youtube API key is found
 
         Returns:
-            dictionary: genre as key and list of song names as values
+            list(str): Youtube API keys
         """
-
-        tokens_exhausted = 0
-        current_token = 0
-
         from dotenv import load_dotenv
 
-        # Getting youtube api key from dot env
         load_dotenv()
-        
-        # Reading data from the name_list file
-        with open(self.song_name_dir, "r") as f:
-            text_data = f.read()
+        keys = [os.getenv(f"YOUTUBE_API_KEY{n}") for n in range(self.num_youtube_api_keys)]
+        keys = [key for key in keys if key]
 
-        # Splitting into genres
-        genre_list = text_data.split("----")
+        if not keys:
+            raise ValueError("Youtube API key not found. Please add it to .env file.Use YOUTUBE_API_KEY0. Alternatively, you can use multiple keys with index starting from 0 since one API key will probably no be able to handle all requests.")
 
-        if "\n" in genre_list:
-            genre_list.remove("\n") # Last contains empty string
-        
-        with open(self.song_name_dir, 'w') as o:
-
-            for genre in genre_list:
-                
-                # Getting list of songs from a genre with first item being Genre=<genre>
-                split = genre.split("\n")
-                if '' in split:
-                    split.remove('')
-                songs = split[1:]
-                genre_name = split[0]
-
-                # If tokens not exhausted
-                if tokens_exhausted < self.num_youtube_api_keys:
-                    print(f"Fetching URLs for {genre_name.capitalize()}")
-
-                o.write(f"{genre_name}\n")
-
-                # Loop Iterators
-                length = len(songs)
-                i = 0
-
-                while i < length:
-
-                    # First time all tokens exhaust
-                    if tokens_exhausted == self.num_youtube_api_keys:
-                        print("All youtube api keys exhausted. Please add more youtube api keys to .env file")
-                        o.write(f"{songs[i]}\n")
-                        tokens_exhausted +=1
-                        i+=1
-                        if i == len(songs):
-                            o.write(f"----\n")
-                        continue
-                    # After first time all tokens exhaust
-                    elif tokens_exhausted > self.num_youtube_api_keys:
-                        if songs[i] != '':
-                            o.write(f"{songs[i]}\n")
-                        i+=1
-                        if i == len(songs):
-                            o.write(f"----\n")
-                        continue
-                    
-                    # If the song name already has its URL
-                    if "->" in songs[i]:
-                        print(f"{i:3.0f}:{len(songs):3.0f} URL already fetched for {songs[i].split('->')[0]}")
-                        o.write(f"{songs[i]}\n")
-                    # If the song name doesnt have its URL
-                    else:
+        return keys
+
+    def _make_youtube_lookup(self):
+        """Creates the Youtube lookup using all Youtube API keys and the persistent url cache
+
+        Returns:
+            (YoutubeKeyPool, UrlCache, YoutubeLookup): key pool, url cache and lookup
+        """
+        from YoutubeLookup import UrlCache, YoutubeKeyPool, YoutubeLookup
+
+        key_pool = YoutubeKeyPool(self._get_youtube_api_keys())
+        url_cache = UrlCache(os.path.join(os.path.dirname(self.song_name_dir), "url_cache.sqlite"))
+        lookup = YoutubeLookup(key_pool, url_cache, n_threads=self.n_threads, search_base_url=self.youtube_search_base_url, metrics=self.metrics)
+
+        return key_pool, url_cache, lookup
+
+    def stream_song_name_url(self, queue_size=100):
+        """Fetches song names and urls like generate_song_list and generate_song_url, but yields each song as soon as its url is
+        resolved instead of waiting for every genre. Names and urls are stored in the catalog as they arrive. Songs whose url could
+        not be resolved, and errors of pages, are kept in `self.stream_errors`
+
+        Args:
+            queue_size (int, optional): maximum number of resolved songs waiting to be consumed, url lookups pause when reached. Defaults to 100.
+                Lookups and page fetches stop once the consumer stops iterating, e.g. on a break, an exception or close().
+
+        Yields:
+            (str, str, str): genre, name and url of each song
+        """
+        import datetime
+
+        year_range = f"2000-{datetime.datetime.now().year}"
+
+        n_request_calls = max(1, self.amount_each // 50)
+        if self.amount_each % 50 != 0:
+            n_request_calls += 1
+
+        key_pool, url_cache, lookup = self._make_youtube_lookup()
+        resolved = queue.Queue(maxsize=queue_size)
+        self.stream_errors = []
+
+        # Set when the consumer stops iterating, so that no thread waits forever on the full queue
+        stop = threading.Event()
+
+        def put(entry):
+            # Blocks while the consumer falls behind, gives up once it stopped
+            while not stop.is_set():
+                try:
+                    resolved.put(entry, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def resolve(genre, name):
+            if stop.is_set():
+                return
+
+            try:
+                # Searched in this thread, the url threads of the stream being the only pool of lookups
+                video_id = lookup.resolve_one(name)
+            except Exception as e:
+                self.stream_errors.append((genre, name, repr(e)))
+                return
+
+            if video_id is None:
+                self.stream_errors.append((genre, name, "url not found"))
+                return
+
+            url = f"{self.youtube_video_base_url}{video_id}"
+            self.catalog.set_urls({name: url})
+            put((genre, name, url))
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=self.n_threads) as page_thread, ThreadPoolExecutor(max_workers=self.n_threads) as url_thread:
+                    pages = {page_thread.submit(self._fetch_song_page, genre, i * 50, year_range): genre for genre in self.genres for i in range(n_request_calls)}
+
+                    for page in as_completed(pages):
+                        if stop.is_set():
+                            # Pages and lookups that did not start are dropped, running ones return at their next put
+                            page_thread.shutdown(wait=False, cancel_futures=True)
+                            url_thread.shutdown(wait=False, cancel_futures=True)
+                            break
+
+                        genre = pages[page]
                         try:
-                            # Get API Key
-                            env_string = f"YOUTUBE_API_KEY{current_token}"
-                            auth_key = os.getenv(env_string)
-                            if not auth_key:
-                                raise ValidationErr("Youtube API key not found. Please add it to .env file.Use YOUTUBE_API_KEY0. Alternatively, you can use multiple keys with index starting from 0 since one API key will probably no be able to handle all requests.")
-                            
-                            # Send request
-                            response = requests.get(f"{self.youtube_search_base_url}?part=snippet&q={songs[i]} Lyrics&key={auth_key}")
+                            names = page.result()
+                        except Exception as e:
+                            self.stream_errors.append((genre, None, repr(e)))
+                            continue
+
+                        self.catalog.add_songs(genre, names)
+                        for name in names:
+                            url_thread.submit(resolve, genre, name)
+            finally:
+                url_cache.close()
+                put(None)
+
+        threading.Thread(target=produce, daemon=True).start()
+
+        try:
+            for song in iter(resolved.get, None):
+                yield song
+        finally:
+            stop.set()
 
-                            # If current token has been exhausted
-                            if response.status_code != 200:
-                                print(f"Token {current_token} exhausted. Trying next token")
-                                tokens_exhausted += 1
-                                current_token += 1
-                                continue
+    def generate_song_url(self):
+        """Fetches urls of songs of the catalog without one from Youtube API and stores them in the catalog.
+        Searches run concurrently across all Youtube API keys according to their remaining quota, and every resolved url is kept in
+        a persistent cache so that repeated songs never spend quota again
+
+        Raises:
+            ValueError: If no Youtube API key is found
 
+        Returns:
+            dictionary: song name as key and url as value, for songs fetched in this call
+        """
+        # Songs without url, searched all at once
+        missing = self.catalog.names_without_url(self.genres)
+        print(f"Fetching URLs for {len(missing)} songs")
+        if not missing:
+            return {}
 
-                            # Access video URL from the response
-                            j = response.json()
-                            item = j["items"][0]
-                            video_id = item["id"]["videoId"]
+        key_pool, url_cache, lookup = self._make_youtube_lookup()
 
-                            # Generate valid Youtube video URl
-                            video_url = f"{self.youtube_video_base_url}{video_id}"
+        video_ids = lookup.resolve(missing)
+        url_cache.close()
 
-                            # Store name with url into the file
-                            o.write(f"{songs[i]}->{video_url}\n")
+        urls = {name: f"{self.youtube_video_base_url}{video_id}" for name, video_id in video_ids.items()}
+        self.catalog.set_urls(urls)
 
-                            print(f"{i:3.0f}:{len(songs):3.0f} Fetched song url of {songs[i]}")
+        if key_pool.exhausted():
+            print("All youtube api keys exhausted. Please add more youtube api keys to .env file")
 
-                        except:
-                            print(f"{i:3.0f}:{len(songs):3.0f} Couldn't fetch song url of {songs[i]}")
-                           
-                    i += 1
-                    if i == len(songs):
-                        o.write(f"----\n")
+        for genre in self.genres:
+            print(f"{genre.capitalize()}: {self.catalog.count(genre, with_url=True)} of {self.catalog.count(genre)} songs have URLs")
 
+        for key, state in key_pool.keys.items():
+            print(f"Key ...{key[-4:]}: {state['used']} quota units used, {state['remaining']} remaining")
+            self.metrics.set("api_youtube_quota_remaining", state["remaining"], key=key[-4:])
+        self.metrics.flush()
 
+        return urls
@@ -0,0 +1,36 @@
+import threading
+import time
+
+
+class RateLimiter:
+
+    def __init__(self, rate, burst=None):
+        """Token bucket limiting how many calls are made per second, shared by any number of threads
+
+        Args:
+            rate (float): calls allowed per second
+            burst (int, optional): calls allowed at once after being idle. Defaults to None (same as `rate`, at least 1).
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, rate)
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks till a call is allowed
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
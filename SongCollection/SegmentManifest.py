@@ -0,0 +1,279 @@
+import os
+import re
+import sqlite3
+import threading
+
+# <genre>_<segment>_<name>.mp3 as written by SongDownloader, genres may contain underscores (e.g. Hip_Hop)
+SEGMENT_FILE_PATTERN = re.compile(r"^(.+?)_(\d+)_(.+)\.mp3$")
+
+
+class SegmentManifest:
+
+    def __init__(self, manifest_path):
+        """Index of downloaded songs and their segments stored in a SQLite database, so that checking whether a song is segmented
+        or listing the segments of a duration does not need to scan the song folders
+
+        Args:
+            manifest_path (str): path of the SQLite database
+        """
+        self.manifest_path = manifest_path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS originals (
+                id INTEGER PRIMARY KEY,
+                genre TEXT NOT NULL,
+                name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                duration REAL,
+                state TEXT NOT NULL,
+                UNIQUE (genre, name)
+            );
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY,
+                original_id INTEGER NOT NULL REFERENCES originals (id),
+                genre TEXT NOT NULL,
+                name TEXT NOT NULL,
+                file_name TEXT NOT NULL UNIQUE,
+                segment_duration INTEGER NOT NULL,
+                segment_index INTEGER NOT NULL,
+                duration REAL,
+                state TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS imported_dirs (
+                segment_duration INTEGER PRIMARY KEY
+            );
+            CREATE INDEX IF NOT EXISTS originals_path ON originals (path);
+            CREATE INDEX IF NOT EXISTS originals_state ON originals (state);
+            CREATE INDEX IF NOT EXISTS segments_original ON segments (original_id, segment_duration);
+            CREATE INDEX IF NOT EXISTS segments_duration_state ON segments (segment_duration, state);
+            """
+        )
+        self._connection.commit()
+
+    def add_original(self, genre, name, path, duration=None, state="downloaded"):
+        """Records a downloaded song, updating it if already recorded. Songs are identified by genre and name, the same file being
+        recorded once for each genre a song is listed under
+
+        Args:
+            genre (str): genre of the song
+            name (str): name of the song
+            path (str): path of the downloaded song
+            duration (float, optional): duration in seconds. Defaults to None.
+            state (str, optional): processing state. Defaults to "downloaded".
+
+        Returns:
+            int: id of the song
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO originals (genre, name, path, duration, state) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (genre, name) DO UPDATE SET path = excluded.path, "
+                "duration = COALESCE(excluded.duration, duration), state = excluded.state",
+                (genre, name, path, duration, state),
+            )
+            self._connection.commit()
+
+            return self._connection.execute("SELECT id FROM originals WHERE genre = ? AND name = ?", (genre, name)).fetchone()[0]
+
+    def set_original_state(self, genre, name, state):
+        """Changes processing state of a downloaded song
+
+        Args:
+            genre (str): genre of the song
+            name (str): name of the song
+            state (str): processing state, e.g. `downloaded`, `segmented`, `extracted` or `failed`
+        """
+        with self._lock:
+            self._connection.execute("UPDATE originals SET state = ? WHERE genre = ? AND name = ?", (state, genre, name))
+            self._connection.commit()
+
+    def get_original(self, genre, name):
+        """Looks up a downloaded song
+
+        Args:
+            genre (str): genre of the song
+            name (str): name of the song
+
+        Returns:
+            dict: id, path, duration and state of the song, None if not recorded
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, path, duration, state FROM originals WHERE genre = ? AND name = ?", (genre, name)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return dict(zip(["id", "path", "duration", "state"], row))
+
+    def get_originals(self, states=None):
+        """Lists downloaded songs
+
+        Args:
+            states (list(str), optional): only list songs in these states. Defaults to None (all states).
+
+        Returns:
+            list((str, str, str)): path, genre and name of each song
+        """
+        query = "SELECT path, genre, name FROM originals"
+        params = []
+
+        if states is not None:
+            query += f" WHERE state IN ({','.join('?' * len(states))})"
+            params.extend(states)
+
+        with self._lock:
+            return self._connection.execute(query + " ORDER BY id", params).fetchall()
+
+    def add_segments(self, genre, name, segment_duration, file_names, durations=None):
+        """Records segments of a downloaded song and marks the song as segmented
+
+        Args:
+            genre (str): genre of the song, which must be recorded already
+            name (str): name of the song
+            segment_duration (int): duration the song was segmented into
+            file_names (list(str)): file names of the segments in order
+            durations (list(float), optional): duration of each segment in seconds. Defaults to None.
+        """
+        if durations is None:
+            durations = [None] * len(file_names)
+
+        with self._lock:
+            row = self._connection.execute("SELECT id FROM originals WHERE genre = ? AND name = ?", (genre, name)).fetchone()
+            if row is None:
+                raise ValueError(f"{genre}: {name} is not recorded, record it with add_original first")
+            original_id = row[0]
+
+            self._connection.executemany(
+                "INSERT INTO segments (original_id, genre, name, file_name, segment_duration, segment_index, duration, state) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'segmented') "
+                "ON CONFLICT (file_name) DO UPDATE SET duration = excluded.duration, state = 'segmented'",
+                [(original_id, genre, name, file_name, segment_duration, i, duration) for i, (file_name, duration) in enumerate(zip(file_names, durations))],
+            )
+            self._connection.execute("UPDATE originals SET state = 'segmented' WHERE id = ?", (original_id,))
+            self._connection.commit()
+
+    def import_segment_dir(self, segment_dir, segment_duration, original_dir):
+        """Records segment files of a directory written before the manifest existed, e.g. by an older run. The directory is listed
+        only the first time for each segment duration, later calls return at once. Segments and songs already recorded are left as
+        they are
+
+        Args:
+            segment_dir (str): directory of segment files named `<genre>_<segment>_<name>.mp3`
+            segment_duration (int): duration of the segments of the directory
+            original_dir (str): directory of downloaded songs, used for the path of songs that are not recorded
+
+        Returns:
+            int: number of files of the directory that were not recorded yet, 0 if the directory was imported before
+        """
+        with self._lock:
+            if self._connection.execute("SELECT 1 FROM imported_dirs WHERE segment_duration = ?", (segment_duration,)).fetchone():
+                return 0
+
+        # Segments of each song in the order ffmpeg numbered them
+        songs = {}
+        for file_name in (os.listdir(segment_dir) if os.path.isdir(segment_dir) else []):
+            match = SEGMENT_FILE_PATTERN.match(file_name)
+            if match is None:
+                continue
+            genre, segment_index, name = match.groups()
+            songs.setdefault((genre, name), []).append((int(segment_index), file_name))
+
+        with self._lock:
+            n_imported = 0
+            for (genre, name), segments in songs.items():
+                # Named like SongDownloader names downloaded songs
+                path = os.path.join(original_dir, name.strip('?!@#$%^&*():;') + ".mp3")
+                self._connection.execute(
+                    "INSERT INTO originals (genre, name, path, state) VALUES (?, ?, ?, 'segmented') ON CONFLICT (genre, name) DO NOTHING",
+                    (genre, name, path),
+                )
+                original_id = self._connection.execute("SELECT id FROM originals WHERE genre = ? AND name = ?", (genre, name)).fetchone()[0]
+
+                n_imported += self._connection.executemany(
+                    "INSERT INTO segments (original_id, genre, name, file_name, segment_duration, segment_index, state) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'segmented') ON CONFLICT (file_name) DO NOTHING",
+                    [(original_id, genre, name, file_name, segment_duration, segment_index) for segment_index, file_name in sorted(segments)],
+                ).rowcount
+
+            self._connection.execute("INSERT INTO imported_dirs VALUES (?)", (segment_duration,))
+            self._connection.commit()
+
+        return n_imported
+
+    def is_segmented(self, genre, name, segment_duration):
+        """Checks whether a song has segments of a duration
+
+        Args:
+            genre (str): genre of the song
+            name (str): name of the song
+            segment_duration (int): duration of the segments
+
+        Returns:
+            bool: True if segments were recorded
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM segments JOIN originals ON segments.original_id = originals.id "
+                "WHERE originals.genre = ? AND originals.name = ? AND segments.segment_duration = ? LIMIT 1",
+                (genre, name, segment_duration),
+            ).fetchone()
+
+        return row is not None
+
+    def get_segments(self, segment_duration, states=None):
+        """Lists segments of a duration
+
+        Args:
+            segment_duration (int): duration of the segments
+            states (list(str), optional): only list segments in these states. Defaults to None (all states).
+
+        Returns:
+            list((str, str, str)): file name, genre and name of each segment
+        """
+        query = "SELECT file_name, genre, name FROM segments WHERE segment_duration = ?"
+        params = [segment_duration]
+
+        if states is not None:
+            query += f" AND state IN ({','.join('?' * len(states))})"
+            params.extend(states)
+
+        with self._lock:
+            return self._connection.execute(query + " ORDER BY id", params).fetchall()
+
+    def set_segment_state(self, file_names, state):
+        """Changes processing state of segments
+
+        Args:
+            file_names (list(str)): file names of the segments
+            state (str): processing state, e.g. `segmented`, `extracted` or `failed`
+        """
+        with self._lock:
+            self._connection.executemany("UPDATE segments SET state = ? WHERE file_name = ?", [(state, file_name) for file_name in file_names])
+            self._connection.commit()
+
+    def count_segments(self, segment_duration):
+        """Counts segments of a duration by processing state
+
+        Args:
+            segment_duration (int): duration of the segments
+
+        Returns:
+            dict: state as key and number of segments as value
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT state, COUNT(*) FROM segments WHERE segment_duration = ? GROUP BY state", (segment_duration,)
+            ).fetchall()
+
+        return dict(rows)
+
+    def close(self):
+        """Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,204 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class SongCatalog:
+
+    def __init__(self, catalog_path):
+        """Catalog of song names and urls stored in a SQLite database, indexed by genre and by name. Updates are incremental and
+        atomic, so adding songs or urls costs as much as the added rows and a crash never loses the catalog
+
+        Args:
+            catalog_path (str): path of the SQLite database
+        """
+        self.catalog_path = catalog_path
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(catalog_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS songs (
+                id INTEGER PRIMARY KEY,
+                genre TEXT NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT,
+                added_at REAL NOT NULL,
+                UNIQUE (genre, name)
+            );
+            CREATE INDEX IF NOT EXISTS songs_name ON songs (name);
+            CREATE INDEX IF NOT EXISTS songs_url ON songs (url);
+            """
+        )
+        self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def add_songs(self, genre, names):
+        """Adds songs of a genre, ignoring songs already in the catalog
+
+        Args:
+            genre (str): genre of the songs
+            names (list(str)): song names
+
+        Returns:
+            int: number of added songs
+        """
+        now = time.time()
+
+        with self._lock, self._connection:
+            cursor = self._connection.executemany(
+                "INSERT OR IGNORE INTO songs (genre, name, added_at) VALUES (?, ?, ?)", [(genre, name, now) for name in names]
+            )
+            return cursor.rowcount
+
+    def set_urls(self, urls):
+        """Sets urls of songs, in every genre the song is in
+
+        Args:
+            urls (dict): song name as key and url as value
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("UPDATE songs SET url = ? WHERE name = ?", [(url, name) for name, url in urls.items()])
+
+    def names_without_url(self, genres=None):
+        """Lists distinct names of songs that have no url yet
+
+        Args:
+            genres (list(str), optional): only list songs of these genres. Defaults to None (all genres).
+
+        Returns:
+            list(str): song names
+        """
+        query = "SELECT DISTINCT name FROM songs WHERE url IS NULL"
+        params = []
+
+        if genres is not None:
+            query += f" AND genre IN ({','.join('?' * len(genres))})"
+            params = list(genres)
+
+        with self._lock:
+            return [name for name, in self._connection.execute(query + " ORDER BY id", params)]
+
+    def genres(self):
+        """Lists genres in the catalog
+
+        Returns:
+            list(str): genres
+        """
+        with self._lock:
+            return [genre for genre, in self._connection.execute("SELECT DISTINCT genre FROM songs ORDER BY genre")]
+
+    def count(self, genre=None, with_url=False):
+        """Counts songs
+
+        Args:
+            genre (str, optional): only count songs of this genre. Defaults to None (all genres).
+            with_url (bool, optional): only count songs that have a url. Defaults to False.
+
+        Returns:
+            int: number of songs
+        """
+        query = "SELECT COUNT(*) FROM songs WHERE 1 = 1"
+        params = []
+
+        if genre is not None:
+            query += " AND genre = ?"
+            params.append(genre)
+        if with_url:
+            query += " AND url IS NOT NULL"
+
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()[0]
+
+    def iter_songs(self, genres=None, with_url=True, batch_size=1000):
+        """Iterates over songs lazily, reading `batch_size` songs from the database at a time
+
+        Args:
+            genres (list(str), optional): only iterate over songs of these genres. Defaults to None (all genres).
+            with_url (bool, optional): only iterate over songs that have a url. Defaults to True.
+            batch_size (int, optional): number of songs read at once. Defaults to 1000.
+
+        Yields:
+            (str, str, str): genre, name and url of each song, in the order they were added
+        """
+        query = "SELECT id, genre, name, url FROM songs WHERE id > ?"
+        params = []
+
+        if genres is not None:
+            query += f" AND genre IN ({','.join('?' * len(genres))})"
+            params.extend(genres)
+        if with_url:
+            query += " AND url IS NOT NULL"
+        query += " ORDER BY id LIMIT ?"
+
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._connection.execute(query, [last_id, *params, batch_size]).fetchall()
+
+            for _, genre, name, url in rows:
+                yield genre, name, url
+
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def import_text(self, text_path):
+        """Imports songs from a name_list.txt file written by previous versions of APICall, `GENRE=<genre>` lines followed by
+        `<name>` or `<name>-><url>` lines and `----` after each genre
+
+        Args:
+            text_path (str): path of the text file
+
+        Returns:
+            int: number of imported songs
+        """
+        now = time.time()
+        rows = []
+        genre = None
+
+        with open(text_path, "r") as f:
+            for line in f:
+                line = line.rstrip("\n")
+
+                if line.startswith("GENRE="):
+                    genre = line.split("=", 1)[1]
+                elif line == "----" or line == "" or genre is None:
+                    continue
+                elif "->" in line:
+                    name, url = line.split("->", 1)
+                    rows.append((genre, name, url, now))
+                else:
+                    rows.append((genre, line, None, now))
+
+        with self._lock, self._connection:
+            return self._connection.executemany("INSERT OR IGNORE INTO songs (genre, name, url, added_at) VALUES (?, ?, ?, ?)", rows).rowcount
+
+    def export_text(self, text_path):
+        """Exports the catalog into the name_list.txt format. The file is written next to the target and moved over it,
+        so a crash never leaves a partial file
+
+        Args:
+            text_path (str): path of the text file
+        """
+        temporary_path = text_path + ".tmp"
+
+        with open(temporary_path, "w") as f:
+            for genre in self.genres():
+                f.write(f"GENRE={genre}\n")
+                for _, name, url in self.iter_songs([genre], with_url=False):
+                    f.write(f"{name}->{url}\n" if url else f"{name}\n")
+                f.write("----\n")
+
+        os.replace(temporary_path, text_path)
+
+    def close(self):
+        """Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
@@ -1,34 +1,85 @@
 
 import os
+import queue
 import subprocess
+import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
 
 from pytube import YouTube
 
-from progressBar import printProgressBar
+from SegmentManifest import SegmentManifest
+
+# Monitoring modules are shared with FeatureExtraction
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Monitoring"))
+
+from MemoryBudget import MemoryBudget
+from Metrics import Metrics
+from ProgressReporter import ProgressReporter
 
 
 class SongDownloader:
-    def __init__(self, n_threads, segment_duration=30):
+    def __init__(self, n_threads, segment_duration=30, feature_extractor=None, n_segment_threads=None, queue_size=None, keep_originals=True, metrics=None,
+                 memory_limit=None):
         """
 
         Args:
-            n_threads (int): Number of threads to utilize for downloading and segmenting songs
+            n_threads (int): Number of threads to utilize for downloading songs
             segment_duration (int, optional): Duration in seconds to segment song into. Defaults to 30.
+            feature_extractor (FeatureExtractor, optional): If given, each downloaded song is decoded once and its segments are passed from memory
+                to this extractor instead of being written to the segment folder. Its `segment_duration` is used. Defaults to None.
+            n_segment_threads (int, optional): Number of threads to utilize for segmenting (or extracting features of) downloaded songs. Defaults to None (number of CPUs).
+            queue_size (int, optional): Maximum number of downloaded songs waiting to be segmented, downloads pause when reached. Defaults to None (twice `n_segment_threads`).
+            keep_originals (bool, optional): Keep downloaded songs once their features were extracted from memory. If False, at most
+                `n_threads + queue_size + n_segment_threads` downloaded songs are on disk at once, and songs extracted by an earlier run
+                are skipped using the manifest, their rows being read from the feature cache of `feature_extractor`. Defaults to True.
+            metrics (Metrics, optional): metrics updated with stage timings, bytes downloaded and errors. Defaults to None (own metrics,
+                or the metrics of `feature_extractor` if given).
+            memory_limit (int or str, optional): ceiling of the resident memory of the process, e.g. `2G`. Songs are extracted from memory
+                only while their footprint, estimated from their duration, fits and the number extracted at once adapts to the measured memory.
+                Defaults to None (the limit of `feature_extractor` if it has one, else no limit).
         """
-        # Number of threads ot utlilize to download and segment songs
+        # Number of threads ot utlilize to download songs, and to segment them
         self.n_threads = n_threads
+        self.n_segment_threads = n_segment_threads or os.cpu_count() or 1
+        self.queue_size = queue_size or 2 * self.n_segment_threads
+        self.keep_originals = keep_originals
 
         # Duration for each segmented clip
         self.SEGMENT_DURATION = segment_duration # Seconds
 
+        # Extractor fed with in memory segments
+        self.feature_extractor = feature_extractor
+        if feature_extractor is not None:
+            self.SEGMENT_DURATION = feature_extractor.segment_duration
+
         # Get root path of the project and initialize song directory
         self.original_folder, self.segment_folder = self._make_song_dir()
 
+        # Index of downloaded songs and segments, queried instead of scanning the song folders
+        self.manifest = SegmentManifest(os.path.join(os.path.dirname(self.original_folder), "manifest.sqlite"))
+        # Segments of runs before the manifest existed, which are skipped below and would be missing from it otherwise
+        self.manifest.import_segment_dir(self.segment_folder, self.SEGMENT_DURATION, self.original_folder)
+
         # To keep track of progress
         self.completed_songs = 0
         self.total_songs = 0
+        self.results = []
+        self.progress = None
+        self._lock = threading.Lock()
+        self._songs_error = None
+
+        # Stage timings, counters and errors, shared with the extractor so that one snapshot covers the whole run
+        if metrics is None:
+            metrics = feature_extractor.metrics if feature_extractor is not None else Metrics()
+        self.metrics = metrics
+
+        # A single budget for the process, shared with the extractor which reserves the footprint of each song it extracts
+        self.memory_budget = feature_extractor.memory_budget if feature_extractor is not None else None
+        if self.memory_budget is None and memory_limit is not None:
+            self.memory_budget = MemoryBudget(memory_limit, self.n_segment_threads, metrics=self.metrics)
+            if feature_extractor is not None:
+                feature_extractor.memory_budget = self.memory_budget
 
     def _make_song_dir(self):
         """Private method to create directory to store downloaded songs in, if not already created
@@ -66,31 +117,34 @@ class SongDownloader:
 
         return orignal_folder, segment_folder
 
-    def _download_individual_song(self, genre, song_name, song_url):
-        """Private method to download and segment one song at a time
+    def _download(self, genre, song_name, song_url):
+        """Private method to download one song, if not already downloaded
 
         Args:
             genre (str): Genre of song
             song_name (str): Name of song
             song_url (str): Youtube URL of song
+
+        Returns:
+            str: path of the downloaded song
         """
 
 
         # Path of the song where it is going to be downloaded
         downloaded_file_path = self.original_folder + "\\" + song_name.strip('?!@#$%^&*():;') + ".mp3"
 
-        # Path of first segment of the song
-        segmented_file_name = f'{genre}_00_{song_name}.mp3'
-        segmented_file_path = os.path.join(self.segment_folder, segmented_file_name)
-
         # If song is not already downloaded
         if not (os.path.isfile(downloaded_file_path)):
 
-            yt = YouTube(song_url)
+            with self.metrics.timer("download_fetch"):
+                yt = YouTube(song_url)
 
-            # Get the audio stream
-            audio = yt.streams.filter(only_audio=True).first()
-            output_file = audio.download(output_path=self.original_folder)
+                # Get the audio stream
+                audio = yt.streams.filter(only_audio=True).first()
+                output_file = audio.download(output_path=self.original_folder)
+
+            self.metrics.increment("download_songs")
+            self.metrics.increment("download_bytes", os.path.getsize(output_file))
 
             # Absolute path of downloaded song
             base, _ = os.path.splitext(output_file)
@@ -99,42 +153,226 @@ class SongDownloader:
             new_file = "\\".join(base.split("\\")[:-1]) + f"\\{song_name.strip('?!@#$%^&*():;')}.mp3"
             os.rename(output_file, new_file)
 
+            self.manifest.add_original(genre, song_name, downloaded_file_path, self._get_duration(downloaded_file_path))
+
+        # Songs downloaded before the manifest existed
+        elif self.manifest.get_original(genre, song_name) is None:
+            self.manifest.add_original(genre, song_name, downloaded_file_path, self._get_duration(downloaded_file_path))
+            self.metrics.increment("download_skipped")
+
+        else:
+            self.metrics.increment("download_skipped")
+
+        return downloaded_file_path
+
+    def _skip_processed(self, genre, song_name):
+        """Private method to check whether an earlier run already processed a song, based on the manifest and not on the original
+        file, which is removed after extraction if `keep_originals` is False
+
+        Args:
+            genre (str): Genre of song
+            song_name (str): Name of song
+
+        Returns:
+            bool: True if the song does not need to be downloaded again
+        """
+        if self.feature_extractor is None:
+            processed = self.manifest.is_segmented(genre, song_name, self.SEGMENT_DURATION)
+        else:
+            # Rows of the earlier run are taken from the feature cache, songs missing from it are downloaded and extracted again
+            original = self.manifest.get_original(genre, song_name)
+            processed = original is not None and original["state"] == "extracted" and self.feature_extractor.load_song(genre, song_name) > 0
+
+        if processed:
+            self.metrics.increment("download_skipped")
+        return processed
+
+    def _process_downloaded(self, genre, song_name, downloaded_file_path):
+        """Private method to segment a downloaded song, or to extract features of its segments from memory if a feature extractor was given
+
+        Args:
+            genre (str): Genre of song
+            song_name (str): Name of song
+            downloaded_file_path (str): path of the downloaded song
+        """
+        # Path of first segment of the song
+        segmented_file_name = f'{genre}_00_{song_name}.mp3'
+        segmented_file_path = os.path.join(self.segment_folder, segmented_file_name)
+
+        # Segments are cut in memory and sent to the extractor, no segment files are written
+        if self.feature_extractor is not None:
+            # Duration recorded at download, the footprint of the song being estimated from it, or read from the song if it is missing
+            original = self.manifest.get_original(genre, song_name)
+            duration = None if original is None else original["duration"]
+
+            with self.metrics.timer("download_extract"):
+                n_segments = self.feature_extractor.extract_song(downloaded_file_path, genre, song_name, duration)
+            self.metrics.increment("download_segments", n_segments)
+            self.manifest.set_original_state(genre, song_name, "extracted")
+
+            if not self.keep_originals:
+                os.remove(downloaded_file_path)
+
         # If song is not alreaded segmented
-        if not (os.path.isfile(segmented_file_path)):
+        elif not (self.manifest.is_segmented(genre, song_name, self.SEGMENT_DURATION) or os.path.isfile(segmented_file_path)):
             self._segment_song(downloaded_file_path, song_name, genre)
 
+    def _record(self, genre, song_name, stage, error=None):
+        """Private method to record the result of a song and track progress
+
+        Args:
+            genre (str): Genre of song
+            song_name (str): Name of song
+            stage (str): last stage reached, `download` or `segment`
+            error (Exception, optional): raised exception if the song failed. Defaults to None.
+        """
+        with self._lock:
+            self.results.append({
+                "genre": genre,
+                "name": song_name,
+                "status": "done" if error is None else "failed",
+                "stage": stage,
+                "error": None if error is None else repr(error),
+            })
+
+            # Track Progress
+            self.completed_songs += 1
+
+        if error is not None:
+            self.metrics.increment("download_errors", stage=stage, type=type(error).__name__)
+        if self.progress is not None:
+            self.progress.update(failed=int(error is not None))
+
+    def _download_worker(self, songs, downloaded):
+        """Private method run by download threads, downloads songs till there are none left
+
+        Args:
+            songs (iterator): shared iterator of (genre, name, url)
+            downloaded (Queue): queue of downloaded songs waiting to be segmented
+        """
+        while True:
+            with self._lock:
+                # Stops every worker once reading songs failed, e.g. a missing API key of APICall.stream_song_name_url
+                if self._songs_error is not None:
+                    return
+                try:
+                    song = next(songs, None)
+                except Exception as e:
+                    self._songs_error = e
+                    self.metrics.increment("download_errors", stage="songs", type=type(e).__name__)
+                    return
+            if song is None:
+                return
+
+            genre, song_name, song_url = song
+            try:
+                if self._skip_processed(genre, song_name):
+                    self._record(genre, song_name, "segment")
+                    continue
+                downloaded_file_path = self._download(genre, song_name, song_url)
+            except Exception as e:
+                self._record(genre, song_name, "download", e)
+                continue
+
+            # Blocks while segmenting falls behind
+            downloaded.put((genre, song_name, downloaded_file_path))
+
+    def _segment_worker(self, downloaded):
+        """Private method run by segment threads, segments downloaded songs till downloads are done
 
-        # Track Progress
-        self.completed_songs += 1
-        if self.completed_songs % 2 == 0:
-            printProgressBar(self.completed_songs, self.total_songs, prefix = 'Progress:', suffix = 'Complete', length = 50)
+        Args:
+            downloaded (Queue): queue of downloaded songs waiting to be segmented
+        """
+        while True:
+            song = downloaded.get()
+            if song is None:
+                return
+
+            genre, song_name, downloaded_file_path = song
+            try:
+                self._process_downloaded(genre, song_name, downloaded_file_path)
+            except Exception as e:
+                self._record(genre, song_name, "segment", e)
+                continue
 
-                
+            self._record(genre, song_name, "segment")
 
     def download_song(self, song_list, song_url):
         """Downloads songs using song_url youtube and saves them in the songs folder and segments them and stores them in a folder named segment_<segment_duration>
-        Utilized muiltithreading for faster processing
+        Songs of all genres go through the same download and segment threads. If a feature extractor was given, features of the segments
+        are extracted from memory and saved by the extractor instead
 
         Args:
             song_list (list(str)): directory with genre as keys and list of song names as values
             song_url (list(str)): directory with genre as keys and list of song url as values
+
+        Returns:
+            list(dict): genre, name, status, stage and error of each song
         """
      
         # Initlialize total songs
-        self.total_songs = sum([len(song_list[genre]) for genre in song_list.keys()])
+        total_songs = sum([len(song_list[genre]) for genre in song_list.keys()])
+
+        songs = ((genre, name, url) for genre in song_list.keys() for name, url in zip(song_list[genre], song_url[genre]))
+
+        return self.download_songs(songs, total_songs)
+
+    def download_songs(self, songs, total_songs=None):
+        """Downloads and segments songs read lazily from an iterable, e.g. APICall.iter_song_name_url, so that the whole catalog
+        never has to be in memory. `n_threads` threads download songs and hand them to `n_segment_threads` threads through a
+        bounded queue, so slow downloads never hold up segmenting and downloads pause when segmenting falls behind
+
+        Args:
+            songs (iterable): (genre, name, url) of each song
+            total_songs (int, optional): number of songs, used for the progress bar. Defaults to None (unknown).
+
+        Raises:
+            Exception: error raised by `songs`, after songs read before it are processed and saved
+
+        Returns:
+            list(dict): genre, name, status, stage and error of each song
+        """
+        self.total_songs = total_songs or 0
+        self.completed_songs = 0
+        self.results = []
+        self._songs_error = None
+        self.progress = ProgressReporter(self.total_songs, prefix="Downloading:")
+
+        if self.feature_extractor is not None:
+            self.feature_extractor.clear_checkpoints()
+
+        songs = iter(songs)
+        downloaded = queue.Queue(maxsize=self.queue_size)
+
+        downloaders = [threading.Thread(target=self._download_worker, args=(songs, downloaded), daemon=True) for _ in range(self.n_threads)]
+        segmenters = [threading.Thread(target=self._segment_worker, args=(downloaded,), daemon=True) for _ in range(self.n_segment_threads)]
 
-        genres = list(song_list.keys())
+        for worker in [*downloaders, *segmenters]:
+            worker.start()
 
-        for genre in genres:
+        for downloader in downloaders:
+            downloader.join()
+        for _ in segmenters:
+            downloaded.put(None)
+        for segmenter in segmenters:
+            segmenter.join()
 
-            # Convert genre to a list beacuse map only accepts an iterable
-            genre_list = [genre] * len(song_list[genre])
+        self.progress.close()
+        self.progress = None
 
-            # Divide task to each thread
-            with ThreadPoolExecutor(max_workers=self.n_threads) as thread:
-                thread.map(self._download_individual_song, genre_list, song_list[genre], song_url[genre])
+        if self.feature_extractor is not None:
+            self.feature_extractor.save_data()
+        self.metrics.flush()
 
+        failures = [result for result in self.results if result["status"] == "failed"]
+        print(f"{len(self.results) - len(failures)} songs done, {len(failures)} failed")
+        for failure in failures:
+            print(f"{failure['genre']}: {failure['name']} failed at {failure['stage']}: {failure['error']}")
 
+        if self._songs_error is not None:
+            raise self._songs_error
+
+        return self.results
 
     def _segment_song(self, song_path, filename,  genre):
         """Segments song into duration of self.SEGMENT_DURATION seconds and saves them in the songs folder
@@ -155,17 +393,49 @@ class SongDownloader:
   
         # Using ffmpeg to convert mp3 into segments of 10 seconds as .mp4
         # Converting to mp3 causes Missing Headers error
-        subprocess.run(['ffmpeg', '-i', song_path, '-c', 'copy' ,'-f' ,'segment', '-segment_time', str(self.SEGMENT_DURATION) ,'-reset_timestamps' ,'1', f'{genre}_%02d_{filename}.mp4', '-loglevel', 'quiet'], shell=True)
+        with self.metrics.timer("download_segment"):
+            subprocess.run(['ffmpeg', '-i', song_path, '-c', 'copy' ,'-f' ,'segment', '-segment_time', str(self.SEGMENT_DURATION) ,'-reset_timestamps' ,'1', f'{genre}_%02d_{filename}.mp4', '-loglevel', 'quiet'], shell=True)
      
-        # Converting all .mp4 files to .mp3
-        for filename in os.listdir(self.segment_folder):
-
-            infilename = os.path.join(self.segment_folder,filename)
+        # Converting .mp4 segments of this song to .mp3, ffmpeg numbers them from 00
+        segment_names = []
+        segment_index = 0
+        while True:
+            infilename = os.path.join(self.segment_folder, f'{genre}_{segment_index:02d}_{filename}.mp4')
             if not os.path.isfile(infilename):
-                continue
-            _ = os.path.splitext(filename)
+                break
+
             newname = infilename.replace('.mp4', '.mp3')
-            _ = os.rename(infilename, newname)
-        
-    
+            os.rename(infilename, newname)
+            segment_names.append(os.path.basename(newname))
+            segment_index += 1
+
+        # Songs segmented without being recorded, e.g. by a caller of this method
+        original = self.manifest.get_original(genre, filename)
+        if original is None:
+            self.manifest.add_original(genre, filename, song_path, self._get_duration(song_path))
+            original = self.manifest.get_original(genre, filename)
+
+        # Every segment is SEGMENT_DURATION long except the last one
+        duration = original["duration"]
+        durations = None
+        if duration is not None:
+            durations = [min(self.SEGMENT_DURATION, duration - i * self.SEGMENT_DURATION) for i in range(len(segment_names))]
+
+        self.manifest.add_segments(genre, filename, self.SEGMENT_DURATION, segment_names, durations)
+        self.metrics.increment("download_segments", len(segment_names))
+
+    def _get_duration(self, song_path):
+        """Gets duration of a song using ffprobe
+
+        Args:
+            song_path (str): path of the song
+
+        Returns:
+            float: duration in seconds, None if it could not be read
+        """
+        try:
+            result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', song_path], capture_output=True, text=True)
+            return float(result.stdout.strip())
+        except (OSError, ValueError):
+            return None
 
@@ -0,0 +1,273 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UrlCache:
+
+    def __init__(self, cache_path):
+        """Persistent cache of resolved Youtube video ids stored in a SQLite database, keyed by song name so that repeated songs and
+        songs shared by several genres are only searched once
+
+        Args:
+            cache_path (str): path of the SQLite database
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS urls (song_name TEXT PRIMARY KEY, video_id TEXT NOT NULL, resolved_at REAL NOT NULL)")
+        self._connection.commit()
+
+    def get_many(self, song_names):
+        """Looks up video ids of many songs
+
+        Args:
+            song_names (list(str)): song names
+
+        Returns:
+            dict: song name as key and video id as value, for cached songs only
+        """
+        found = {}
+        song_names = list(song_names)
+
+        with self._lock:
+            # SQLite limits the number of parameters of a query
+            for i in range(0, len(song_names), 500):
+                batch = song_names[i:i+500]
+                rows = self._connection.execute(
+                    f"SELECT song_name, video_id FROM urls WHERE song_name IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+
+        return found
+
+    def put(self, song_name, video_id):
+        """Stores the video id of a song
+
+        Args:
+            song_name (str): song name
+            video_id (str): Youtube video id
+        """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?)", (song_name, video_id, time.time()))
+            self._connection.commit()
+
+    def close(self):
+        """Closes the database connection
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class YoutubeKeyPool:
+
+    def __init__(self, keys, quota_per_key=10000, search_cost=100, max_backoff=300):
+        """Hands out Youtube API keys according to their remaining quota. A key that fails is backed off exponentially on its own,
+        and only counts as exhausted when Youtube reports its quota exceeded
+
+        Args:
+            keys (list(str)): Youtube API keys
+            quota_per_key (int, optional): daily quota units of a key. Defaults to 10000 (Youtube default).
+            search_cost (int, optional): quota units spent by a search request. Defaults to 100.
+            max_backoff (float, optional): maximum seconds a failing key is backed off. Defaults to 300.
+        """
+        self.search_cost = search_cost
+        self.max_backoff = max_backoff
+
+        self.keys = {
+            key: {"remaining": quota_per_key, "used": 0, "failures": 0, "backoff_until": 0.0}
+            for key in keys
+        }
+
+        self._condition = threading.Condition()
+
+    def _available(self, key):
+        """Checks whether a key has quota left for a search
+
+        Args:
+            key (str): Youtube API key
+
+        Returns:
+            bool: True if the key has quota left
+        """
+        return self.keys[key]["remaining"] >= self.search_cost
+
+    def acquire(self):
+        """Reserves quota of a search on the key with most quota left, waiting while all usable keys are backed off
+
+        Returns:
+            str: Youtube API key, None if all keys are exhausted
+        """
+        with self._condition:
+            while True:
+                usable = [key for key in self.keys if self._available(key)]
+                if not usable:
+                    return None
+
+                now = time.monotonic()
+                ready = [key for key in usable if self.keys[key]["backoff_until"] <= now]
+                if ready:
+                    key = max(ready, key=lambda key: self.keys[key]["remaining"])
+                    self.keys[key]["remaining"] -= self.search_cost
+                    self.keys[key]["used"] += self.search_cost
+                    return key
+
+                self._condition.wait(min(self.keys[key]["backoff_until"] for key in usable) - now)
+
+    def release(self, key, status_code, reason=None):
+        """Reports the result of a search made with a key
+
+        Args:
+            key (str): Youtube API key
+            status_code (int): status code of the response
+            reason (str, optional): error reason given by Youtube, e.g. `quotaExceeded`. Defaults to None.
+        """
+        with self._condition:
+            state = self.keys[key]
+
+            if status_code == 200:
+                state["failures"] = 0
+            elif reason in ("quotaExceeded", "dailyLimitExceeded"):
+                state["remaining"] = 0
+            else:
+                state["failures"] += 1
+                state["backoff_until"] = time.monotonic() + min(self.max_backoff, 2 ** state["failures"])
+
+            self._condition.notify_all()
+
+    def exhausted(self):
+        """Checks whether all keys ran out of quota
+
+        Returns:
+            bool: True if no key has quota left
+        """
+        with self._condition:
+            return not any(self._available(key) for key in self.keys)
+
+
+class YoutubeLookup:
+
+    def __init__(self, key_pool, url_cache, n_threads=8, search_base_url="https://www.googleapis.com/youtube/v3/search", metrics=None):
+        """Resolves song names to Youtube video ids, searching concurrently with all keys of the key pool and remembering every result
+
+        Args:
+            key_pool (YoutubeKeyPool): Youtube API keys
+            url_cache (UrlCache): cache of resolved video ids
+            n_threads (int, optional): number of searches sent at once. Defaults to 8.
+            search_base_url (str, optional): url of Youtube search API. Defaults to "https://www.googleapis.com/youtube/v3/search".
+            metrics (Metrics, optional): metrics updated with searches, their latency, quota used and cache hits. Defaults to None.
+        """
+        self.key_pool = key_pool
+        self.metrics = metrics
+        self.url_cache = url_cache
+        self.n_threads = n_threads
+        self.search_base_url = search_base_url
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=n_threads))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=n_threads))
+
+    def _search(self, song_name, max_attempts=5):
+        """Searches the video id of a song
+
+        Args:
+            song_name (str): song name
+            max_attempts (int, optional): number of keys tried before giving up. Defaults to 5.
+
+        Returns:
+            str: video id, None if it could not be found or all keys are exhausted
+        """
+        for _ in range(max_attempts):
+            key = self.key_pool.acquire()
+            if key is None:
+                return None
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(self.search_base_url, params={"part": "snippet", "q": f"{song_name} Lyrics", "key": key})
+            except requests.RequestException as e:
+                self.key_pool.release(key, None)
+                self._record_search(start, type(e).__name__)
+                continue
+
+            self._record_search(start, response.status_code)
+
+            if response.status_code != 200:
+                reason = None
+                try:
+                    reason = response.json()["error"]["errors"][0]["reason"]
+                except (ValueError, KeyError, IndexError, TypeError):
+                    pass
+
+                self.key_pool.release(key, response.status_code, reason)
+                continue
+
+            self.key_pool.release(key, 200)
+
+            items = response.json().get("items", [])
+            if not items:
+                return None
+
+            video_id = items[0]["id"].get("videoId")
+            if video_id is not None:
+                self.url_cache.put(song_name, video_id)
+            return video_id
+
+        return None
+
+    def _record_search(self, start, status):
+        """Records a search in the metrics, if any
+
+        Args:
+            start (float): time.perf_counter() before the search was sent
+            status (int or str): status code of the response, or name of the raised exception
+        """
+        if self.metrics is None:
+            return
+
+        self.metrics.observe("api_request", time.perf_counter() - start, api="youtube")
+        self.metrics.increment("api_calls", api="youtube", status=status)
+        self.metrics.increment("api_youtube_quota_used", self.key_pool.search_cost)
+
+    def resolve_one(self, song_name):
+        """Resolves a single song name in the calling thread, for callers searching from their own threads (e.g.
+        APICall.stream_song_name_url), which `resolve` would give a thread pool of its own for every song
+
+        Args:
+            song_name (str): song name
+
+        Returns:
+            str: video id, None if it could not be found
+        """
+        video_id = self.url_cache.get_many([song_name]).get(song_name)
+        if video_id is not None:
+            if self.metrics is not None:
+                self.metrics.increment("api_youtube_cache_hits")
+            return video_id
+
+        return self._search(song_name)
+
+    def resolve(self, song_names):
+        """Resolves song names to video ids. Cached and duplicate names do not spend any quota
+
+        Args:
+            song_names (list(str)): song names
+
+        Returns:
+            dict: song name as key and video id as value, for resolved songs only
+        """
+        unique_names = list(dict.fromkeys(song_names))
+        resolved = self.url_cache.get_many(unique_names)
+
+        missing = [song_name for song_name in unique_names if song_name not in resolved]
+        if self.metrics is not None:
+            self.metrics.increment("api_youtube_cache_hits", len(resolved))
+        with ThreadPoolExecutor(max_workers=self.n_threads) as thread:
+            for song_name, video_id in zip(missing, thread.map(self._search, missing)):
+                if video_id is not None:
+                    resolved[song_name] = video_id
+
+        return resolved
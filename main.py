@@ -1,11 +1,74 @@
-from FeatureExtraction.FeatureExtractor import FeatureExtractor
-from SongCollection.APICall import APICall
-from SongCollection.SongDownloader import SongDownloader
+import argparse
+import os
+import sys
+import time
 
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
 
-def main():
-    # Making APICall object to acquire song name and url of 50 songs of 2 genre each using 1 API key.
-    ac = APICall(["classical", "rock"],50, 1)
+# Modules of each folder import their siblings directly
+for directory in ["FeatureExtraction", "SongCollection", "Deployment", "Monitoring"]:
+    sys.path.append(os.path.join(ROOT_DIR, directory))
+
+# Heavy modules (librosa, numba, pandas) are only imported by the commands that need them, so collecting urls starts instantly
+
+GENRES = ["classical", "rock"]
+
+
+def _make_metrics(args):
+    """Creates the metrics shared by every stage of a command
+
+    Args:
+        args (Namespace): parsed arguments
+
+    Returns:
+        Metrics: metrics written to `--metrics`
+    """
+    from Metrics import Metrics
+
+    return Metrics(path=args.metrics)
+
+
+def _ignore_warnings():
+    """Ignores warnings thrown while decoding songs
+    """
+    import warnings
+
+    # Ignoring warning thrown by Librosa because of mp3 format
+    warnings.filterwarnings("ignore")
+
+
+def _enable_jit_cache():
+    """Caches compiled numba kernels on disk (see JitCache.enable), called before librosa is imported so that its kernels are cached too
+    """
+    import JitCache
+    JitCache.enable()
+
+
+def _return_freed_memory(args):
+    """Makes freed memory go back to the system when `--memory-limit` is given, so that the measured RSS the budget adapts to does
+    not include memory freed by earlier songs (see MemoryBudget.return_freed_memory)
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    if args.memory_limit is not None:
+        from MemoryBudget import return_freed_memory
+        return_freed_memory()
+
+
+def collect(args, metrics=None):
+    """Fetches song names from Spotify and their urls from Youtube into the catalog
+
+    Args:
+        args (Namespace): parsed arguments
+        metrics (Metrics, optional): shared metrics. Defaults to None (written to `--metrics`).
+    """
+    from APICall import APICall
+
+    metrics = metrics or _make_metrics(args)
+
+    # Making APICall object to acquire song name and url of `amount` songs of each genre
+    ac = APICall(args.genres, args.amount, args.keys, metrics=metrics)
 
     # Getting song names
     ac.generate_song_list()
@@ -13,31 +76,343 @@ def main():
     # Getting song URLs
     ac.generate_song_url()
 
-    # Fetching the name and url stored in the file
-    song_name ,song_url = ac.get_song_name_url()
+    # Fetching the name and url stored in the catalog
+    song_name, song_url = ac.get_song_name_url()
 
-   
     for key in song_name.keys():
         print(f'Genre: {key} Songs: {len(song_name[key])} URLs: {len(song_url[key])}')
 
-    # Initializing SongDownloader object to download and segment songs using 10 threads
-    sd = SongDownloader(10)
-    
+    metrics.flush()
+
+
+def download(args, metrics=None):
+    """Downloads and segments songs of the catalog that have a url
+
+    Args:
+        args (Namespace): parsed arguments
+        metrics (Metrics, optional): shared metrics. Defaults to None (written to `--metrics`).
+    """
+    from SongCatalog import SongCatalog
+    from SongDownloader import SongDownloader
+
+    metrics = metrics or _make_metrics(args)
+
+    # Same catalog APICall writes, read directly so no Spotify request is needed
+    catalog = SongCatalog(os.path.join(ROOT_DIR, "SongCollection", "Song List", "catalog.sqlite"))
+    total_songs = sum(catalog.count(genre, with_url=True) for genre in args.genres)
+
+    # Initializing SongDownloader object to download and segment songs
+    sd = SongDownloader(args.threads, segment_duration=args.segment_duration, metrics=metrics, n_segment_threads=args.segment_threads,
+                        queue_size=args.queue_size)
+
     # Downloading and Segmenting songs
-    sd.download_song(song_name, song_url)
+    sd.download_songs(catalog.iter_songs(args.genres), total_songs)
+    catalog.close()
 
 
-    import warnings
+def extract(args, metrics=None):
+    """Extracts features of the segmented songs into data.csv and the columnar dataset
 
-    # Ignoring warning thrown by Librosa because of mp3 format
-    warnings.filterwarnings("ignore")
+    Args:
+        args (Namespace): parsed arguments
+        metrics (Metrics, optional): shared metrics. Defaults to None (written to `--metrics`).
+    """
+    _ignore_warnings()
+    _enable_jit_cache()
+    _return_freed_memory(args)
+    from FeatureExtractor import FeatureExtractor
 
-    # Initializing object for FeatureExtractor using 10 threads
-    fe = FeatureExtractor(n_threads=10)
+    fe = FeatureExtractor(segment_duration=args.segment_duration, n_threads=args.threads, n_processes=args.processes,
+                          output_format=args.format, metrics=metrics or _make_metrics(args), columns=args.columns or args.model,
+                          checkpoint_every=args.checkpoint_every, memory_limit=args.memory_limit)
 
     # Extracting Features -> stored into data.csv
     fe.extract_features()
 
 
+def queue(args):
+    """Starts a sharded extraction run: queues the segmented songs into work items that workers on any machine can lease
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    _ignore_warnings()
+    from FeatureExtractor import FeatureExtractor
+    from ShardedExtraction import ShardedExtraction
+
+    # Workers build their extractor with the same parameters
+    fe = FeatureExtractor(segment_duration=args.segment_duration, output_format=args.format, columns=args.columns or args.model)
+
+    sharded = ShardedExtraction(args.queue)
+    n_items = sharded.coordinate(fe, item_size=args.item_size, lease_seconds=args.lease, max_attempts=args.attempts)
+    print(f"Queued {fe.total_data} songs into {n_items} items in {args.queue}")
+
+
+def work(args):
+    """Extracts items of a sharded extraction run till none is left, in this process or in `--processes` local processes
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    _ignore_warnings()
+    _enable_jit_cache()
+    from ShardedExtraction import ShardedExtraction
+
+    metrics = _make_metrics(args)
+    sharded = ShardedExtraction(args.queue)
+
+    if args.processes > 0:
+        n_items = sharded.work_locally(args.processes, n_threads=args.threads, song_dir=args.song_dir, metrics=metrics)
+    else:
+        fe = sharded.make_extractor(args.threads, args.song_dir)
+        fe.metrics = metrics
+        n_items = sharded.work(fe)
+
+    print(f"Extracted {n_items} items, queue: {sharded.queue.counts()}")
+    metrics.flush()
+
+
+def merge(args):
+    """Writes the shards of a finished sharded extraction run into data.csv and the columnar dataset
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    from ShardedExtraction import ShardedExtraction
+
+    sharded = ShardedExtraction(args.queue)
+    n_rows, failed = sharded.merge(allow_unfinished=args.force)
+
+    for song_name in failed:
+        print(f"{song_name} was not extracted")
+    print(f"Merged {n_rows} rows")
+
+
+def frames(args):
+    """Computes frame level features of every downloaded song once, then writes a columnar dataset of features for each window
+    duration from them, without segmenting or extracting songs again
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    _ignore_warnings()
+    _enable_jit_cache()
+    from FeatureExtractor import FeatureExtractor
+    from FrameFeatureStore import FrameFeatureStore
+
+    fe = FeatureExtractor(n_threads=args.threads, metrics=_make_metrics(args), columns=args.columns)
+
+    # Songs already in the store are not computed again
+    store = FrameFeatureStore(args.store, fe)
+    for song_path, error in store.build_from_manifest():
+        print(f"{song_path} failed: {error}")
+
+    for window in args.windows or [args.segment_duration]:
+        start = time.perf_counter()
+        dataset = store.to_dataset(os.path.join(ROOT_DIR, f"dataset_{window:g}"), window, args.hop)
+        print(f"{window:g}s windows: {len(dataset)} rows of {len(store)} songs in {time.perf_counter() - start:.1f}s -> {dataset.dataset_dir}")
+
+    fe.metrics.flush()
+
+
+def stream(args):
+    """Runs every stage at once, each song moves to the next stage as soon as it is ready: its name is fetched, its url is
+    resolved, it is downloaded and features of its segments are extracted from memory. Feature rows are checkpointed every
+    few songs, and downloaded songs are removed once extracted so disk usage stays bounded by the number of songs in flight
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    _ignore_warnings()
+    _enable_jit_cache()
+    _return_freed_memory(args)
+    from APICall import APICall
+    from FeatureExtractor import FeatureExtractor
+    from SongDownloader import SongDownloader
+
+    start = time.perf_counter()
+
+    # Metrics of every stage, flushed at every checkpoint
+    metrics = _make_metrics(args)
+
+    # Same songs as collect, song names and urls are streamed instead of being stored first
+    ac = APICall(args.genres, args.amount, args.keys, metrics=metrics)
+
+    # Feature rows are checkpointed every `checkpoint_every` rows into FeatureExtraction/checkpoints, then merged into data.csv
+    fe = FeatureExtractor(segment_duration=args.segment_duration, n_threads=args.extract_threads, checkpoint_every=args.checkpoint_every,
+                          metrics=metrics, memory_limit=args.memory_limit)
+
+    # `threads` threads downloading and `segment_threads` extracting, at most `queue_size` downloaded songs waiting to be extracted
+    sd = SongDownloader(args.threads, feature_extractor=fe, n_segment_threads=args.segment_threads, queue_size=args.queue_size, keep_originals=False)
+
+    sd.download_songs(ac.stream_song_name_url())
+
+    for genre, song_name, error in ac.stream_errors:
+        print(f"{genre}: {song_name} failed at url: {error}")
+
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+def predict(args):
+    """Prints the genre of songs, probabilities being averaged over the segments of each song
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    _ignore_warnings()
+    _enable_jit_cache()
+    from FeatureExtractor import FeatureExtractor
+    from GenreClassifier import GenreClassifier
+
+    # Only the columns the model uses are extracted
+    classifier = GenreClassifier(args.model)
+    fe = FeatureExtractor(segment_duration=args.segment_duration, use_cache=False, res_type="kaiser_fast", columns=classifier.columns)
+
+    for song_path in args.songs:
+        rows = fe.extract_signal(*fe._load(song_path))
+        if not len(rows):
+            print(f"{song_path}: audio is too short")
+            continue
+
+        probabilities = classifier.predict_proba(rows).mean(axis=0)
+        ranking = sorted(zip(classifier.labels, probabilities), key=lambda label: -label[1])
+
+        print(f"{song_path}: {ranking[0][0]} ({', '.join(f'{label} {probability:.2f}' for label, probability in ranking[:3])})")
+
+
+def warmup(args):
+    """Compiles the numba kernels of resampling and feature extraction once and caches them on disk, so later commands and
+    worker processes load them instead of compiling them
+
+    Args:
+        args (Namespace): parsed arguments
+    """
+    _ignore_warnings()
+    start = time.perf_counter()
+
+    _enable_jit_cache()
+    import JitCache
+    from FeatureExtractor import FeatureExtractor
+
+    imported = time.perf_counter()
+
+    # Every resampler used by the project
+    for res_type in ["kaiser_best", "kaiser_fast"]:
+        fe = FeatureExtractor(segment_duration=args.segment_duration, use_cache=False, res_type=res_type)
+        print(f"{res_type}: {JitCache.warmup(fe):.2f}s")
+
+    print(f"Imports {imported - start:.2f}s, kernels cached in {os.environ['NUMBA_CACHE_DIR']}")
+
+
+def main(argv=()):
+    """Runs every stage one after the other with default arguments: collect, download and extract
+
+    Args:
+        argv (list(str), optional): options given before any command, e.g. `--metrics`. Defaults to ().
+    """
+    argv = list(argv)
+
+    # Stage timings, counters and errors of every step, written to metrics.json (use a .prom path for Prometheus)
+    metrics = _make_metrics(parse_args(argv))
+
+    collect(parse_args([*argv, "collect"]), metrics)
+    download(parse_args([*argv, "download"]), metrics)
+    extract(parse_args([*argv, "extract"]), metrics)
+
+
+def parse_args(argv):
+    """Parses command line arguments
+
+    Args:
+        argv (list(str)): arguments, without the program name
+
+    Returns:
+        Namespace: parsed arguments, `command` being None if no command was given
+    """
+    parser = argparse.ArgumentParser(description="Music genre classification pipeline. Without a command, runs collect, download and extract")
+    parser.add_argument("--metrics", default="metrics.json", help="file metrics are written to, in Prometheus format if it ends with .prom")
+    parser.add_argument("--segment-duration", type=int, default=30, help="duration of segments in seconds")
+    parser.add_argument("--stream", action="store_true", help="same as the stream command")
+
+    commands = parser.add_subparsers(dest="command")
+
+    def add_collection_args(command):
+        command.add_argument("--genres", nargs="+", default=GENRES, help="Spotify genres")
+        command.add_argument("--amount", type=int, default=50, help="number of songs of each genre")
+        command.add_argument("--keys", type=int, default=1, help="number of Youtube API keys in .env")
+
+    collect_parser = commands.add_parser("collect", help="fetch song names and urls")
+    add_collection_args(collect_parser)
+
+    download_parser = commands.add_parser("download", help="download and segment songs of the catalog")
+    download_parser.add_argument("--genres", nargs="+", default=GENRES)
+    download_parser.add_argument("--threads", type=int, default=10, help="download threads")
+    download_parser.add_argument("--segment-threads", type=int, help="segment threads. Defaults to the number of cores")
+    download_parser.add_argument("--queue-size", type=int, help="downloaded songs waiting to be segmented. Defaults to twice --segment-threads")
+
+    extract_parser = commands.add_parser("extract", help="extract features of segmented songs")
+    extract_parser.add_argument("--threads", type=int, default=10)
+    extract_parser.add_argument("--processes", type=int, default=0, help="worker processes, threads are used if 0")
+    extract_parser.add_argument("--format", default="both", choices=["csv", "columnar", "both"])
+    extract_parser.add_argument("--checkpoint-every", type=int, default=100, help="rows between two checkpoint shards")
+    extract_parser.add_argument("--columns", nargs="+", help="feature columns to extract, e.g. AE_Mean MFCC0_Std. Defaults to all 38")
+    extract_parser.add_argument("--model", help="extract only the columns this model was trained on")
+    extract_parser.add_argument("--memory-limit", help="keep memory of the process under this size, e.g. 2G. Defaults to no limit")
+
+    queue_path = os.path.join(ROOT_DIR, "queue", "queue.sqlite")
+
+    queue_parser = commands.add_parser("queue", help="queue segmented songs for workers on any number of machines")
+    queue_parser.add_argument("--queue", default=queue_path, help="work queue, on a directory shared by every worker")
+    queue_parser.add_argument("--item-size", type=int, default=20, help="songs of each work item")
+    queue_parser.add_argument("--lease", type=float, default=300, help="seconds before an item of a silent worker is leased again")
+    queue_parser.add_argument("--attempts", type=int, default=3, help="leases of an item before it is given up")
+    queue_parser.add_argument("--format", default="both", choices=["csv", "columnar", "both"])
+    queue_parser.add_argument("--columns", nargs="+", help="feature columns to extract. Defaults to all 38")
+    queue_parser.add_argument("--model", help="extract only the columns this model was trained on")
+
+    work_parser = commands.add_parser("work", help="extract queued items till none is left")
+    work_parser.add_argument("--queue", default=queue_path)
+    work_parser.add_argument("--threads", type=int, default=4, help="songs extracted at once by each worker")
+    work_parser.add_argument("--processes", type=int, default=0, help="local worker processes, this process works if 0")
+    work_parser.add_argument("--song-dir", help="song directory if it is mounted elsewhere on this machine")
+
+    merge_parser = commands.add_parser("merge", help="merge shards of the queued items into data.csv and the dataset")
+    merge_parser.add_argument("--queue", default=queue_path)
+    merge_parser.add_argument("--force", action="store_true", help="merge even if items are still pending or leased")
+
+    frames_parser = commands.add_parser("frames", help="store frame level features of downloaded songs, and write a dataset per window duration")
+    frames_parser.add_argument("--windows", type=float, nargs="+", help="window durations in seconds, e.g. 10 30 60. Defaults to --segment-duration")
+    frames_parser.add_argument("--hop", type=float, help="seconds between the start of two windows. Defaults to the window duration")
+    frames_parser.add_argument("--store", default=os.path.join(ROOT_DIR, "frames"), help="directory of the frame level features")
+    frames_parser.add_argument("--columns", nargs="+", help="feature columns to compute. Defaults to all 38")
+    frames_parser.add_argument("--threads", type=int, default=4, help="songs computed at once")
+
+    stream_parser = commands.add_parser("stream", help="run every stage at once, song by song")
+    add_collection_args(stream_parser)
+    stream_parser.add_argument("--threads", type=int, default=10, help="download threads")
+    stream_parser.add_argument("--extract-threads", type=int, default=10, help="threads of the feature extractor")
+    stream_parser.add_argument("--segment-threads", type=int, default=2, help="threads extracting downloaded songs")
+    stream_parser.add_argument("--queue-size", type=int, default=4, help="downloaded songs waiting to be extracted")
+    stream_parser.add_argument("--checkpoint-every", type=int, default=10, help="rows between two checkpoint shards")
+    stream_parser.add_argument("--memory-limit", help="keep memory of the process under this size, e.g. 2G. Defaults to no limit")
+
+    predict_parser = commands.add_parser("predict", help="print the genre of songs")
+    predict_parser.add_argument("songs", nargs="+", help="audio files")
+    predict_parser.add_argument("--model", default=os.path.join(ROOT_DIR, "ML", "genre_model.pkl"), help="pickled model or exported model directory")
+
+    commands.add_parser("warmup", help="compile and cache numba kernels once")
+
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    main()
+    args = parse_args(sys.argv[1:])
+
+    # python main.py --stream runs all stages at once, as before commands existed
+    if args.command is None and args.stream:
+        args = parse_args([argument for argument in sys.argv[1:] if argument != "--stream"] + ["stream"])
+
+    if args.command is None:
+        main(sys.argv[1:])
+    else:
+        {"collect": collect, "download": download, "extract": extract, "queue": queue, "work": work, "merge": merge, "frames": frames, "stream": stream, "predict": predict, "warmup": warmup}[args.command](args)
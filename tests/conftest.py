@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules import their siblings by name, as they do when run from their own directory
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+for directory in ["FeatureExtraction", "Deployment", "Monitoring"]:
+    sys.path.append(os.path.join(root_dir, directory))
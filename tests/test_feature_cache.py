@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+import pytest
+
+from FeatureCache import FeatureCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = FeatureCache(str(tmp_path / "feature_cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_hash_file_depends_on_content_only(tmp_path):
+    first, renamed, other = tmp_path / "a.mp3", tmp_path / "b.mp3", tmp_path / "c.mp3"
+    first.write_bytes(b"clip")
+    renamed.write_bytes(b"clip")
+    other.write_bytes(b"other clip")
+
+    assert FeatureCache.hash_file(str(first)) == FeatureCache.hash_file(str(renamed))
+    assert FeatureCache.hash_file(str(first)) != FeatureCache.hash_file(str(other))
+
+
+def test_make_params_key_ignores_order():
+    assert FeatureCache.make_params_key(frame_size=1024, hop_length=512) == FeatureCache.make_params_key(hop_length=512, frame_size=1024)
+
+
+def test_get_many_returns_hits_only(cache):
+    rows = np.arange(6, dtype=np.float32).reshape(2, 3)
+    cache.put_many(["a", "b"], "params", rows)
+
+    found = cache.get_many(["a", "b", "missing"], "params")
+
+    assert set(found) == {"a", "b"}
+    np.testing.assert_array_equal(found["a"], rows[0])
+    np.testing.assert_array_equal(found["b"], rows[1])
+    assert found["a"].dtype == np.float32
+
+
+def test_get_many_misses_other_params(cache):
+    cache.put_many(["a"], "params", np.ones((1, 3)))
+
+    assert cache.get_many(["a"], "other params") == {}
+
+
+def test_get_many_splits_large_lookups(cache):
+    hashes = [f"clip{i}" for i in range(1200)]
+    cache.put_many(hashes, "params", np.arange(1200, dtype=np.float32)[:, np.newaxis])
+
+    found = cache.get_many(hashes, "params")
+
+    assert len(found) == 1200
+    assert found["clip1100"][0] == 1100
+
+
+def test_put_many_replaces_entries(cache):
+    cache.put_many(["a"], "params", np.zeros((1, 3)))
+    cache.put_many(["a"], "params", np.ones((1, 3)))
+
+    np.testing.assert_array_equal(cache.get_many(["a"], "params")["a"], np.ones(3))
+    assert cache.params_keys() == {"params": 1}
+
+
+def test_evict_keeps_given_params(cache):
+    cache.put_many(["a", "b"], "old", np.zeros((2, 3)))
+    cache.put_many(["a"], "new", np.zeros((1, 3)))
+
+    assert cache.evict(["new"]) == 2
+    assert cache.params_keys() == {"new": 1}
+
+
+def test_evict_removes_unused_entries(cache):
+    cache.put_many(["a", "b"], "params", np.zeros((2, 3)))
+    time.sleep(0.05)
+    # Looking an entry up renews it
+    cache.get_many(["a"], "params")
+
+    assert cache.evict(["params"], unused_for=0.04) == 1
+    assert set(cache.get_many(["a", "b"], "params")) == {"a"}
@@ -0,0 +1,62 @@
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from FlatForest import FlatForest
+
+
+@pytest.fixture(scope="module")
+def data():
+    X, y = make_classification(n_samples=600, n_features=12, n_informative=8, n_classes=4, random_state=0)
+    labels = np.array(["blues", "jazz", "pop", "rock"])[y]
+    return X.astype(np.float32), labels
+
+
+def export(tmp_path, model, scaler, columns=None):
+    model_path = tmp_path / "model.pkl"
+    with open(model_path, "wb") as f:
+        pickle.dump({"model": model, "scaler": scaler, "columns": columns}, f)
+
+    return FlatForest.export(str(model_path), str(tmp_path / "model_flat"))
+
+
+def test_random_forest_parity(tmp_path, data):
+    X, y = data
+    scaler = StandardScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=25, max_depth=None, random_state=0, n_jobs=1).fit(scaler.transform(X), y)
+
+    artifact = FlatForest.load_artifact(export(tmp_path, model, scaler, [f"f{i}" for i in range(X.shape[1])]))
+    flat, flat_scaler = artifact["model"], artifact["scaler"]
+
+    np.testing.assert_array_equal(flat_scaler.transform(X), scaler.transform(X))
+    np.testing.assert_array_equal(flat.predict_proba(scaler.transform(X)), model.predict_proba(scaler.transform(X)))
+    np.testing.assert_array_equal(flat.predict(scaler.transform(X)), model.predict(scaler.transform(X)))
+    assert artifact["columns"] == [f"f{i}" for i in range(X.shape[1])]
+
+
+def test_xgboost_parity(tmp_path, data):
+    xgboost = pytest.importorskip("xgboost")
+    X, y = data
+    _, encoded = np.unique(y, return_inverse=True)
+    scaler = StandardScaler().fit(X)
+    model = xgboost.XGBClassifier(n_estimators=20, max_depth=4, n_jobs=1).fit(scaler.transform(X), encoded)
+
+    flat = FlatForest(export(tmp_path, model, scaler))
+
+    # Probabilities are equal up to float32 rounding of the margins
+    np.testing.assert_allclose(flat.predict_proba(scaler.transform(X)), model.predict_proba(scaler.transform(X)), atol=1e-5)
+    np.testing.assert_array_equal(flat.predict(scaler.transform(X)), model.predict(scaler.transform(X)))
+
+
+def test_bare_model_is_rejected(tmp_path, data):
+    X, y = data
+    model_path = tmp_path / "model.pkl"
+    with open(model_path, "wb") as f:
+        pickle.dump(RandomForestClassifier(n_estimators=2, random_state=0).fit(X, y), f)
+
+    with pytest.raises(ValueError):
+        FlatForest.export(str(model_path), str(tmp_path / "model_flat"))
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from FeatureExtractor import FeatureExtractor
+from FrameFeatureStore import FrameFeatureStore
+
+SAMPLE_RATE = 22050
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return FeatureExtractor(segment_duration=10, use_cache=False)
+
+
+@pytest.fixture(scope="module")
+def signal():
+    rng = np.random.default_rng(0)
+    t = np.arange(int(35.5 * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = 0.3 * np.sin(2 * np.pi * 440 * t) * (1 + 0.5 * np.sin(2 * np.pi * 0.5 * t)) + 0.05 * rng.standard_normal(len(t))
+    # A silent second, whose frames have no Band Energy Ratio
+    signal[12 * SAMPLE_RATE:13 * SAMPLE_RATE] = 0
+    return signal.astype(np.float32)
+
+
+@pytest.fixture
+def store(tmp_path, extractor, signal):
+    store = FrameFeatureStore(str(tmp_path / "frames"), extractor)
+    assert store.add("Rock", "song", signal, SAMPLE_RATE)
+    return store
+
+
+def direct_window_features(extractor, signal, window_duration, hop_duration):
+    """Mean and Standard Deviation of the frames of the whole song whose position falls in each full window, without prefix sums
+    """
+    frame_features = extractor.frame_level_features(signal[np.newaxis], SAMPLE_RATE)
+    window_length, hop = int(window_duration * SAMPLE_RATE), int(hop_duration * SAMPLE_RATE)
+
+    rows = []
+    for start in range(0, len(signal) - window_length + 1, hop):
+        row = []
+        for column in extractor.features[2:]:
+            name, statistic = column.rsplit("_", 1)
+            frame_hop = extractor.frame_hops[name]
+            # Frame counts of a hop group are cut to the shortest feature, as the store does
+            n_frames = min(frame_features[other].shape[-1] for other, other_hop in extractor.frame_hops.items() if other_hop == frame_hop)
+            values = frame_features[name][0, -(-start // frame_hop):min((start + window_length) // frame_hop + 1, n_frames)]
+            row.append(np.nanmean(values) if statistic == "Mean" else np.nanstd(values))
+        rows.append(row)
+
+    return np.array(rows)
+
+
+@pytest.mark.parametrize("window_duration, hop_duration", [(10, 10), (5, 2.5)])
+def test_windows_match_frames_of_the_song(store, extractor, signal, window_duration, hop_duration):
+    windows = store.window_features(store.songs[0], window_duration, hop_duration, keep_partial=False)
+
+    np.testing.assert_allclose(windows, direct_window_features(extractor, signal, window_duration, hop_duration), rtol=1e-4, atol=1e-4)
+
+
+def test_windows_match_segment_features(store, extractor, signal):
+    windows = store.window_features(store.songs[0], 10)
+    segments = extractor.extract_signal(signal, SAMPLE_RATE)
+
+    # Same windows as segments, including the shorter last one
+    assert windows.shape == segments.shape
+
+    # Frames at the edges of a segment see padding instead of the neighbouring samples, which mostly changes Standard Deviations
+    means = [i for i, column in enumerate(extractor.features[2:]) if column.endswith("_Mean")]
+    stds = [i for i, column in enumerate(extractor.features[2:]) if column.endswith("_Std")]
+    np.testing.assert_allclose(windows[:, means], segments[:, means], rtol=0.05, atol=0.05)
+    np.testing.assert_allclose(windows[:, stds], segments[:, stds], rtol=0.25, atol=0.05)
+
+
+def test_index_is_reloaded(store, extractor):
+    store.save()
+
+    reloaded = FrameFeatureStore(store.store_dir, extractor)
+
+    assert ("Rock", "song") in reloaded and len(reloaded) == 1
+    np.testing.assert_array_equal(reloaded.window_features(reloaded.songs[0], 10), store.window_features(store.songs[0], 10))
+
+
+def test_other_parameters_are_rejected(store):
+    store.save()
+
+    with pytest.raises(ValueError):
+        FrameFeatureStore(store.store_dir, FeatureExtractor(segment_duration=10, hop_length=256, use_cache=False))
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from FeatureExtractor import FeatureExtractor
+from RunningMoments import RunningMoments
+from StreamingExtractor import StreamingExtractor
+
+
+def test_batches_match_whole_array():
+    rng = np.random.default_rng(0)
+    # Large offset, where the naive sum of squares loses the variance
+    values = 1e4 + rng.standard_normal((1000, 4))
+    values[rng.random(values.shape) < 0.1] = np.nan
+
+    moments = RunningMoments(4)
+    for batch in np.array_split(values, [1, 7, 300, 301, 999]):
+        moments.update(batch)
+
+    np.testing.assert_allclose(moments.mean, np.nanmean(values, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(moments.std, np.nanstd(values, axis=0), rtol=1e-9)
+    np.testing.assert_array_equal(moments.count, np.isfinite(values).sum(axis=0))
+
+
+def test_column_subsets():
+    rng = np.random.default_rng(1)
+    first, second = rng.standard_normal((50, 2)), rng.standard_normal((80, 1))
+
+    moments = RunningMoments(3)
+    moments.update(first, [0, 2])
+    moments.update(second, [1])
+
+    np.testing.assert_allclose(moments.mean, [first[:, 0].mean(), second[:, 0].mean(), first[:, 1].mean()])
+    np.testing.assert_allclose(moments.std, [first[:, 0].std(), second[:, 0].std(), first[:, 1].std()])
+
+
+def test_features_without_values_are_nan():
+    moments = RunningMoments(2)
+    moments.update(np.empty((0, 2)))
+    moments.update(np.array([[1.0, np.nan], [3.0, np.nan]]))
+
+    assert moments.mean[0] == 2 and moments.std[0] == 1
+    assert np.isnan(moments.mean[1]) and np.isnan(moments.std[1])
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return FeatureExtractor(use_cache=False)
+
+
+@pytest.fixture(scope="module")
+def signal():
+    rng = np.random.default_rng(2)
+    t = np.arange(60 * 22050) / 22050
+    # Amplitude modulated tone in noise, so that every feature varies between frames
+    return (0.3 * np.sin(2 * np.pi * 440 * t) * (1 + 0.5 * np.sin(2 * np.pi * 0.5 * t)) + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def test_stream_does_not_depend_on_chunks(extractor, signal):
+    whole = StreamingExtractor(extractor)
+    whole.feed(signal)
+
+    chunked = StreamingExtractor(extractor)
+    for chunk in np.array_split(signal, 37):
+        chunked.feed(chunk)
+
+    np.testing.assert_allclose(chunked.features(), whole.features(), rtol=1e-5, atol=1e-5)
+
+
+def test_stream_matches_batch_features(extractor, signal):
+    stream = StreamingExtractor(extractor)
+    stream.feed(signal)
+
+    # Frames are not centered in the stream, which changes the few frames at the edges of the clip only
+    np.testing.assert_allclose(stream.features(), extractor.extract_features_batch(signal[np.newaxis], extractor.sample_rate)[0], rtol=0.05, atol=0.05)
+
+
+def test_stream_windows_cover_the_stream(extractor, signal):
+    stream = StreamingExtractor(extractor, window_duration=20)
+
+    windows = []
+    for chunk in np.array_split(signal, 10):
+        windows.extend(stream.feed(chunk))
+    windows.extend(stream.flush())
+
+    assert [(start, end) for start, end, _ in windows] == [(0, 20), (20, 40), (40, 60)]
+    for _, _, features in windows:
+        assert features.shape == (len(extractor.features) - 2,)
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+from WorkQueue import WorkQueue
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.sqlite")
+
+
+@pytest.fixture
+def queue(queue_path):
+    queue = WorkQueue(queue_path)
+    queue.reset([["a.mp3"], ["b.mp3"]], meta={"segment_duration": 30})
+    yield queue
+    queue.close()
+
+
+def test_claims_items_in_order_once(queue):
+    first, second = queue.claim("w1"), queue.claim("w2")
+
+    assert first[1] == ["a.mp3"] and second[1] == ["b.mp3"]
+    assert queue.claim("w3") is None
+    assert queue.counts() == {"pending": 0, "leased": 2, "done": 0, "failed": 0}
+    assert queue.get_meta("segment_duration") == 30
+
+
+def test_workers_of_other_connections_never_share_an_item(queue, queue_path):
+    other = WorkQueue(queue_path)
+
+    claimed = [queue.claim("w1"), other.claim("w2"), other.claim("w2")]
+    other.close()
+
+    assert sorted(item_id for item_id, _ in claimed[:2]) == [1, 2]
+    assert claimed[2] is None
+
+
+def test_complete(queue):
+    item_id, _ = queue.claim("w1")
+
+    assert not queue.complete(item_id, "w2", "shard")
+    assert queue.complete(item_id, "w1", "shard")
+    assert queue.get_items(["done"]) == [(item_id, "done", ["a.mp3"], "shard", None)]
+    assert not queue.is_finished()
+
+
+def test_expired_lease_is_claimed_again(queue_path):
+    queue = WorkQueue(queue_path, lease_seconds=0.05)
+    queue.reset([["a.mp3"]])
+
+    item_id, _ = queue.claim("w1")
+    assert queue.claim("w2") is None
+    time.sleep(0.1)
+
+    assert queue.claim("w2") == (item_id, ["a.mp3"])
+    # The worker whose lease expired can not complete the item anymore
+    assert not queue.renew(item_id, "w1")
+    assert not queue.complete(item_id, "w1")
+    assert queue.complete(item_id, "w2")
+    assert queue.is_finished()
+    queue.close()
+
+
+def test_renewed_lease_does_not_expire(queue_path):
+    queue = WorkQueue(queue_path, lease_seconds=0.2)
+    queue.reset([["a.mp3"]])
+
+    item_id, _ = queue.claim("w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.renew(item_id, "w1")
+
+    assert queue.claim("w2") is None
+    queue.close()
+
+
+def test_expired_leases_fail_after_max_attempts(queue_path):
+    queue = WorkQueue(queue_path, lease_seconds=0.05, max_attempts=2)
+    queue.reset([["a.mp3"]])
+
+    for worker in ["w1", "w2"]:
+        assert queue.claim(worker) is not None
+        time.sleep(0.1)
+
+    assert queue.claim("w3") is None
+    assert queue.get_items(["failed"])[0][4] == "lease expired"
+    assert queue.is_finished()
+    queue.close()
+
+
+def test_failed_item_is_retried_until_max_attempts(queue_path):
+    queue = WorkQueue(queue_path, max_attempts=2)
+    queue.reset([["a.mp3"]])
+
+    item_id, _ = queue.claim("w1")
+    assert queue.fail(item_id, "w1", "decode error")
+    assert queue.counts()["pending"] == 1
+
+    item_id, _ = queue.claim("w2")
+    assert not queue.fail(item_id, "w1", "not the holder")
+    assert queue.fail(item_id, "w2", "decode error")
+
+    assert queue.claim("w3") is None
+    assert queue.get_items() == [(item_id, "failed", ["a.mp3"], None, "decode error")]
+    queue.close()
+
+
+def test_reset_replaces_items(queue):
+    queue.claim("w1")
+    queue.reset([["c.mp3"]])
+
+    assert [payload for _, _, payload, _, _ in queue.get_items()] == [["c.mp3"]]
+    assert queue.get_meta("segment_duration", "missing") == "missing"